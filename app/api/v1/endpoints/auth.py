@@ -2,10 +2,13 @@ from fastapi import APIRouter, HTTPException, status, Depends
 from app.schemas.auth import UserRegister, UserLogin, Token
 from app.database import get_mongo_db
 from passlib.context import CryptContext
-from jose import jwt
+from jose import jwt, JWTError
 from datetime import datetime, timedelta
-from fastapi.security import OAuth2PasswordRequestForm
+from fastapi.security import OAuth2PasswordRequestForm, HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import EmailStr
+from typing import Optional
+from app.config import get_settings
+from app.services.tenancy import DEFAULT_NAMESPACE, namespace_for_claims
 import os
 
 from motor.motor_asyncio import AsyncIOMotorDatabase
@@ -18,6 +21,9 @@ pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
+settings = get_settings()
+bearer_scheme = HTTPBearer(auto_error=False)
+
 async def get_user_by_email(db: AsyncIOMotorDatabase, email: str):
     return await db["users"].find_one({"email": email})
 
@@ -34,6 +40,27 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+async def get_index_namespace(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer_scheme)
+) -> str:
+    """Index namespace of the caller's JWT; uploads and searches are confined to it"""
+    if settings.INDEX_PARTITION_BY == "none":
+        return DEFAULT_NAMESPACE
+    unauthorized = HTTPException(
+        status_code=401,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    if credentials is None:
+        raise unauthorized
+    try:
+        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        raise unauthorized
+    if not payload.get("sub"):
+        raise unauthorized
+    return namespace_for_claims(payload)
+
 @router.post("/register", response_model=Token)
 async def register(user: UserRegister, db: AsyncIOMotorDatabase = Depends(get_mongo_db)):
     existing = await get_user_by_email(db, user.email)
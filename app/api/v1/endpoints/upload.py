@@ -1,55 +1,120 @@
-from fastapi import APIRouter, UploadFile, File, BackgroundTasks, HTTPException, Depends
-from app.schemas.upload import UploadResponse, ProcessingStatus
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Request, Query
+from starlette.concurrency import run_in_threadpool
+from app.schemas.upload import UploadResponse, ProcessingStatus, DeleteResponse
 from app.database import get_mongo_db
+from app.config import get_settings
 from app.services.document_processor import document_processor
+from app.services.ingestion_queue import ingestion_queue, ACTIVE_STATUSES
+from app.services.tenancy import namespace_filter
+from app.api.v1.endpoints.auth import get_index_namespace
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from typing import Tuple
 from uuid import uuid4
 import os
+import hashlib
 from datetime import datetime
 
+settings = get_settings()
+
 router = APIRouter(prefix="/upload", tags=["upload"])
 
 UPLOAD_DIR = "data/uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
-async def save_file(file: UploadFile, file_id: str) -> str:
-    file_path = os.path.join(UPLOAD_DIR, f"{file_id}_{file.filename}")
-    with open(file_path, "wb") as f:
-        content = await file.read()
-        f.write(content)
-    return file_path
+def _too_large() -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"File exceeds the maximum upload size of {settings.UPLOAD_MAX_BYTES} bytes"
+    )
 
-async def process_document(file_id: str, file_path: str, filename: str, db: AsyncIOMotorDatabase):
-    """Process document with FAISS indexing and embeddings"""
+async def save_file(file: UploadFile, file_id: str) -> Tuple[str, int, str]:
+    """Stream the upload to disk in chunks; returns (path, size, sha256 hex digest).
+
+    Writes happen in the thread pool and the size limit is enforced as the
+    data arrives, so a large upload never sits in memory or blocks the loop.
+    """
+    file_path = os.path.join(UPLOAD_DIR, f"{file_id}_{file.filename}")
+    partial_path = file_path + ".part"
+    digest = hashlib.sha256()
+    size = 0
+    f = await run_in_threadpool(open, partial_path, "wb")
     try:
-        await document_processor.process_document(file_path, file_id, filename, db)
-    except Exception as e:
-        await db["uploads"].update_one(
-            {"file_id": file_id}, 
-            {"$set": {"status": "failed", "error": str(e), "processed_at": datetime.utcnow()}}
-        )
+        while True:
+            chunk = await file.read(settings.UPLOAD_CHUNK_BYTES)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > settings.UPLOAD_MAX_BYTES:
+                raise _too_large()
+            digest.update(chunk)
+            await run_in_threadpool(f.write, chunk)
+    except BaseException:
+        await run_in_threadpool(f.close)
+        await run_in_threadpool(os.remove, partial_path)
+        raise
+    await run_in_threadpool(f.close)
+    await run_in_threadpool(os.replace, partial_path, file_path)
+    return file_path, size, digest.hexdigest()
 
 @router.post("/", response_model=UploadResponse)
 async def upload_file(
-    background_tasks: BackgroundTasks,
+    request: Request,
     file: UploadFile = File(...),
+    priority: int = Query(0, ge=-10, le=10, description="Higher priorities are processed first"),
+    namespace: str = Depends(get_index_namespace),
     db: AsyncIOMotorDatabase = Depends(get_mongo_db)
 ):
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > settings.UPLOAD_MAX_BYTES + 64 * 1024:
+        # Clearly over the limit even allowing for multipart overhead
+        raise _too_large()
+    
     file_id = str(uuid4())
-    file_path = await save_file(file, file_id)
+    file_path, size, content_hash = await save_file(file, file_id)
+    
+    # Identical content that is indexed or being indexed is not processed again
+    existing = await db["uploads"].find_one({
+        "namespace": namespace,
+        "content_hash": content_hash,
+        "status": {"$in": ACTIVE_STATUSES}
+    })
+    if existing:
+        await run_in_threadpool(os.remove, file_path)
+        return UploadResponse(
+            file_id=existing["file_id"],
+            filename=existing.get("filename", file.filename),
+            status=existing.get("status", "queued"),
+            duplicate=True
+        )
+    
+    # A new version of a file replaces the old one once it has been indexed
+    previous = await db["uploads"].find(
+        {**namespace_filter(namespace), "filename": file.filename, "status": {"$in": ACTIVE_STATUSES}},
+        {"file_id": 1}
+    ).to_list(length=None)
+    replaces = [doc["file_id"] for doc in previous]
+    
     await db["uploads"].insert_one({
         "file_id": file_id,
         "filename": file.filename,
         "path": file_path,
-        "status": "processing",
-        "uploaded_at": datetime.utcnow()
+        "size": size,
+        "content_hash": content_hash,
+        "namespace": namespace,
+        "replaces": replaces,
+        "uploaded_at": datetime.utcnow(),
+        **ingestion_queue.new_job(priority)
     })
-    background_tasks.add_task(process_document, file_id, file_path, file.filename, db)
-    return UploadResponse(file_id=file_id, filename=file.filename, status="processing")
+    ingestion_queue.notify()
+    return UploadResponse(file_id=file_id, filename=file.filename, status="queued", replaces=replaces)
 
 @router.get("/status/{file_id}", response_model=ProcessingStatus)
-async def get_processing_status(file_id: str, db: AsyncIOMotorDatabase = Depends(get_mongo_db)):
-    doc = await db["uploads"].find_one({"file_id": file_id})
+async def get_processing_status(
+    file_id: str,
+    namespace: str = Depends(get_index_namespace),
+    db: AsyncIOMotorDatabase = Depends(get_mongo_db)
+):
+    doc = await db["uploads"].find_one({"file_id": file_id, **namespace_filter(namespace)})
     if not doc:
         raise HTTPException(status_code=404, detail="File not found")
     
@@ -60,17 +125,43 @@ async def get_processing_status(file_id: str, db: AsyncIOMotorDatabase = Depends
         chunks_count=doc.get("chunks_count"),
         text_length=doc.get("text_length"),
         error=doc.get("error"),
+        attempts=doc.get("attempts"),
         uploaded_at=doc.get("uploaded_at"),
         processed_at=doc.get("processed_at")
     )
 
 
+@router.delete("/{file_id}", response_model=DeleteResponse)
+async def delete_file(
+    file_id: str,
+    namespace: str = Depends(get_index_namespace),
+    db: AsyncIOMotorDatabase = Depends(get_mongo_db)
+):
+    """Remove an uploaded file and its chunks from the caller's index"""
+    doc = await db["uploads"].find_one_and_update(
+        {"file_id": file_id, **namespace_filter(namespace), "status": {"$ne": "deleted"}},
+        {"$set": {"status": "deleted", "deleted_at": datetime.utcnow(), "index_cleanup": "pending"}}
+    )
+    if not doc:
+        raise HTTPException(status_code=404, detail="File not found")
+    
+    if document_processor.read_only:
+        # The index-writing worker picks the deletion up from the flag
+        removed = None
+    else:
+        # Tombstones the file's rows; the rest of the index is untouched
+        removed = await run_in_threadpool(document_processor.delete_document, file_id, namespace)
+        await db["uploads"].update_one({"file_id": file_id}, {"$unset": {"index_cleanup": ""}})
+    path = doc.get("path")
+    if path and await run_in_threadpool(os.path.exists, path):
+        await run_in_threadpool(os.remove, path)
+    return DeleteResponse(file_id=file_id, status="deleted", chunks_removed=removed)
 
 @router.get("/index/stats")
-async def get_index_stats():
-    """Get statistics about the FAISS index"""
+async def get_index_stats(namespace: str = Depends(get_index_namespace)):
+    """Get statistics about the caller's FAISS index"""
     try:
-        stats = document_processor.get_index_stats()
+        stats = document_processor.get_index_stats(namespace)
         return stats
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get stats: {str(e)}") 
\ No newline at end of file
@@ -19,6 +19,94 @@ class Settings(BaseSettings):
     
     # OpenAI
     OPENAI_API_KEY: str = ""
+    EMBEDDING_MODEL: str = "text-embedding-ada-002"
+    
+    # Chat history
+    CHAT_HISTORY_WINDOW: int = 20  # recent messages kept per connection and sent as context
+    
+    # LLM concurrency and backpressure
+    LLM_MAX_CONCURRENCY: int = 16
+    LLM_MAX_QUEUE: int = 64
+    LLM_QUEUE_TIMEOUT_SECONDS: float = 10.0
+    WS_MAX_IN_FLIGHT_PER_CONNECTION: int = 1
+    
+    # Prompt budget (tokens counted with tiktoken, estimated when its files are unavailable)
+    LLM_CONTEXT_MAX_TOKENS: int = 2000  # retrieved passages, after merging overlapping chunks
+    LLM_HISTORY_MAX_TOKENS: int = 1000  # most recent chat messages that fit
+    LLM_HISTORY_MAX_MESSAGES: int = 10
+    TOKENIZER_LOAD_TIMEOUT_SECONDS: float = 10.0  # wait this long for tiktoken's files, then estimate
+    
+    # Uploads
+    UPLOAD_MAX_BYTES: int = 100 * 1024 * 1024
+    UPLOAD_CHUNK_BYTES: int = 1024 * 1024
+    
+    # Ingestion job queue
+    INGESTION_WORKERS: int = 2
+    INGESTION_MAX_ATTEMPTS: int = 3
+    INGESTION_RETRY_BACKOFF_SECONDS: float = 30.0
+    INGESTION_RETRY_BACKOFF_MAX_SECONDS: float = 600.0
+    INGESTION_LEASE_SECONDS: float = 120.0
+    INGESTION_POLL_SECONDS: float = 5.0
+    
+    # Document extraction (process pool)
+    EXTRACTION_WORKERS: int = 2
+    EXTRACTION_TIMEOUT_SECONDS: float = 300.0  # without producing a chunk batch
+    EXTRACTION_MEMORY_LIMIT_MB: int = 2048  # per worker, 0 disables the limit
+    EXTRACTION_WINDOW_CHARS: int = 200000  # text held by the splitter at a time
+    EXTRACTION_BATCH_CHUNKS: int = 256  # chunks embedded and indexed together
+    EXTRACTION_QUEUE_BATCHES: int = 2  # batches read ahead of embedding
+    
+    # Embedding scheduler
+    EMBEDDING_BATCH_MAX_TOKENS: int = 50000
+    EMBEDDING_BATCH_MAX_SIZE: int = 512
+    EMBEDDING_MAX_CONCURRENCY: int = 4
+    EMBEDDING_MAX_RETRIES: int = 6
+    EMBEDDING_COALESCE_MS: int = 20
+    
+    # Embedding cache
+    EMBEDDING_CACHE_ENABLED: bool = True
+    EMBEDDING_CACHE_PATH: str = "data/embedding_cache.sqlite3"
+    EMBEDDING_CACHE_MAX_ENTRIES: int = 100000
+    
+    # Query embedding / search result cache (in-process)
+    QUERY_CACHE_ENABLED: bool = True
+    QUERY_CACHE_TTL_SECONDS: int = 600
+    QUERY_CACHE_MAX_ENTRIES: int = 1024
+    QUERY_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    
+    # Answer cache: LLM answers reused for similar questions that retrieve the same chunks
+    ANSWER_CACHE_ENABLED: bool = True
+    ANSWER_CACHE_SIMILARITY: float = 0.95  # cosine similarity of the query embeddings
+    ANSWER_CACHE_TTL_SECONDS: int = 3600
+    ANSWER_CACHE_MAX_ENTRIES: int = 2048
+    
+    # Vector index
+    EMBEDDING_DIMENSION: int = 1536  # text-embedding-ada-002
+    FAISS_INDEX_TYPE: str = "flat"  # flat, ivf_flat or hnsw
+    FAISS_IVF_NLIST: int = 256
+    FAISS_IVF_NPROBE: int = 16
+    FAISS_IVF_MIN_TRAIN_SIZE: int = 0  # vectors before IVF/SQ8/PQ training; 0 means 39 per centroid
+    FAISS_HNSW_M: int = 32
+    FAISS_HNSW_EF_CONSTRUCTION: int = 200
+    FAISS_HNSW_EF_SEARCH: int = 64
+    FAISS_COMPRESSION: str = "none"  # none, fp16, sq8 or pq: how the index stores vectors
+    FAISS_PQ_M: int = 96  # PQ bytes per vector; must divide EMBEDDING_DIMENSION
+    FAISS_RERANK_FACTOR: int = 4  # compressed indexes re-score k * factor candidates at full precision
+    INDEX_PARTITION_BY: str = "none"  # none (one shared index) or user (or the JWT's workspace claim)
+    INDEX_PARTITION_IDLE_SECONDS: int = 1800
+    INDEX_MAX_LOADED_PARTITIONS: int = 64
+    INDEX_COMPACTION_MIN_SEGMENTS: int = 16
+    INDEX_COMPACTION_INTERVAL_SECONDS: int = 300
+    INDEX_PURGE_DELETED_RATIO: float = 0.1  # compact once this share of vectors belongs to deleted files
+    INDEX_WRITER: str = "auto"  # auto (first worker process to start writes), always or never
+    INDEX_REFRESH_SECONDS: float = 2.0  # how often read-only workers look for new index commits
+    
+    # Retrieval
+    SEARCH_MODE: str = "hybrid"  # vector, lexical (BM25, no embedding call) or hybrid (reciprocal rank fusion)
+    SEARCH_RRF_K: int = 60
+    SEARCH_HYBRID_CANDIDATES: int = 4  # each retriever returns k * this many candidates for fusion
+    SEARCH_EMBEDDING_TIMEOUT_SECONDS: float = 5.0  # fall back to lexical search when the query embedding is slower
+    SEARCH_FILTER_EXACT_MAX_ROWS: int = 20000  # filtered searches over fewer rows scan them exactly
     
     class Config:
         case_sensitive = True
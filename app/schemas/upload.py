@@ -1,11 +1,13 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime
 
 class UploadResponse(BaseModel):
     file_id: str
     filename: str
     status: str
+    duplicate: bool = False  # identical content was already uploaded; file_id is the original
+    replaces: List[str] = []  # earlier uploads of the same filename, removed once this one is indexed
 
 class ProcessingStatus(BaseModel):
     file_id: str
@@ -14,7 +16,13 @@ class ProcessingStatus(BaseModel):
     chunks_count: Optional[int] = None
     text_length: Optional[int] = None
     error: Optional[str] = None
+    attempts: Optional[int] = None
     uploaded_at: Optional[datetime] = None
     processed_at: Optional[datetime] = None
 
- 
\ No newline at end of file
+ 
+
+class DeleteResponse(BaseModel):
+    file_id: str
+    status: str
+    chunks_removed: Optional[int] = None  # None when another worker process removes them shortly
@@ -0,0 +1,137 @@
+import time
+import itertools
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Hashable, Optional, Set, Tuple
+
+import numpy as np
+
+
+def _normalize_question(question: str) -> str:
+    return " ".join(question.casefold().split())
+
+
+def _unit(vector: Optional[np.ndarray]) -> Optional[np.ndarray]:
+    if vector is None:
+        return None
+    vector = np.asarray(vector, dtype="float32").reshape(-1)
+    norm = float(np.linalg.norm(vector))
+    return vector / norm if norm else None
+
+
+@dataclass
+class _Entry:
+    namespace: str
+    grounding: Hashable
+    question: str
+    vector: Optional[np.ndarray]
+    answer: Dict[str, Any]
+    expires_at: float
+
+
+class AnswerCache:
+    """LLM answers reused for questions that mean the same thing.
+
+    An answer is reused when a new question was asked with the same
+    ``grounding`` (the retrieved chunk ids and anything else that shaped
+    the prompt, such as the chat history) at the same index version and
+    its query embedding has at least ``similarity_threshold`` cosine
+    similarity with the cached question's (without embeddings, when the
+    normalized text is equal). A namespace's
+    answers are dropped as soon as it is seen at a new index version. At
+    most ``max_entries`` answers are kept, least recently used first out,
+    each for ``ttl_seconds``.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, similarity_threshold: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        # (namespace, grounding) -> entries for that retrieval
+        self._by_grounding: Dict[Tuple[str, Hashable], Set[int]] = {}
+        self._versions: Dict[str, int] = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _remove(self, entry_id: int):
+        entry = self._entries.pop(entry_id)
+        key = (entry.namespace, entry.grounding)
+        ids = self._by_grounding[key]
+        ids.discard(entry_id)
+        if not ids:
+            del self._by_grounding[key]
+
+    def _check_version(self, namespace: str, version: int) -> bool:
+        """Drop the namespace's answers if its index has changed since they were stored.
+
+        Versions only grow, so False means the caller saw an index that has
+        since been replaced and must neither use nor store answers.
+        """
+        known = self._versions.get(namespace)
+        if known == version:
+            return True
+        if known is not None and version < known:
+            return False
+        stale = [entry_id for entry_id, entry in self._entries.items() if entry.namespace == namespace]
+        for entry_id in stale:
+            self._remove(entry_id)
+        self.invalidations += len(stale)
+        self._versions[namespace] = version
+        return True
+
+    def _matches(self, entry: _Entry, question: str, vector: Optional[np.ndarray]) -> bool:
+        if vector is not None and entry.vector is not None:
+            return float(np.dot(entry.vector, vector)) >= self.similarity_threshold
+        return entry.question == question
+
+    def get(self, namespace: str, version: int, grounding: Hashable, question: str,
+            query_vector: Optional[np.ndarray] = None) -> Optional[Dict[str, Any]]:
+        question = _normalize_question(question)
+        vector = _unit(query_vector)
+        now = time.monotonic()
+        with self._lock:
+            if not self._check_version(namespace, version):
+                self.misses += 1
+                return None
+            for entry_id in list(self._by_grounding.get((namespace, grounding), ())):
+                entry = self._entries[entry_id]
+                if entry.expires_at < now:
+                    self._remove(entry_id)
+                    continue
+                if self._matches(entry, question, vector):
+                    self._entries.move_to_end(entry_id)
+                    self.hits += 1
+                    return entry.answer
+            self.misses += 1
+            return None
+
+    def set(self, namespace: str, version: int, grounding: Hashable, question: str,
+            query_vector: Optional[np.ndarray], answer: Dict[str, Any]):
+        entry = _Entry(namespace, grounding, _normalize_question(question), _unit(query_vector),
+                       answer, time.monotonic() + self.ttl_seconds)
+        with self._lock:
+            if not self._check_version(namespace, version):
+                return
+            entry_id = next(self._ids)
+            self._entries[entry_id] = entry
+            self._by_grounding.setdefault((namespace, grounding), set()).add(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
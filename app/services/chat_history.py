@@ -0,0 +1,69 @@
+import logging
+from collections import deque
+from typing import Any, Deque, Dict, List
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING, DESCENDING
+from app.config import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+MESSAGES_COLLECTION = "chat_messages"
+LEGACY_COLLECTION = "chats"
+
+
+class ChatHistoryStore:
+    """Chat history stored one document per message.
+
+    Messages live in ``chat_messages`` with a ``(user_id, timestamp)`` index,
+    so loading the most recent ``window`` messages is an indexed, bounded
+    read no matter how long the conversation is. Users whose earlier history
+    is still in the old single ``chats`` document get the window topped up
+    from its last messages, read with a ``$slice`` projection; those are all
+    older than anything in ``chat_messages``.
+    """
+
+    def __init__(self, window: int):
+        self.window = window
+        self._indexed = set()
+
+    async def ensure_indexes(self, db: AsyncIOMotorDatabase):
+        if id(db) in self._indexed:
+            return
+        try:
+            await db[MESSAGES_COLLECTION].create_index(
+                [("user_id", ASCENDING), ("timestamp", DESCENDING)]
+            )
+            self._indexed.add(id(db))
+        except Exception as e:
+            logger.warning(f"Could not create chat history index: {e}")
+
+    async def load_window(self, db: AsyncIOMotorDatabase, user_id: str) -> Deque[Dict[str, Any]]:
+        """Most recent messages for a user, oldest first, capped at the window size"""
+        await self.ensure_indexes(db)
+        cursor = (
+            db[MESSAGES_COLLECTION]
+            .find({"user_id": user_id}, {"_id": 0, "user_id": 0})
+            .sort("timestamp", DESCENDING)
+            .limit(self.window)
+        )
+        messages: List[Dict[str, Any]] = await cursor.to_list(length=self.window)
+        messages.reverse()
+
+        missing = self.window - len(messages)
+        if missing > 0:
+            legacy = await db[LEGACY_COLLECTION].find_one(
+                {"user_id": user_id},
+                {"_id": 0, "messages": {"$slice": -missing}}
+            )
+            if legacy:
+                messages = legacy.get("messages", [])[-missing:] + messages
+
+        return deque(messages, maxlen=self.window)
+
+    async def append(self, db: AsyncIOMotorDatabase, user_id: str, message: Dict[str, Any]):
+        await db[MESSAGES_COLLECTION].insert_one({"user_id": user_id, **message})
+
+
+# Global instance
+chat_history_store = ChatHistoryStore(window=settings.CHAT_HISTORY_WINDOW)
@@ -0,0 +1,176 @@
+import os
+import json
+import mmap
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+
+OFFSETS_FILE = "offsets.npy"
+TEXT_FILE = "text.bin"
+META_IDS_FILE = "meta_ids.npy"
+METADATA_FILE = "metadata.json"
+
+
+def _save_durably(path: str, write):
+    with open(path, "wb") as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class ChunkStore:
+    """Read-only columnar chunk records, memory-mapped from disk.
+
+        chunks/
+            offsets.npy    int64[n + 1] byte offsets of each chunk in text.bin
+            text.bin       UTF-8 chunk contents back to back
+            meta_ids.npy   int32[n] index into the metadata table per chunk
+            metadata.json  interned metadata dicts (one per uploaded file)
+
+    Nothing is read until a row is requested, and the mapped pages are
+    shared through the page cache by every worker process.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, METADATA_FILE), "r", encoding="utf-8") as f:
+            self.metadata: List[Dict[str, Any]] = json.load(f)
+        self.offsets = np.load(os.path.join(path, OFFSETS_FILE), mmap_mode="r")
+        self._size = len(self.offsets) - 1
+        if self._size > 0:
+            self.meta_ids = np.load(os.path.join(path, META_IDS_FILE), mmap_mode="r")
+        else:
+            self.meta_ids = np.zeros(0, dtype="int32")
+        self._text = None
+        text_file = os.path.join(path, TEXT_FILE)
+        if os.path.getsize(text_file) > 0:
+            with open(text_file, "rb") as f:
+                self._text = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def content(self, row: int) -> str:
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        if self._text is None or start == end:
+            return ""
+        return self._text[start:end].decode("utf-8")
+
+    def __getitem__(self, row: int) -> Dict[str, Any]:
+        if row < 0:
+            row += self._size
+        if not 0 <= row < self._size:
+            raise IndexError(row)
+        return {
+            "content": self.content(row),
+            "metadata": dict(self.metadata[int(self.meta_ids[row])]),
+        }
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for row in range(self._size):
+            yield self[row]
+
+    def rows_where(self, predicate: Callable[[Dict[str, Any]], bool]) -> np.ndarray:
+        """Rows whose metadata satisfies ``predicate``, found through the metadata table alone"""
+        meta_ids = [i for i, metadata in enumerate(self.metadata) if predicate(metadata)]
+        if not meta_ids or self._size == 0:
+            return np.zeros(0, dtype="int64")
+        return np.flatnonzero(np.isin(self.meta_ids, meta_ids)).astype("int64")
+
+    @staticmethod
+    def write(path: str, records: Iterable[Dict[str, Any]]):
+        """Write records as a columnar chunk store, streaming the text blob"""
+        os.makedirs(path, exist_ok=True)
+        offsets = [0]
+        meta_ids = []
+        metadata_table = []
+        interned = {}
+        with open(os.path.join(path, TEXT_FILE), "wb") as text_file:
+            for record in records:
+                data = record["content"].encode("utf-8")
+                text_file.write(data)
+                offsets.append(offsets[-1] + len(data))
+                metadata = record.get("metadata") or {}
+                key = json.dumps(metadata, sort_keys=True, default=str)
+                if key not in interned:
+                    interned[key] = len(metadata_table)
+                    metadata_table.append(json.loads(key))
+                meta_ids.append(interned[key])
+            text_file.flush()
+            os.fsync(text_file.fileno())
+        _save_durably(
+            os.path.join(path, OFFSETS_FILE),
+            lambda f: np.save(f, np.asarray(offsets, dtype="int64")),
+        )
+        _save_durably(
+            os.path.join(path, META_IDS_FILE),
+            lambda f: np.save(f, np.asarray(meta_ids, dtype="int32")),
+        )
+        _save_durably(
+            os.path.join(path, METADATA_FILE),
+            lambda f: f.write(json.dumps(metadata_table).encode("utf-8")),
+        )
+
+
+class ChunkList:
+    """Sequence of chunk records: a memory-mapped base plus an in-memory tail.
+
+    Records appended since the last compaction live in ``tail``; everything
+    older is served lazily from the ``ChunkStore``. ``extended`` leaves the
+    list it is called on untouched, for lists that searches may be reading.
+    """
+
+    def __init__(self, base: Optional[ChunkStore] = None, tail: List[Dict[str, Any]] = None):
+        self.base = base
+        self.tail = tail if tail is not None else []
+
+    @property
+    def base_size(self) -> int:
+        return len(self.base) if self.base is not None else 0
+
+    def __len__(self) -> int:
+        return self.base_size + len(self.tail)
+
+    def __getitem__(self, row: int) -> Dict[str, Any]:
+        if row < 0:
+            row += len(self)
+        base_size = self.base_size
+        if row < base_size:
+            return self.base[row]
+        return self.tail[row - base_size]
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        if self.base is not None:
+            yield from self.base
+        yield from list(self.tail)
+
+    def append(self, record: Dict[str, Any]):
+        self.tail.append(record)
+
+    def extend(self, records: Iterable[Dict[str, Any]]):
+        self.tail.extend(records)
+
+    def extended(self, records: Iterable[Dict[str, Any]]) -> "ChunkList":
+        """A new list with ``records`` appended"""
+        return ChunkList(self.base, self.tail + list(records))
+
+    def rows_where(self, predicate: Callable[[Dict[str, Any]], bool]) -> np.ndarray:
+        """Sorted rows whose metadata satisfies ``predicate``"""
+        base_rows = self.base.rows_where(predicate) if self.base is not None else np.zeros(0, dtype="int64")
+        base_size = self.base_size
+        tail_rows = [
+            base_size + i for i, record in enumerate(self.tail)
+            if predicate(record.get("metadata") or {})
+        ]
+        return np.concatenate([base_rows, np.asarray(tail_rows, dtype="int64")])
+
+    def rows_for_file(self, file_id: str) -> np.ndarray:
+        return self.rows_where(lambda metadata: metadata.get("file_id") == file_id)
+
+    def snapshot(self) -> "ChunkList":
+        """Cheap point-in-time view for writing a compacted copy"""
+        return ChunkList(self.base, list(self.tail))
+
+    def rebase(self, base: ChunkStore, absorbed: int) -> "ChunkList":
+        """Swap in a compacted base that absorbed the first ``absorbed`` tail rows"""
+        return ChunkList(base, self.tail[absorbed:])
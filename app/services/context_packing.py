@@ -0,0 +1,174 @@
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.config import get_settings
+from app.services.tokens import count_tokens, truncate_to_tokens
+
+settings = get_settings()
+
+# Chunks of one file whose rows are not adjacent (another upload's batch was
+# indexed in between) are still merged when they share at least this much text
+MIN_MERGE_OVERLAP = 32
+# Shorter suffix/prefix matches between adjacent chunks are taken as coincidence, not splitter overlap
+MIN_TRIM_OVERLAP = 8
+# Tokens the chat API adds around each message
+MESSAGE_OVERHEAD_TOKENS = 4
+# A passage that does not fit is cut to the remaining budget, unless that is smaller than this
+MIN_PARTIAL_TOKENS = 64
+
+
+def _overlap(previous: str, following: str) -> int:
+    """Length of the longest suffix of ``previous`` that ``following`` starts with"""
+    for start in range(max(len(previous) - len(following), 0), len(previous) - MIN_TRIM_OVERLAP + 1):
+        if following.startswith(previous[start:]):
+            return len(previous) - start
+    return 0
+
+
+def _source_header(position: int, filename: str) -> str:
+    return f"Source {position} (from {filename}):\n"
+
+
+@dataclass
+class Passage:
+    """Search results from one file merged into a single run of text"""
+
+    filename: str
+    text: str
+    last_row: int
+    # Position of the best result in the search results; passages are packed in this order
+    rank: int
+    results: List[Dict[str, Any]] = field(default_factory=list)
+
+
+@dataclass
+class PackedPrompt:
+    context: str
+    sources: List[Dict[str, Any]]
+    history: List[Dict[str, Any]]
+    context_tokens: int
+    history_tokens: int
+    tokens_saved: int
+
+    def token_report(self) -> Dict[str, int]:
+        return {"context": self.context_tokens, "history": self.history_tokens, "saved": self.tokens_saved}
+
+
+class ContextPacker:
+    """Fits retrieved chunks and chat history into token budgets.
+
+    Chunks are split with an overlap, so results that are neighbours in a
+    file repeat each other's text; they are merged into one passage with the
+    repeated text kept once, and chunks of a file with identical text are
+    dropped. Identical text from different files is kept, so each file is
+    still cited.
+    Passages go into the context best first until ``context_max_tokens``;
+    history keeps the most recent messages (at most ``history_max_messages``)
+    that fit in ``history_max_tokens``.
+    """
+
+    def __init__(self, context_max_tokens: int, history_max_tokens: int, history_max_messages: int = 10,
+                 model: str = "gpt-3.5-turbo"):
+        self.context_max_tokens = context_max_tokens
+        self.history_max_tokens = history_max_tokens
+        self.history_max_messages = history_max_messages
+        self.model = model
+
+    def _tokens(self, text: str) -> int:
+        return count_tokens(text, self.model)
+
+    def merge(self, results: List[Dict[str, Any]]) -> List[Passage]:
+        """Merge overlapping and adjacent results of the same file, best passage first"""
+        by_file: Dict[Any, List[Tuple[int, Dict[str, Any]]]] = {}
+        seen = set()
+        for rank, result in enumerate(results):
+            file_id = result["metadata"].get("file_id")
+            if (file_id, result["content"]) in seen:
+                continue
+            seen.add((file_id, result["content"]))
+            by_file.setdefault(file_id, []).append((rank, result))
+
+        passages: List[Passage] = []
+        for file_results in by_file.values():
+            current: Optional[Passage] = None
+            for rank, result in sorted(file_results, key=lambda item: item[1].get("row", 0)):
+                content = result["content"]
+                row = result.get("row", 0)
+                if current is not None:
+                    overlap = _overlap(current.text, content)
+                    if row == current.last_row + 1 or overlap >= MIN_MERGE_OVERLAP:
+                        separator = "" if overlap else "\n"
+                        current.text += separator + content[overlap:]
+                        current.last_row = row
+                        current.rank = min(current.rank, rank)
+                        current.results.append(result)
+                        continue
+                    passages.append(current)
+                current = Passage(result["metadata"].get("filename", "unknown"), content, row, rank, [result])
+            passages.append(current)
+        return sorted(passages, key=lambda passage: passage.rank)
+
+    def _raw_tokens(self, results: List[Dict[str, Any]], chat_history: List[Dict[str, Any]]) -> int:
+        """Tokens of the prompt parts without packing: every chunk verbatim and the last messages"""
+        context = "\n".join(
+            _source_header(i, result["metadata"].get("filename", "unknown")) + result["content"] + "\n"
+            for i, result in enumerate(results, 1)
+        )
+        history = chat_history[-self.history_max_messages:] if self.history_max_messages else []
+        return (self._tokens(context) if context else 0) + sum(
+            self._tokens(msg.get("message", "")) + MESSAGE_OVERHEAD_TOKENS for msg in history
+        )
+
+    def pack_context(self, passages: List[Passage]) -> Tuple[str, List[Dict[str, Any]], int]:
+        """Context text within the budget, the results it includes and its token count"""
+        parts: List[str] = []
+        included: List[Dict[str, Any]] = []
+        used = 0
+        for passage in passages:
+            header = _source_header(len(parts) + 1, passage.filename)
+            part = header + passage.text + "\n"
+            tokens = self._tokens(part) + (1 if parts else 0)  # the joining newline
+            remaining = self.context_max_tokens - used
+            if tokens > remaining:
+                body_budget = remaining - self._tokens(header) - 2
+                if body_budget < MIN_PARTIAL_TOKENS:
+                    break
+                part = header + truncate_to_tokens(passage.text, body_budget, self.model) + "\n"
+                tokens = self._tokens(part) + (1 if parts else 0)
+                parts.append(part)
+                included.extend(passage.results)
+                used += tokens
+                break
+            parts.append(part)
+            included.extend(passage.results)
+            used += tokens
+        return "\n".join(parts), included, used
+
+    def pack_history(self, chat_history: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], int]:
+        """The most recent messages that fit in the history budget, oldest first, and their token count"""
+        kept: List[Dict[str, Any]] = []
+        used = 0
+        recent = chat_history[-self.history_max_messages:] if self.history_max_messages else []
+        for msg in reversed(recent):
+            tokens = self._tokens(msg.get("message", "")) + MESSAGE_OVERHEAD_TOKENS
+            if used + tokens > self.history_max_tokens:
+                break
+            kept.append(msg)
+            used += tokens
+        kept.reverse()
+        return kept, used
+
+    def pack(self, results: List[Dict[str, Any]], chat_history: Optional[List[Dict[str, Any]]]) -> PackedPrompt:
+        chat_history = chat_history or []
+        context, included, context_tokens = self.pack_context(self.merge(results))
+        history, history_tokens = self.pack_history(chat_history)
+        saved = max(self._raw_tokens(results, chat_history) - context_tokens - history_tokens, 0)
+        return PackedPrompt(context, included, history, context_tokens, history_tokens, saved)
+
+
+# Global instance
+context_packer = ContextPacker(
+    context_max_tokens=settings.LLM_CONTEXT_MAX_TOKENS,
+    history_max_tokens=settings.LLM_HISTORY_MAX_TOKENS,
+    history_max_messages=settings.LLM_HISTORY_MAX_MESSAGES,
+)
@@ -1,232 +1,226 @@
 import os
+import time
+import shutil
 import asyncio
-from typing import List, Dict, Any
-from pathlib import Path
+import threading
+from datetime import datetime
+from contextlib import aclosing, contextmanager
+from typing import List, Dict, Any, Iterator, Optional
 import logging
-import rdflib
-import json
-import xml.etree.ElementTree as ET
 
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_openai import OpenAIEmbeddings
 from langchain.docstore.document import Document
-import faiss
 import numpy as np
-import pickle
-import PyPDF2
-from docx import Document as DocxDocument
 from motor.motor_asyncio import AsyncIOMotorDatabase
 
 from app.config import get_settings
+from app.services.index_partition import IndexPartition
+from app.services.index_store import acquire_writer_lock
+from app.services.tenancy import DEFAULT_NAMESPACE, namespace_directory
+from app.services.search_filter import SearchFilter
+from app.services.embedding_cache import EmbeddingCache
+from app.services.cache import TTLCache
+from app.services.embedding_scheduler import EmbeddingScheduler
+from app.services.extraction import ExtractionPool, extract_text_from_file, stream_chunks
+from app.services.metrics import chat_stage_seconds, document_processing_seconds, document_stage_seconds
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
 
+
+class ReadOnlyIndexError(RuntimeError):
+    """The index was asked to change in a worker process that only reads it"""
+
+
 class DocumentProcessor:
-    def __init__(self):
+    def __init__(self, faiss_index_path: str = "data/faiss_index", documents_path: str = "data/documents.pkl"):
         if not settings.OPENAI_API_KEY:
             logger.warning("OpenAI API key not provided. Document processing will be limited.")
             self.embeddings = None
         else:
             self.embeddings = OpenAIEmbeddings(
                 openai_api_key=settings.OPENAI_API_KEY,
-                model="text-embedding-ada-002"
+                model=settings.EMBEDDING_MODEL,
+                # Retries and 429 backoff are handled by the embedding scheduler
+                max_retries=0
             )
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            length_function=len,
+        self.embedding_scheduler = EmbeddingScheduler(
+            self._embed_batch,
+            max_batch_tokens=settings.EMBEDDING_BATCH_MAX_TOKENS,
+            max_batch_size=settings.EMBEDDING_BATCH_MAX_SIZE,
+            max_concurrency=settings.EMBEDDING_MAX_CONCURRENCY,
+            max_retries=settings.EMBEDDING_MAX_RETRIES,
+            coalesce_seconds=settings.EMBEDDING_COALESCE_MS / 1000,
+            model=settings.EMBEDDING_MODEL
         )
-        self.faiss_index_path = "data/faiss_index"
-        self.documents_path = "data/documents.pkl"
+        if settings.EMBEDDING_CACHE_ENABLED:
+            self.embedding_cache = EmbeddingCache(
+                settings.EMBEDDING_CACHE_PATH,
+                model=settings.EMBEDDING_MODEL,
+                max_entries=settings.EMBEDDING_CACHE_MAX_ENTRIES
+            )
+        else:
+            self.embedding_cache = None
+        if settings.QUERY_CACHE_ENABLED:
+            self.query_embedding_cache = TTLCache(
+                settings.QUERY_CACHE_MAX_ENTRIES,
+                settings.QUERY_CACHE_TTL_SECONDS,
+                max_bytes=settings.QUERY_CACHE_MAX_BYTES
+            )
+            self.search_result_cache = TTLCache(
+                settings.QUERY_CACHE_MAX_ENTRIES,
+                settings.QUERY_CACHE_TTL_SECONDS,
+                max_bytes=settings.QUERY_CACHE_MAX_BYTES
+            )
+        else:
+            self.query_embedding_cache = None
+            self.search_result_cache = None
+        self.chunk_size = 1000
+        self.chunk_overlap = 200
+        # Parsing and splitting are CPU-bound; they run in worker processes
+        self.extraction_pool = ExtractionPool(
+            max_workers=settings.EXTRACTION_WORKERS,
+            timeout=settings.EXTRACTION_TIMEOUT_SECONDS,
+            memory_limit_mb=settings.EXTRACTION_MEMORY_LIMIT_MB,
+            queue_size=settings.EXTRACTION_QUEUE_BATCHES
+        )
+        self.faiss_index_path = faiss_index_path
+        self.documents_path = documents_path
+        # Tenant partitions live next to the default (pre-partitioning) index
+        self.tenants_path = os.path.join(self.faiss_index_path, "tenants")
         
         # Ensure directories exist
         os.makedirs(self.faiss_index_path, exist_ok=True)
         os.makedirs(os.path.dirname(self.documents_path), exist_ok=True)
         
-        # Initialize or load FAISS index
-        self.index = None
-        self.documents = []
-        self._load_index()
+        # One process (the first uvicorn worker to start, by default) owns
+        # ingestion, deletion and compaction; the others open the stores
+        # read-only and follow its commits with ``run_refresh_loop``
+        self._writer_lock = None
+        if settings.INDEX_WRITER == "always":
+            self.read_only = False
+        elif settings.INDEX_WRITER == "never":
+            self.read_only = True
+        else:
+            self._writer_lock = acquire_writer_lock(self.faiss_index_path)
+            self.read_only = self._writer_lock is None
+        logger.info(f"Index role: {'read-only' if self.read_only else 'writer'} (pid {os.getpid()})")
+        
+        # Loaded partitions by namespace; others are opened on first use
+        self.partitions: Dict[str, IndexPartition] = {}
+        self._partitions_lock = threading.Lock()
+        with self._use_partition(DEFAULT_NAMESPACE):
+            pass
 
-    def _load_index(self):
-        """Load existing FAISS index and documents"""
-        try:
-            index_file = os.path.join(self.faiss_index_path, "index.faiss")
-            if os.path.exists(index_file):
-                self.index = faiss.read_index(index_file)
-                logger.info(f"Loaded FAISS index with {self.index.ntotal} vectors")
-            else:
-                # Create new index (768 dimensions for OpenAI embeddings)
-                self.index = faiss.IndexFlatL2(1536)  # text-embedding-ada-002 dimension
-                logger.info("Created new FAISS index")
-                
-            if os.path.exists(self.documents_path):
-                with open(self.documents_path, 'rb') as f:
-                    self.documents = pickle.load(f)
-                logger.info(f"Loaded {len(self.documents)} document chunks")
-            else:
-                self.documents = []
-                
-        except Exception as e:
-            logger.error(f"Error loading FAISS index: {e}")
-            self.index = faiss.IndexFlatL2(1536)
-            self.documents = []
+    def _partition_path(self, namespace: str) -> str:
+        if namespace == DEFAULT_NAMESPACE:
+            return self.faiss_index_path
+        return os.path.join(self.tenants_path, namespace_directory(namespace))
 
-    def _save_index(self):
-        """Save FAISS index and documents"""
+    @contextmanager
+    def _use_partition(self, namespace: str) -> Iterator[IndexPartition]:
+        """Load the namespace's partition if needed and keep it from being evicted while in use"""
+        with self._partitions_lock:
+            partition = self.partitions.get(namespace)
+            if partition is None:
+                partition = IndexPartition(
+                    namespace,
+                    self._partition_path(namespace),
+                    legacy_documents_path=self.documents_path if namespace == DEFAULT_NAMESPACE else None,
+                    read_only=self.read_only
+                )
+                self.partitions[namespace] = partition
+            partition.pins += 1
         try:
-            index_file = os.path.join(self.faiss_index_path, "index.faiss")
-            faiss.write_index(self.index, index_file)
-            
-            with open(self.documents_path, 'wb') as f:
-                pickle.dump(self.documents, f)
-                
-            logger.info(f"Saved FAISS index with {self.index.ntotal} vectors")
-        except Exception as e:
-            logger.error(f"Error saving FAISS index: {e}")
+            yield partition
+        finally:
+            with self._partitions_lock:
+                partition.pins -= 1
+                partition.last_used = time.monotonic()
 
-    def extract_text_from_file(self, file_path: str) -> str:
-        """Extract text from various file formats"""
-        file_path = Path(file_path)
-        text = ""
-        
-        try:
-            if file_path.suffix.lower() == '.pdf':
-                text = self._extract_from_pdf(file_path)
-            elif file_path.suffix.lower() in ['.docx', '.doc']:
-                text = self._extract_from_docx(file_path)
-            elif file_path.suffix.lower() == '.txt':
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    text = f.read()
-            elif file_path.suffix.lower() in ['.rdf', '.nt', '.owl', '.xml']:
-                # Try RDF extraction first, fallback to generic XML if it fails
-                try:
-                    text = self._extract_from_rdf(file_path)
-                    if not text.strip():
-                        raise ValueError('No RDF triples extracted')
-                except Exception:
-                    text = self._extract_from_xml(file_path)
-            elif file_path.suffix.lower() == '.json':
-                text = self._extract_from_json(file_path)
-            else:
-                logger.warning(f"Unsupported file format: {file_path.suffix}")
-                return ""
-                
-        except Exception as e:
-            logger.error(f"Error extracting text from {file_path}: {e}")
-            return ""
-            
-        return text
+    def evict_idle_partitions(self, idle_seconds: float = None, max_loaded: int = None) -> int:
+        """Unload partitions idle for ``idle_seconds`` and the least recently used beyond ``max_loaded``"""
+        if idle_seconds is None:
+            idle_seconds = settings.INDEX_PARTITION_IDLE_SECONDS
+        if max_loaded is None:
+            max_loaded = settings.INDEX_MAX_LOADED_PARTITIONS
+        now = time.monotonic()
+        evicted = []
+        with self._partitions_lock:
+            idle = sorted(
+                (p for p in self.partitions.values() if p.pins == 0),
+                key=lambda p: p.last_used
+            )
+            overflow = len(self.partitions) - max_loaded
+            for partition in idle:
+                if overflow > 0 or now - partition.last_used >= idle_seconds:
+                    # Everything is already durable in the segment log
+                    del self.partitions[partition.namespace]
+                    evicted.append(partition.namespace)
+                    overflow -= 1
+        if evicted:
+            logger.info(f"Evicted {len(evicted)} idle index partitions")
+        return len(evicted)
 
-    def _extract_from_pdf(self, file_path: Path) -> str:
-        """Extract text from PDF file"""
-        text = ""
-        try:
-            with open(file_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                for page in pdf_reader.pages:
-                    text += page.extract_text() + "\n"
-        except Exception as e:
-            logger.error(f"Error reading PDF {file_path}: {e}")
-        return text
+    def compact_index(self, min_segments: int = None) -> int:
+        """Compact every loaded partition with at least ``min_segments`` segments
+        or with enough deleted rows to purge"""
+        if min_segments is None:
+            min_segments = settings.INDEX_COMPACTION_MIN_SEGMENTS
+        self._ensure_writer()
+        compacted = 0
+        for namespace in list(self.partitions):
+            with self._use_partition(namespace) as partition:
+                compacted += partition.compact(min_segments, settings.INDEX_PURGE_DELETED_RATIO)
+        return compacted
 
-    def _extract_from_docx(self, file_path: Path) -> str:
-        """Extract text from DOCX file"""
-        text = ""
-        try:
-            doc = DocxDocument(file_path)
-            for paragraph in doc.paragraphs:
-                text += paragraph.text + "\n"
-        except Exception as e:
-            logger.error(f"Error reading DOCX {file_path}: {e}")
-        return text
-
-    def _extract_from_rdf(self, file_path: Path) -> str:
-        """Extract readable text from RDF file using rdflib with rdfs:label support"""
-        RDFS_LABEL = rdflib.term.URIRef('http://www.w3.org/2000/01/rdf-schema#label')
-    
-        def get_label(term, g):
-            # Якщо це URI — шукаємо rdfs:label, інакше повертаємо простий label
-            if isinstance(term, rdflib.term.URIRef) or isinstance(term, rdflib.term.BNode):
-                # Спробуємо знайти rdfs:label для term
-                label = None
-                for _, _, lbl in g.triples((term, RDFS_LABEL, None)):
-                    label = str(lbl)
-                    break
-                if label:
-                    return label
-                else:
-                    # fallback — остання частина URI
-                    return str(term).split('/')[-1].split('#')[-1]
-            elif isinstance(term, rdflib.term.Literal):
-                return str(term)
-            else:
-                return str(term)
+    async def run_compaction_loop(self):
+        """Periodically compact segment logs and unload idle partitions in the background"""
+        loop = asyncio.get_event_loop()
+        while True:
+            await asyncio.sleep(settings.INDEX_COMPACTION_INTERVAL_SECONDS)
+            try:
+                await loop.run_in_executor(None, self.compact_index)
+                self.evict_idle_partitions()
+            except Exception as e:
+                logger.error(f"Error compacting FAISS index: {e}")
 
-        try:
-            g = rdflib.Graph()
-            g.parse(str(file_path))
-            lines = []
-            for subj, pred, obj in g:
-                subj_label = get_label(subj, g)
-                pred_label = get_label(pred, g)
-                obj_label = get_label(obj, g)
-                sentence = f"{subj_label} {pred_label} {obj_label}."
-                lines.append(sentence)
-            text = "\n".join(lines)
-        except Exception as e:
-            logger.error(f"Error reading RDF {file_path}: {e}")
-            text = ""
-        return text
+    def refresh_index(self) -> int:
+        """Pick up the writer's commits in every loaded partition; returns how many changed"""
+        refreshed = 0
+        for namespace in list(self.partitions):
+            with self._use_partition(namespace) as partition:
+                try:
+                    refreshed += partition.refresh()
+                except Exception as e:
+                    # Typically files the writer compacted away mid-read; the next round retries
+                    logger.warning(f"Could not refresh index '{namespace}': {e}")
+        return refreshed
 
-    def _extract_from_xml(self, file_path: Path) -> str:
-        """Extract all text content from a generic XML file by flattening the tree."""
-        try:
-            tree = ET.parse(file_path)
-            root = tree.getroot()
-            texts = []
-            def recurse(node):
-                if node.text and node.text.strip():
-                    texts.append(node.text.strip())
-                for child in node:
-                    recurse(child)
-            recurse(root)
-            return '\n'.join(texts)
-        except Exception as e:
-            logger.error(f"Error reading XML {file_path}: {e}")
-            return ""
-
-    def _extract_from_json(self, file_path: Path) -> str:
-        """Extract text from JSON file by flattening all key-value paths"""
-        def flatten_json(y, prefix=""):
-            out = []
-            def flatten(x, name=""):
-                if isinstance(x, dict):
-                    for k, v in x.items():
-                        new_name = f"{name}/{k}" if name else k
-                        flatten(v, new_name)
-                elif isinstance(x, list):
-                    for i, v in enumerate(x):
-                        new_name = f"{name}[{i}]" if name else str(i)
-                        flatten(v, new_name)
-                elif isinstance(x, str):
-                    out.append(f"{name}: {x}")
-            flatten(y, prefix)
-            return out
+    async def run_refresh_loop(self):
+        """Follow the writer's index commits and unload idle partitions (read-only workers)"""
+        loop = asyncio.get_event_loop()
+        while True:
+            await asyncio.sleep(settings.INDEX_REFRESH_SECONDS)
+            try:
+                await loop.run_in_executor(None, self.refresh_index)
+                self.evict_idle_partitions()
+            except Exception as e:
+                logger.error(f"Error refreshing FAISS index: {e}")
 
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            strings = flatten_json(data)
-            return '\n'.join(strings)
-        except Exception as e:
-            logger.error(f"Error reading JSON {file_path}: {e}")
-            return ""
+    def _ensure_writer(self):
+        if self.read_only:
+            raise ReadOnlyIndexError("This worker process serves a read-only copy of the index")
 
+    def extract_text_from_file(self, file_path: str) -> str:
+        """Extract text from various file formats (in the calling process)"""
+        return extract_text_from_file(file_path)
 
-    async def process_document(self, file_path: str, file_id: str, filename: str, db: AsyncIOMotorDatabase):
-        """Process a document: extract text, split, embed, and index"""
+    async def process_document(self, file_path: str, file_id: str, filename: str, db: AsyncIOMotorDatabase,
+                               namespace: str = DEFAULT_NAMESPACE, uploaded_at: Optional[datetime] = None):
+        """Process a document: extract text, split, embed, and index into the namespace's partition"""
+        self._ensure_writer()
+        started = time.perf_counter()
         try:
             logger.info(f"Starting processing for {filename}")
             
@@ -236,145 +230,278 @@ class DocumentProcessor:
                 {"$set": {"status": "processing", "processing_step": "extracting_text"}}
             )
             
-            # Extract text
-            text = self.extract_text_from_file(file_path)
-            if not text.strip():
+            # Chunks indexed by an earlier, failed attempt would otherwise be duplicated
+            await asyncio.get_event_loop().run_in_executor(None, self.delete_document, file_id, namespace)
+            
+            # Stream chunk batches out of the extraction pool; each batch is
+            # embedded and indexed (searchable) while the next one is read
+            metadata = {
+                "file_id": file_id,
+                "filename": filename,
+                "source": file_path
+            }
+            if uploaded_at is not None:
+                # Lets searches be restricted by upload date
+                metadata["uploaded_at"] = uploaded_at.isoformat()
+            text_length = 0
+            chunks_count = 0
+            batches = self.extraction_pool.stream(
+                stream_chunks, file_path, self.chunk_size, self.chunk_overlap,
+                settings.EXTRACTION_WINDOW_CHARS, settings.EXTRACTION_BATCH_CHUNKS, True
+            )
+            async with aclosing(batches):
+                async for chunks, text_length, timings in batches:
+                    for stage, seconds in timings.items():
+                        document_stage_seconds.observe(seconds, stage=stage)
+                    documents = [Document(page_content=chunk, metadata=dict(metadata)) for chunk in chunks]
+                    with document_stage_seconds.time(stage="embed"):
+                        embeddings = await self._generate_embeddings_async(chunks)
+                    
+                    # Add to FAISS index and append a segment for this batch only; the
+                    # segment's fsyncs (and any index training) stay off the event loop
+                    await asyncio.get_event_loop().run_in_executor(
+                        None, self._add_to_index, documents, embeddings, namespace
+                    )
+                    chunks_count += len(documents)
+                    
+                    # Update status
+                    await db["uploads"].update_one(
+                        {"file_id": file_id},
+                        {"$set": {"processing_step": "indexing", "chunks_count": chunks_count}}
+                    )
+            
+            if not chunks_count:
                 await db["uploads"].update_one(
                     {"file_id": file_id},
                     {"$set": {"status": "failed", "error": "No text could be extracted"}}
                 )
+                document_processing_seconds.observe(time.perf_counter() - started, outcome="empty")
                 return
             
-            # Update status
+            # Update status to completed, unless the upload was deleted meanwhile
             await db["uploads"].update_one(
-                {"file_id": file_id},
-                {"$set": {"processing_step": "splitting_text"}}
-            )
-            
-            # Split text into chunks
-            documents = self.text_splitter.create_documents(
-                [text],
-                metadatas=[{
-                    "file_id": file_id,
-                    "filename": filename,
-                    "source": file_path
-                }]
-            )
-            
-            # Update status
-            await db["uploads"].update_one(
-                {"file_id": file_id},
-                {"$set": {"processing_step": "generating_embeddings"}}
-            )
-            
-            # Generate embeddings
-            texts = [doc.page_content for doc in documents]
-            embeddings = await self._generate_embeddings_async(texts)
-            
-            # Update status
-            await db["uploads"].update_one(
-                {"file_id": file_id},
-                {"$set": {"processing_step": "indexing"}}
-            )
-            
-            # Add to FAISS index
-            self._add_to_index(documents, embeddings)
-            
-            # Save index
-            self._save_index()
-            
-            # Update status to completed
-            await db["uploads"].update_one(
-                {"file_id": file_id},
+                {"file_id": file_id, "status": "processing"},
                 {
                     "$set": {
                         "status": "processed",
                         "processing_step": "completed",
-                        "chunks_count": len(documents),
-                        "text_length": len(text)
+                        "chunks_count": chunks_count,
+                        "text_length": text_length
                     }
                 }
             )
             
-            logger.info(f"Successfully processed {filename} - {len(documents)} chunks created")
+            document_processing_seconds.observe(time.perf_counter() - started, outcome="processed")
+            logger.info(f"Successfully processed {filename} - {chunks_count} chunks created")
             
         except Exception as e:
+            # The ingestion queue records the failure and decides on a retry
+            document_processing_seconds.observe(time.perf_counter() - started, outcome="failed")
             logger.error(f"Error processing document {filename}: {e}")
-            await db["uploads"].update_one(
-                {"file_id": file_id},
-                {"$set": {"status": "failed", "error": str(e)}}
-            )
+            # Batches indexed before the failure must not stay searchable, whether the
+            # upload is retried, fails for good or was deleted or replaced meanwhile
+            try:
+                await asyncio.get_event_loop().run_in_executor(None, self.delete_document, file_id, namespace)
+            except Exception as cleanup_error:
+                logger.error(f"Could not remove the indexed chunks of {filename}: {cleanup_error}")
+            raise
+
+    async def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """Send one scheduler batch to the embeddings API"""
+        return await self.embeddings.aembed_documents(texts)
 
-    async def _generate_embeddings_async(self, texts: List[str]) -> List[List[float]]:
-        """Generate embeddings asynchronously"""
+    async def _generate_embeddings_async(self, texts: List[str], urgent: bool = False) -> List[List[float]]:
+        """Generate embeddings asynchronously, reusing cached vectors"""
         if not self.embeddings:
             raise ValueError("OpenAI API key not configured. Cannot generate embeddings.")
         
-        # OpenAI embeddings don't have native async support in langchain yet
-        # So we'll run it in a thread pool
+        # Urgent texts are search queries; they live in the in-process query cache
+        # so user questions are never written to the on-disk chunk cache
+        if not self.embedding_cache or urgent:
+            return await self.embedding_scheduler.embed(texts, urgent=urgent)
+        
         loop = asyncio.get_event_loop()
-        embeddings = await loop.run_in_executor(
-            None, self.embeddings.embed_documents, texts
-        )
+        embeddings = await loop.run_in_executor(None, self.embedding_cache.get_many, texts)
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            # Embed each distinct missing text once
+            missing_texts = list(dict.fromkeys(texts[i] for i in missing))
+            new_embeddings = await self.embedding_scheduler.embed(missing_texts, urgent=urgent)
+            await loop.run_in_executor(None, self.embedding_cache.put_many, missing_texts, new_embeddings)
+            by_text = dict(zip(missing_texts, new_embeddings))
+            for i in missing:
+                embeddings[i] = by_text[texts[i]]
+        logger.debug(f"Embedding cache: {len(texts) - len(missing)}/{len(texts)} hits")
         return embeddings
 
-    def _add_to_index(self, documents: List[Document], embeddings: List[List[float]]):
-        """Add documents and embeddings to FAISS index"""
+    def _add_to_index(self, documents: List[Document], embeddings: List[List[float]], namespace: str = DEFAULT_NAMESPACE):
+        """Add documents and embeddings to the namespace's FAISS index and persist them as a segment"""
+        self._ensure_writer()
         # Convert embeddings to numpy array
         embeddings_array = np.array(embeddings).astype('float32')
+        records = [
+            {"content": doc.page_content, "metadata": doc.metadata}
+            for doc in documents
+        ]
         
-        # Add to FAISS index
-        self.index.add(embeddings_array)
-        
-        # Store document metadata
-        for doc in documents:
-            self.documents.append({
-                "content": doc.page_content,
-                "metadata": doc.metadata
-            })
-
-    async def search_similar_documents(self, query: str, k: int = 5) -> List[Dict[str, Any]]:
-        """Search for similar documents using FAISS"""
+        with self._use_partition(namespace) as partition:
+            partition.add(embeddings_array, records)
+
+    def delete_document(self, file_id: str, namespace: str = DEFAULT_NAMESPACE) -> int:
+        """Remove a file's chunks from the namespace's index; returns the number removed"""
+        self._ensure_writer()
+        with self._use_partition(namespace) as partition:
+            return partition.delete_file(file_id)
+
+    @staticmethod
+    def _normalize_query(query: str) -> str:
+        return " ".join(query.casefold().split())
+
+    async def _embed_query(self, query: str) -> np.ndarray:
+        """Embed a search query, reusing the in-process query embedding cache"""
+        key = self._normalize_query(query)
+        if self.query_embedding_cache is not None:
+            cached = self.query_embedding_cache.get(key)
+            if cached is not None:
+                return cached
+        query_embedding = await self._generate_embeddings_async([query], urgent=True)
+        query_vector = np.array(query_embedding).astype('float32')
+        if self.query_embedding_cache is not None:
+            self.query_embedding_cache.set(key, query_vector, size=query_vector.nbytes)
+        return query_vector
+
+    def cached_query_vector(self, query: str) -> Optional[np.ndarray]:
+        """The query's embedding if a recent search computed it; never calls the embeddings API"""
+        if self.query_embedding_cache is None:
+            return None
+        return self.query_embedding_cache.get(self._normalize_query(query))
+
+    async def _embed_query_for_search(self, query: str) -> Optional[np.ndarray]:
+        """The query embedding, or None when the embeddings API is slow or unavailable"""
         try:
-            # Generate embedding for query
-            query_embedding = await self._generate_embeddings_async([query])
-            query_vector = np.array(query_embedding).astype('float32')
-            
-            # Search in FAISS index
-            scores, indices = self.index.search(query_vector, k)
-            
-            # Get matching documents
-            results = []
-            for i, (score, idx) in enumerate(zip(scores[0], indices[0])):
-                if idx < len(self.documents):
-                    doc = self.documents[idx]
-                    results.append({
-                        "content": doc["content"],
-                        "metadata": doc["metadata"],
-                        "similarity_score": float(score),
-                        "rank": i + 1
-                    })
+            return await asyncio.wait_for(self._embed_query(query), settings.SEARCH_EMBEDDING_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            logger.warning(f"Query embedding took over {settings.SEARCH_EMBEDDING_TIMEOUT_SECONDS}s; using lexical search")
+        except Exception as e:
+            logger.warning(f"Query embedding failed ({e}); using lexical search")
+        return None
+
+    @staticmethod
+    def _fuse(result_lists: List[List[Dict[str, Any]]], k: int) -> List[Dict[str, Any]]:
+        """Reciprocal rank fusion: a chunk scores 1 / (SEARCH_RRF_K + rank) in each list that has it.
+
+        The fused value goes in ``score``; ``similarity_score`` keeps the
+        chunk's L2 distance when the vector search found it.
+        """
+        fused: Dict[int, Dict[str, Any]] = {}
+        for results in result_lists:
+            for result in results:
+                entry = fused.setdefault(result["row"], {**result, "score": 0.0, "score_kind": "rrf"})
+                if result["similarity_score"] is not None:
+                    entry["similarity_score"] = result["similarity_score"]
+                entry["score"] += 1.0 / (settings.SEARCH_RRF_K + result["rank"])
+        ranked = sorted(fused.values(), key=lambda result: result["score"], reverse=True)[:k]
+        for rank, result in enumerate(ranked, 1):
+            result["rank"] = rank
+        return ranked
+
+    async def search_similar_documents(self, query: str, k: int = 5, namespace: str = DEFAULT_NAMESPACE,
+                                       mode: Optional[str] = None,
+                                       search_filter: Optional[SearchFilter] = None) -> List[Dict[str, Any]]:
+        """Search the namespace's documents for the chunks most relevant to the query.
+
+        ``mode`` (default ``SEARCH_MODE``) is ``vector`` (embedding similarity),
+        ``lexical`` (BM25, no embedding call) or ``hybrid`` (both, fused by
+        reciprocal rank). Vector and hybrid searches fall back to lexical
+        results when the query cannot be embedded in time. ``search_filter``
+        restricts both retrievers to matching files inside the index search.
+        """
+        mode = (mode or settings.SEARCH_MODE).lower()
+        try:
+            with self._use_partition(namespace) as partition:
+                # One snapshot for the whole search, so both retrievers see the same rows
+                snapshot = partition.snapshot
+                cache_key = (namespace, mode, self._normalize_query(query), k, search_filter, snapshot.version)
+                if self.search_result_cache is not None:
+                    cached = self.search_result_cache.get(cache_key)
+                    if cached is not None:
+                        return [dict(result) for result in cached]
+                
+                cacheable = True
+                query_vector = None
+                if mode != "lexical":
+                    with chat_stage_seconds.time(stage="embed_query"):
+                        query_vector = await self._embed_query_for_search(query)
+                with chat_stage_seconds.time(stage="search"):
+                    if mode == "lexical":
+                        results = snapshot.search_lexical(query, k, search_filter)
+                    elif query_vector is None:
+                        # Degraded answer; don't keep it once the API recovers
+                        results = snapshot.search_lexical(query, k, search_filter)
+                        cacheable = False
+                    elif mode == "vector":
+                        results = snapshot.search(query_vector, k, search_filter)
+                    else:
+                        candidates = k * settings.SEARCH_HYBRID_CANDIDATES
+                        results = self._fuse([
+                            snapshot.search(query_vector, candidates, search_filter),
+                            snapshot.search_lexical(query, candidates, search_filter),
+                        ], k)
             
-            return results
+            if self.search_result_cache is not None and cacheable:
+                size = sum(len(result["content"]) + 256 for result in results)
+                self.search_result_cache.set(cache_key, results, size=size)
+            return [dict(result) for result in results]
             
         except Exception as e:
             logger.error(f"Error searching documents: {e}")
             return []
 
-    def get_index_stats(self) -> Dict[str, Any]:
-        """Get statistics about the FAISS index"""
+    def index_version(self, namespace: str = DEFAULT_NAMESPACE) -> int:
+        """Version of the namespace's searchable index; it changes whenever search results may change"""
+        with self._use_partition(namespace) as partition:
+            return partition.version
+
+    def get_index_stats(self, namespace: Optional[str] = None) -> Dict[str, Any]:
+        """Get statistics about one namespace's FAISS index, or totals over the loaded partitions"""
+        if namespace is not None:
+            with self._use_partition(namespace) as partition:
+                index_stats = partition.stats()
+        else:
+            partitions = list(self.partitions.values())
+            snapshots = [p.snapshot for p in partitions]
+            index_stats = {
+                "total_vectors": sum(s.index.ntotal for s in snapshots),
+                "total_documents": sum(len(s.documents) for s in snapshots),
+                "pending_segments": sum(p.store.segment_count for p in partitions),
+                "partitions_loaded": len(partitions),
+            }
         return {
-            "total_vectors": self.index.ntotal,
-            "total_documents": len(self.documents),
-            "index_dimension": self.index.d,
-            "index_type": type(self.index).__name__
+            **index_stats,
+            "read_only": self.read_only,
+            "embedding_scheduler": self.embedding_scheduler.stats(),
+            "embedding_cache": self.embedding_cache.stats() if self.embedding_cache else None,
+            "query_embedding_cache": self.query_embedding_cache.stats() if self.query_embedding_cache is not None else None,
+            "search_result_cache": self.search_result_cache.stats() if self.search_result_cache is not None else None
         }
 
-    def clear_index(self):
-        """Clear all embeddings and documents from the FAISS index and memory."""
-        self.index = faiss.IndexFlatL2(1536)  # Reset to empty index
-        self.documents = []
-        self._save_index()
+    def clear_index(self, namespace: Optional[str] = None):
+        """Clear all embeddings and documents of one namespace, or of every namespace."""
+        self._ensure_writer()
+        if namespace is not None:
+            with self._use_partition(namespace) as partition:
+                partition.clear()
+            logger.info(f"FAISS index and document list of '{namespace}' cleared.")
+            return
+        with self._partitions_lock:
+            for partition in self.partitions.values():
+                partition.clear()
+            # Partitions that are not loaded are simply deleted
+            loaded = {os.path.basename(p.path) for p in self.partitions.values()}
+            if os.path.isdir(self.tenants_path):
+                for entry in os.listdir(self.tenants_path):
+                    if entry not in loaded:
+                        shutil.rmtree(os.path.join(self.tenants_path, entry), ignore_errors=True)
         logger.info("FAISS index and document list cleared.")
 
 # Global instance
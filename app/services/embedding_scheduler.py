@@ -0,0 +1,223 @@
+import asyncio
+import logging
+import random
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set
+
+import openai
+
+from app.services.tokens import count_tokens
+
+logger = logging.getLogger(__name__)
+
+EmbedBatch = Callable[[List[str]], Awaitable[List[List[float]]]]
+
+
+@dataclass
+class _Item:
+    text: str
+    tokens: int
+    future: asyncio.Future
+    urgent: bool = False
+
+
+def _is_rate_limit(error: Exception) -> bool:
+    return isinstance(error, openai.RateLimitError) or getattr(error, "status_code", None) == 429
+
+
+def _is_retryable(error: Exception) -> bool:
+    if _is_rate_limit(error):
+        return True
+    if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError, asyncio.TimeoutError)):
+        return True
+    status_code = getattr(error, "status_code", None)
+    return status_code is not None and status_code >= 500
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """Seconds the server asked us to wait, if it sent a Retry-After header"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    value = headers.get("retry-after")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class EmbeddingScheduler:
+    """Shared queue that batches embedding work across all in-flight uploads.
+
+    Texts from every caller are queued together and cut into batches bounded
+    by ``max_batch_tokens`` and ``max_batch_size``; a short coalescing window
+    lets small uploads share a request. At most ``max_concurrency`` batches
+    are sent at once. A 429 pauses the whole scheduler (honouring
+    Retry-After) and retries with exponential backoff, so a rate-limited
+    burst does not hammer the API. ``urgent`` texts (search queries) jump
+    the queue and skip the coalescing window.
+    """
+
+    def __init__(
+        self,
+        embed_batch: EmbedBatch,
+        max_batch_tokens: int = 50000,
+        max_batch_size: int = 512,
+        max_concurrency: int = 4,
+        max_retries: int = 6,
+        backoff_base: float = 1.0,
+        backoff_max: float = 60.0,
+        coalesce_seconds: float = 0.02,
+        model: Optional[str] = None,
+    ):
+        self.embed_batch = embed_batch
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.coalesce_seconds = coalesce_seconds
+        self.model = model
+        self.batches = 0
+        self.texts = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.in_flight = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pending: Deque[_Item] = deque()
+        self._tasks: Set[asyncio.Task] = set()
+
+    def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        # asyncio primitives are bound to one event loop
+        self._loop = loop
+        self._pending = deque()
+        self._tasks = set()
+        self._wakeup = asyncio.Event()
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._resume_at = 0.0
+        self._dispatcher = loop.create_task(self._dispatch())
+
+    async def embed(self, texts: List[str], urgent: bool = False) -> List[List[float]]:
+        """Embed texts, sharing batches and the concurrency budget with other callers"""
+        if not texts:
+            return []
+        self._ensure_started()
+        items = [
+            _Item(text, count_tokens(text, self.model), self._loop.create_future(), urgent)
+            for text in texts
+        ]
+        if urgent:
+            self._pending.extendleft(reversed(items))
+        else:
+            self._pending.extend(items)
+        self._wakeup.set()
+        return list(await asyncio.gather(*(item.future for item in items)))
+
+    @property
+    def queued(self) -> int:
+        return len(self._pending)
+
+    def _batch_is_full(self) -> bool:
+        tokens = 0
+        for count, item in enumerate(self._pending, 1):
+            tokens += item.tokens
+            if count >= self.max_batch_size or tokens >= self.max_batch_tokens:
+                return True
+        return False
+
+    def _take_batch(self) -> List[_Item]:
+        batch = []
+        tokens = 0
+        while self._pending and len(batch) < self.max_batch_size:
+            item = self._pending[0]
+            if item.future.done():
+                # The caller gave up (cancelled or failed elsewhere)
+                self._pending.popleft()
+                continue
+            if batch and tokens + item.tokens > self.max_batch_tokens:
+                break
+            batch.append(self._pending.popleft())
+            tokens += item.tokens
+        return batch
+
+    async def _wait_for_rate_limit(self):
+        delay = self._resume_at - self._loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _dispatch(self):
+        while True:
+            if not self._pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            if self.coalesce_seconds and not self._pending[0].urgent and not self._batch_is_full():
+                # Give other uploads a moment to queue work into the same request
+                await asyncio.sleep(self.coalesce_seconds)
+            await self._wait_for_rate_limit()
+            await self._semaphore.acquire()
+            batch = self._take_batch()
+            if not batch:
+                self._semaphore.release()
+                continue
+            task = self._loop.create_task(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[_Item]):
+        texts = [item.text for item in batch]
+        self.in_flight += 1
+        try:
+            attempt = 0
+            while True:
+                await self._wait_for_rate_limit()
+                try:
+                    vectors = await self.embed_batch(texts)
+                    if len(vectors) != len(texts):
+                        raise ValueError(f"Expected {len(texts)} embeddings, got {len(vectors)}")
+                    break
+                except Exception as e:
+                    if not _is_retryable(e) or attempt >= self.max_retries:
+                        logger.error(f"Embedding batch of {len(texts)} texts failed: {e}")
+                        for item in batch:
+                            if not item.future.done():
+                                item.future.set_exception(e)
+                        return
+                    delay = _retry_after(e)
+                    if delay is None:
+                        delay = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+                        delay *= 0.5 + random.random() / 2
+                    if _is_rate_limit(e):
+                        self.rate_limited += 1
+                        self._resume_at = max(self._resume_at, self._loop.time() + delay)
+                        logger.warning(f"Embedding API rate limited, pausing for {delay:.1f}s")
+                    else:
+                        logger.warning(f"Embedding batch failed ({e}), retrying in {delay:.1f}s")
+                        await asyncio.sleep(delay)
+                    attempt += 1
+                    self.retries += 1
+            self.batches += 1
+            self.texts += len(texts)
+            for item, vector in zip(batch, vectors):
+                if not item.future.done():
+                    item.future.set_result(vector)
+        finally:
+            for item in batch:
+                if not item.future.done():
+                    item.future.cancel()
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued_texts": self.queued,
+            "in_flight_batches": self.in_flight,
+            "batches": self.batches,
+            "texts": self.texts,
+            "retries": self.retries,
+            "rate_limited": self.rate_limited,
+        }
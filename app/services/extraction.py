@@ -0,0 +1,537 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import re
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from queue import Empty, Full
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import rdflib
+import PyPDF2
+from docx import Document as DocxDocument
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+
+# Extraction runs in worker processes, so everything below is a plain
+# module-level function that can be pickled by reference.
+
+def iter_text_blocks(file_path: str) -> Iterator[str]:
+    """Yield a file's text in blocks (pages, paragraphs or pieces) as it is read.
+
+    PDF, DOCX, plain text and N-Triples/N-Quads are read incrementally; the
+    remaining formats are parsed whole and yielded as a single block.
+    """
+    file_path = Path(file_path)
+    suffix = file_path.suffix.lower()
+
+    if suffix == '.pdf':
+        yield from _iter_pdf_pages(file_path)
+    elif suffix in ['.docx', '.doc']:
+        yield from _iter_docx_paragraphs(file_path)
+    elif suffix == '.txt':
+        yield from _iter_text_file(file_path)
+    elif suffix in ['.nt', '.nq']:
+        yield from _iter_ntriples(file_path)
+    elif suffix in ['.rdf', '.owl', '.xml']:
+        # Try RDF extraction first, fallback to generic XML if it fails
+        try:
+            text = _extract_from_rdf(file_path)
+            if not text.strip():
+                raise ValueError('No RDF triples extracted')
+        except MemoryError:
+            raise
+        except Exception:
+            text = _extract_from_xml(file_path)
+        if text:
+            yield text
+    elif suffix == '.json':
+        text = _extract_from_json(file_path)
+        if text:
+            yield text
+    else:
+        logger.warning(f"Unsupported file format: {file_path.suffix}")
+
+def extract_text_from_file(file_path: str) -> str:
+    """Extract text from various file formats"""
+    try:
+        return "".join(iter_text_blocks(file_path))
+    except MemoryError:
+        raise
+    except Exception as e:
+        logger.error(f"Error extracting text from {file_path}: {e}")
+        return ""
+
+def _iter_pdf_pages(file_path: Path) -> Iterator[str]:
+    """Yield the text of a PDF file page by page"""
+    try:
+        with open(file_path, 'rb') as file:
+            pdf_reader = PyPDF2.PdfReader(file)
+            for page in pdf_reader.pages:
+                yield page.extract_text() + "\n"
+    except MemoryError:
+        raise
+    except Exception as e:
+        logger.error(f"Error reading PDF {file_path}: {e}")
+
+def _iter_docx_paragraphs(file_path: Path) -> Iterator[str]:
+    """Yield the text of a DOCX file paragraph by paragraph"""
+    try:
+        doc = DocxDocument(file_path)
+        for paragraph in doc.paragraphs:
+            yield paragraph.text + "\n"
+    except MemoryError:
+        raise
+    except Exception as e:
+        logger.error(f"Error reading DOCX {file_path}: {e}")
+
+def _iter_text_file(file_path: Path, block_size: int = 64 * 1024) -> Iterator[str]:
+    """Yield a UTF-8 text file in fixed-size pieces.
+
+    Undecodable bytes become U+FFFD; failing would only retry the same bytes.
+    """
+    with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            yield block
+
+RDFS_LABEL_IRI = 'http://www.w3.org/2000/01/rdf-schema#label'
+
+def _extract_from_rdf(file_path: Path) -> str:
+    """Extract readable text from RDF file using rdflib with rdfs:label support"""
+    RDFS_LABEL = rdflib.term.URIRef(RDFS_LABEL_IRI)
+
+    try:
+        g = rdflib.Graph()
+        g.parse(str(file_path))
+        # One pass over the label triples instead of a lookup per term
+        labels = {}
+        for subj, _, lbl in g.triples((None, RDFS_LABEL, None)):
+            labels.setdefault(subj, str(lbl))
+
+        def get_label(term):
+            # Якщо це URI — шукаємо rdfs:label, інакше повертаємо простий label
+            if isinstance(term, rdflib.term.URIRef) or isinstance(term, rdflib.term.BNode):
+                label = labels.get(term)
+                if label:
+                    return label
+                else:
+                    # fallback — остання частина URI
+                    return _local_name(str(term))
+            else:
+                return str(term)
+
+        lines = []
+        for subj, pred, obj in g:
+            sentence = f"{get_label(subj)} {get_label(pred)} {get_label(obj)}."
+            lines.append(sentence)
+        text = "\n".join(lines)
+    except MemoryError:
+        raise
+    except Exception as e:
+        logger.error(f"Error reading RDF {file_path}: {e}")
+        text = ""
+    return text
+
+def _local_name(iri: str) -> str:
+    return iri.split('/')[-1].split('#')[-1]
+
+# One N-Triples / N-Quads statement: subject, predicate, object and an
+# optional graph label. Literals keep their quotes so they can be told apart.
+_NT_BNODE = r'_:[A-Za-z0-9_\-.]*[A-Za-z0-9_\-]'
+_NT_TERM = rf'(<[^>]*>|{_NT_BNODE}|"(?:[^"\\]|\\.)*"(?:@[A-Za-z0-9-]+|\^\^<[^>]*>)?)'
+_NT_STATEMENT = re.compile(
+    rf'^\s*{_NT_TERM}\s*{_NT_TERM}\s*{_NT_TERM}(?:\s*(?:<[^>]*>|{_NT_BNODE}))?\s*\.\s*(?:#.*)?$'
+)
+_NT_LITERAL = re.compile(r'^"((?:[^"\\]|\\.)*)"')
+_NT_ESCAPE = re.compile(r'\\(?:u([0-9A-Fa-f]{4})|U([0-9A-Fa-f]{8})|(.))')
+_NT_ESCAPES = {'t': '\t', 'b': '\b', 'n': '\n', 'r': '\r', 'f': '\f', '"': '"', "'": "'", '\\': '\\'}
+
+def _unescape_literal(value: str) -> str:
+    if '\\' not in value:
+        return value
+
+    def replace(match):
+        code = match.group(1) or match.group(2)
+        if code:
+            return chr(int(code, 16))
+        return _NT_ESCAPES.get(match.group(3), match.group(3))
+
+    return _NT_ESCAPE.sub(replace, value)
+
+def _parse_statement(line: str) -> Optional[Tuple[str, str, str]]:
+    """Split an N-Triples/N-Quads line into its three terms, or None if it isn't one"""
+    line = line.strip()
+    if not line or line.startswith('#'):
+        return None
+    match = _NT_STATEMENT.match(line)
+    if not match:
+        return None
+    return match.group(1), match.group(2), match.group(3)
+
+def _term_text(term: str, labels: Dict[str, str]) -> str:
+    if term.startswith('"'):
+        return _unescape_literal(_NT_LITERAL.match(term).group(1))
+    label = labels.get(term)
+    if label:
+        return label
+    if term.startswith('<'):
+        return _local_name(term[1:-1])
+    return term[2:]  # blank node id
+
+def _iter_ntriples(file_path: Path, lines_per_block: int = 1000) -> Iterator[str]:
+    """Stream sentences from an N-Triples or N-Quads file without building a graph.
+
+    The first pass only collects ``rdfs:label`` values, so the label table
+    is the only thing held in memory; the second pass emits one sentence
+    per statement in file order.
+    """
+    label_predicate = f"<{RDFS_LABEL_IRI}>"
+    labels: Dict[str, str] = {}
+    with open(file_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if label_predicate not in line:
+                continue
+            statement = _parse_statement(line)
+            if statement and statement[1] == label_predicate and statement[2].startswith('"'):
+                labels.setdefault(statement[0], _term_text(statement[2], {}))
+
+    skipped = 0
+    sentences: List[str] = []
+    with open(file_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            statement = _parse_statement(line)
+            if statement is None:
+                if line.strip() and not line.lstrip().startswith('#'):
+                    skipped += 1
+                continue
+            subj, pred, obj = (_term_text(term, labels) for term in statement)
+            sentences.append(f"{subj} {pred} {obj}.")
+            if len(sentences) >= lines_per_block:
+                yield "\n".join(sentences) + "\n"
+                sentences = []
+    if sentences:
+        yield "\n".join(sentences) + "\n"
+    if skipped:
+        logger.warning(f"Skipped {skipped} malformed lines in {file_path}")
+
+def _extract_from_xml(file_path: Path) -> str:
+    """Extract all text content from a generic XML file by flattening the tree."""
+    try:
+        tree = ET.parse(file_path)
+        root = tree.getroot()
+        texts = []
+        def recurse(node):
+            if node.text and node.text.strip():
+                texts.append(node.text.strip())
+            for child in node:
+                recurse(child)
+        recurse(root)
+        return '\n'.join(texts)
+    except MemoryError:
+        raise
+    except Exception as e:
+        logger.error(f"Error reading XML {file_path}: {e}")
+        return ""
+
+def _extract_from_json(file_path: Path) -> str:
+    """Extract text from JSON file by flattening all key-value paths"""
+    def flatten_json(y, prefix=""):
+        out = []
+        def flatten(x, name=""):
+            if isinstance(x, dict):
+                for k, v in x.items():
+                    new_name = f"{name}/{k}" if name else k
+                    flatten(v, new_name)
+            elif isinstance(x, list):
+                for i, v in enumerate(x):
+                    new_name = f"{name}[{i}]" if name else str(i)
+                    flatten(v, new_name)
+            elif isinstance(x, str):
+                out.append(f"{name}: {x}")
+        flatten(y, prefix)
+        return out
+
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        strings = flatten_json(data)
+        return '\n'.join(strings)
+    except MemoryError:
+        raise
+    except Exception as e:
+        logger.error(f"Error reading JSON {file_path}: {e}")
+        return ""
+
+def iter_chunks(blocks: Iterable[str], chunk_size: int, chunk_overlap: int, window_chars: int) -> Iterator[str]:
+    """Split a stream of text blocks into chunks, holding about ``window_chars`` at a time.
+
+    Blocks are buffered into windows and each window is split on its own.
+    The last chunk of a window is not emitted yet: its text is carried into
+    the next window so chunks never end at an arbitrary window boundary.
+    """
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=len,
+    )
+    carry = ""
+    buffer: List[str] = []
+    buffered = 0
+    for block in blocks:
+        buffer.append(block)
+        buffered += len(block)
+        if buffered < window_chars:
+            continue
+        text = carry + "".join(buffer)
+        buffer, buffered = [], 0
+        chunks = splitter.split_text(text)
+        if not chunks:
+            carry = ""
+            continue
+        last = chunks.pop()
+        start = text.rfind(last)
+        carry = text[start:] if start >= 0 else last + "\n"
+        yield from chunks
+
+    text = carry + "".join(buffer)
+    if text.strip():
+        yield from splitter.split_text(text)
+
+def _put(queue: Any, cancel: Any, item: Any) -> bool:
+    """Put into a bounded queue, giving up if the consumer cancelled"""
+    while not cancel.is_set():
+        try:
+            queue.put(item, timeout=0.5)
+            return True
+        except Full:
+            continue
+    return False
+
+def stream_chunks(queue: Any, cancel: Any, file_path: str, chunk_size: int, chunk_overlap: int,
+                  window_chars: int, batch_size: int, timed: bool = False) -> int:
+    """Worker job: put ``(chunks, text_length_so_far)`` batches on ``queue`` as the file is read.
+
+    With ``timed`` each batch also carries ``{"extract": seconds, "split": seconds}``
+    spent reading the file and splitting its text since the previous batch.
+    Returns the total text length once the whole file has been streamed.
+    """
+    text_length = 0
+    extract_seconds = 0.0
+
+    def counted(blocks: Iterable[str]) -> Iterator[str]:
+        nonlocal text_length, extract_seconds
+        blocks = iter(blocks)
+        while True:
+            start = time.perf_counter()
+            block = next(blocks, None)
+            extract_seconds += time.perf_counter() - start
+            if block is None:
+                return
+            text_length += len(block)
+            yield block
+
+    def item(batch: List[str], started: float) -> Tuple:
+        nonlocal extract_seconds
+        if not timed:
+            return batch, text_length
+        elapsed = time.perf_counter() - started
+        timings = {"extract": extract_seconds, "split": max(elapsed - extract_seconds, 0.0)}
+        extract_seconds = 0.0
+        return batch, text_length, timings
+
+    batch: List[str] = []
+    started = time.perf_counter()
+    for chunk in iter_chunks(counted(iter_text_blocks(file_path)), chunk_size, chunk_overlap, window_chars):
+        batch.append(chunk)
+        if len(batch) >= batch_size:
+            if not _put(queue, cancel, item(batch, started)):
+                return text_length
+            batch = []
+            started = time.perf_counter()
+    if batch:
+        _put(queue, cancel, item(batch, started))
+    return text_length
+
+
+class ExtractionTimeoutError(Exception):
+    """Raised when an extraction job runs longer than the pool's timeout"""
+
+
+def _worker_died() -> MemoryError:
+    return MemoryError("Extraction worker died (memory limit exceeded or crashed)")
+
+
+_EMPTY = object()
+
+
+def _get_or_empty(queue: Any, timeout: float) -> Any:
+    try:
+        return queue.get(timeout=timeout)
+    except Empty:
+        return _EMPTY
+
+
+def _limit_worker_memory(memory_limit_mb: int):
+    if resource is None or not memory_limit_mb:
+        return
+    limit = memory_limit_mb * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+class ExtractionPool:
+    """Process pool for CPU-bound parsing, kept off the API event loop.
+
+    Each worker's address space is capped at ``memory_limit_mb`` so a
+    pathological file fails with ``MemoryError`` instead of taking the host
+    down. A job that runs past ``timeout`` seconds (for streamed jobs: that
+    goes ``timeout`` seconds without producing a batch) is abandoned by
+    killing the pool's workers; the pool is recreated for the next job, and
+    ``run`` jobs that only died as collateral are retried once.
+    """
+
+    def __init__(self, max_workers: int, timeout: Optional[float] = None, memory_limit_mb: int = 0,
+                 queue_size: int = 2):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.memory_limit_mb = memory_limit_mb
+        self.queue_size = queue_size
+        self.completed = 0
+        self.failed = 0
+        self.timed_out = 0
+        self.restarts = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._manager = None
+        self._generation = 0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                # Forking a process that runs Motor/FAISS threads is not safe
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_limit_worker_memory,
+                initargs=(self.memory_limit_mb,),
+            )
+        return self._executor
+
+    def _get_manager(self):
+        # Manager queues can be handed to pool jobs; plain multiprocessing
+        # queues can only be inherited by child processes
+        if self._manager is None:
+            self._manager = multiprocessing.get_context("spawn").Manager()
+        return self._manager
+
+    def _restart(self, generation: int):
+        """Kill the workers of ``generation`` unless that pool was already replaced"""
+        if generation != self._generation or self._executor is None:
+            return
+        executor = self._executor
+        self._executor = None
+        self._generation += 1
+        self.restarts += 1
+        for process in list((executor._processes or {}).values()):
+            process.kill()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """Run ``fn(*args)`` in a worker process and await its result"""
+        loop = asyncio.get_running_loop()
+        for attempt in range(2):
+            generation = self._generation
+            future = loop.run_in_executor(self._get_executor(), fn, *args)
+            try:
+                result = await asyncio.wait_for(future, timeout=self.timeout)
+            except asyncio.TimeoutError:
+                self.timed_out += 1
+                self._restart(generation)
+                raise ExtractionTimeoutError(f"Extraction timed out after {self.timeout}s")
+            except BrokenProcessPool:
+                # A worker died: our own job ran out of memory or crashed, or
+                # another job's timeout killed the pool under us
+                pool_replaced = generation != self._generation
+                self._restart(generation)
+                if pool_replaced and attempt == 0:
+                    continue
+                self.failed += 1
+                raise _worker_died()
+            except Exception:
+                self.failed += 1
+                raise
+            self.completed += 1
+            return result
+
+    async def stream(self, fn: Callable[..., Any], *args: Any) -> AsyncIterator[Any]:
+        """Run ``fn(queue, cancel, *args)`` in a worker and yield what it puts on ``queue``.
+
+        The queue holds at most ``queue_size`` items, so a worker that gets
+        ahead of the consumer blocks instead of buffering the whole file.
+        Closing the iterator early sets ``cancel`` and the worker stops.
+        """
+        loop = asyncio.get_running_loop()
+        manager = self._get_manager()
+        queue = manager.Queue(maxsize=self.queue_size)
+        cancel = manager.Event()
+        generation = self._generation
+        future = loop.run_in_executor(self._get_executor(), fn, queue, cancel, *args)
+        finished = False
+        try:
+            last_progress = loop.time()
+            while True:
+                item = await loop.run_in_executor(None, _get_or_empty, queue, 0.2)
+                if item is not _EMPTY:
+                    yield item
+                    last_progress = loop.time()
+                    continue
+                if future.done():
+                    if not queue.empty():
+                        continue
+                    try:
+                        future.result()
+                    except BrokenProcessPool:
+                        self._restart(generation)
+                        self.failed += 1
+                        raise _worker_died()
+                    except Exception:
+                        self.failed += 1
+                        raise
+                    finished = True
+                    self.completed += 1
+                    return
+                if self.timeout and loop.time() - last_progress > self.timeout:
+                    self.timed_out += 1
+                    self._restart(generation)
+                    raise ExtractionTimeoutError(f"Extraction made no progress for {self.timeout}s")
+        finally:
+            if not finished:
+                cancel.set()
+
+    def stats(self):
+        return {
+            "max_workers": self.max_workers,
+            "completed": self.completed,
+            "failed": self.failed,
+            "timed_out": self.timed_out,
+            "restarts": self.restarts,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        if self._manager is not None:
+            self._manager.shutdown()
+            self._manager = None
@@ -0,0 +1,354 @@
+import os
+import time
+import logging
+import itertools
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.services.vector_index import VectorIndex
+from app.services.index_store import IndexStore
+from app.services.chunk_store import ChunkList
+from app.services.lexical_index import LexicalIndex
+from app.services.search_filter import SearchFilter
+from app.services.metrics import document_stage_seconds, index_compaction_seconds
+
+logger = logging.getLogger(__name__)
+
+# Versions come from one process-wide counter so a partition that is evicted
+# and loaded again never reuses a version that cached results were keyed on
+_versions = itertools.count(1)
+
+
+class IndexSnapshot:
+    """One published version of a partition's vectors, chunk records and BM25 postings.
+
+    A published snapshot is never modified. Writers build the next one,
+    sharing whatever did not change, and publish it by replacing
+    ``IndexPartition.snapshot`` in a single assignment. A search reads that
+    reference once and so sees one consistent version throughout without
+    taking a lock: no vector without its chunk record, no half-cleared index.
+    """
+
+    def __init__(self, index: VectorIndex, documents: ChunkList, lexical: LexicalIndex,
+                 version: Optional[int] = None):
+        self.index = index
+        self.documents = documents
+        self.lexical = lexical
+        self.version = version if version is not None else next(_versions)
+        self._filter_rows: Dict[SearchFilter, np.ndarray] = {}
+
+    @classmethod
+    def empty(cls) -> "IndexSnapshot":
+        return cls(VectorIndex(), ChunkList(), LexicalIndex())
+
+    def appended(self, vectors: np.ndarray, records: List[Dict[str, Any]]) -> "IndexSnapshot":
+        return IndexSnapshot(
+            self.index.added(vectors),
+            self.documents.extended(records),
+            self.lexical.added(record["content"] for record in records),
+        )
+
+    def excluding(self, rows: np.ndarray) -> "IndexSnapshot":
+        return IndexSnapshot(self.index.excluding(rows), self.documents, self.lexical)
+
+    @property
+    def deleted_ratio(self) -> float:
+        return len(self.index.excluded) / self.index.ntotal if self.index.ntotal else 0.0
+
+    def _results(self, hits, score_kind: str) -> List[Dict[str, Any]]:
+        """Result dicts for (row, score) hits; ``similarity_score`` stays the L2 distance
+        (None without one) and ``score`` is the retriever's own score of ``score_kind``"""
+        results = []
+        for row, score in hits:
+            if 0 <= row < len(self.documents):
+                doc = self.documents[row]
+                results.append({
+                    "content": doc["content"],
+                    "metadata": doc["metadata"],
+                    "similarity_score": float(score) if score_kind == "l2_distance" else None,
+                    "score": float(score),
+                    "score_kind": score_kind,
+                    "rank": len(results) + 1,
+                    "row": int(row)
+                })
+        return results
+
+    def filter_rows(self, search_filter: SearchFilter) -> np.ndarray:
+        """Live rows matching the filter, resolved once per snapshot"""
+        rows = self._filter_rows.get(search_filter)
+        if rows is None:
+            rows = np.setdiff1d(self.documents.rows_where(search_filter.matches), self.index.excluded)
+            if len(self._filter_rows) >= 64:
+                self._filter_rows.clear()
+            self._filter_rows[search_filter] = rows
+        return rows
+
+    def search(self, query_vector: np.ndarray, k: int,
+               search_filter: Optional[SearchFilter] = None) -> List[Dict[str, Any]]:
+        """Nearest chunks by L2 distance (lower ``similarity_score`` is closer)"""
+        allowed = self.filter_rows(search_filter) if search_filter is not None else None
+        scores, indices = self.index.search(query_vector, k, allowed=allowed)
+        return self._results(zip(indices[0], scores[0]), "l2_distance")
+
+    def search_lexical(self, query: str, k: int,
+                       search_filter: Optional[SearchFilter] = None) -> List[Dict[str, Any]]:
+        """Best chunks by BM25 (higher ``score`` is better); needs no embedding"""
+        allowed = self.filter_rows(search_filter) if search_filter is not None else None
+        return self._results(self.lexical.search(query, k, self.index.excluded, allowed=allowed), "bm25")
+
+
+class IndexPartition:
+    """The vector index, chunk records and segment log of one namespace.
+
+    Each tenant's partition lives in its own directory with its own
+    ``IndexStore``, so searching it only touches that tenant's vectors.
+    Searches run on the current ``snapshot``; ingestion, deletes, refreshes
+    and compactions build the next snapshot and publish it atomically.
+    ``version`` changes whenever search results may change. ``pins`` counts
+    callers currently using the partition; the owner only evicts unpinned
+    partitions. Deleting a file tombstones its rows; they stay on disk
+    until a compaction rewrites the base without them. A ``read_only``
+    partition serves another process's writes and follows them with
+    ``refresh``.
+    """
+
+    def __init__(self, namespace: str, path: str, legacy_documents_path: Optional[str] = None,
+                 read_only: bool = False):
+        self.namespace = namespace
+        self.path = path
+        self.read_only = read_only
+        if not read_only:
+            os.makedirs(path, exist_ok=True)
+        self.snapshot = IndexSnapshot.empty()
+        self.pins = 0
+        self.last_used = time.monotonic()
+        # Serializes writers with each other and with the on-disk manifest;
+        # searches never take it
+        self._lock = threading.RLock()
+        self._compaction_lock = threading.Lock()
+        self.store = IndexStore(path, legacy_documents_path=legacy_documents_path, read_only=read_only)
+        self._load()
+
+    @property
+    def index(self) -> VectorIndex:
+        return self.snapshot.index
+
+    @property
+    def documents(self) -> ChunkList:
+        return self.snapshot.documents
+
+    @property
+    def lexical(self) -> LexicalIndex:
+        return self.snapshot.lexical
+
+    @property
+    def version(self) -> int:
+        return self.snapshot.version
+
+    def _load(self):
+        """Load the base snapshot and replay appended segments"""
+        try:
+            self.snapshot, migrated = self._read_state(self.store)
+            logger.info(f"Loaded FAISS index '{self.namespace}' with {self.index.ntotal} vectors ({self.index.kind}) "
+                        f"and {len(self.documents)} document chunks from {self.store.segment_count} segments")
+            if migrated and not self.read_only:
+                self.save()
+
+        except Exception as e:
+            logger.error(f"Error loading FAISS index '{self.namespace}': {e}")
+            self.snapshot = IndexSnapshot.empty()
+            if self.read_only:
+                # Makes the next refresh retry the load
+                self.store.manifest = {**self.store.manifest, "generation": -1}
+
+    @staticmethod
+    def _read_state(store: IndexStore) -> Tuple[IndexSnapshot, bool]:
+        """Snapshot of what is committed in ``store`` and whether the base needs compacting"""
+        index, documents, migrated = store.load()
+        index.set_excluded(store.load_tombstones())
+        base = store.open_base_lexical() if documents.base is not None else None
+        if base is not None and len(base) == documents.base_size:
+            lexical = LexicalIndex(base)
+            lexical.add(record["content"] for record in documents.tail)
+        else:
+            # A base written before it had BM25 postings gets them on the next compaction
+            lexical = LexicalIndex()
+            lexical.add(record["content"] for record in documents)
+            migrated = migrated or documents.base is not None
+        return IndexSnapshot(index, documents, lexical), migrated
+
+    def refresh(self) -> bool:
+        """Catch up with what the writing process committed since this copy was loaded.
+
+        New segments are added to the next snapshot; a new base or new
+        tombstones make it load the store again in the background and
+        publish the result. Returns True when anything changed.
+        """
+        current = self.store.manifest
+        manifest = self.store.read_manifest()
+        if manifest["generation"] == current["generation"]:
+            return False
+        seen = current["segments"]
+        if (manifest["base"] == current["base"] and manifest.get("tombstones") == current.get("tombstones")
+                and manifest["segments"][:len(seen)] == seen):
+            batches = [self.store.read_segment(name) for name in manifest["segments"][len(seen):]]
+            vectors = [batch_vectors for batch_vectors, _ in batches if len(batch_vectors)]
+            records = [record for _, batch_records in batches for record in batch_records]
+            with self._lock:
+                self.snapshot = self.snapshot.appended(
+                    np.vstack(vectors) if vectors else np.zeros((0, self.index.d), dtype="float32"), records
+                )
+                self.store.manifest = manifest
+            logger.info(f"Index '{self.namespace}' picked up {len(batches)} new segments")
+            return True
+
+        store = IndexStore(self.path, read_only=True)
+        snapshot, _ = self._read_state(store)
+        with self._lock:
+            self.store = store
+            self.snapshot = snapshot
+        logger.info(f"Index '{self.namespace}' reloaded at generation {store.manifest['generation']}")
+        return True
+
+    def add(self, embeddings_array: np.ndarray, records: List[Dict[str, Any]]):
+        """Add vectors and their chunk records and persist them as a segment"""
+        with self._lock:
+            with document_stage_seconds.time(stage="index"):
+                snapshot = self.snapshot.appended(embeddings_array, records)
+            with document_stage_seconds.time(stage="save"):
+                self.store.append_segment(embeddings_array, records)
+            self.snapshot = snapshot
+
+    def delete_file(self, file_id: str) -> int:
+        """Exclude a file's chunks from search; returns how many rows were deleted"""
+        with self._lock:
+            snapshot = self.snapshot
+            rows = np.setdiff1d(snapshot.documents.rows_for_file(file_id), snapshot.index.excluded)
+            if not len(rows):
+                return 0
+            tombstones = np.union1d(snapshot.index.excluded, rows)
+            self.store.write_tombstones(tombstones)
+            self.snapshot = snapshot.excluding(tombstones)
+        logger.info(f"Deleted {len(rows)} chunks of {file_id} from '{self.namespace}'")
+        return len(rows)
+
+    @property
+    def deleted_ratio(self) -> float:
+        return self.snapshot.deleted_ratio
+
+    def filter_rows(self, search_filter: SearchFilter) -> np.ndarray:
+        return self.snapshot.filter_rows(search_filter)
+
+    def search(self, query_vector: np.ndarray, k: int,
+               search_filter: Optional[SearchFilter] = None) -> List[Dict[str, Any]]:
+        return self.snapshot.search(query_vector, k, search_filter)
+
+    def search_lexical(self, query: str, k: int,
+                       search_filter: Optional[SearchFilter] = None) -> List[Dict[str, Any]]:
+        return self.snapshot.search_lexical(query, k, search_filter)
+
+    def save(self) -> bool:
+        """Write a full snapshot of the index and fold all segments into it"""
+        if not self._compaction_lock.acquire(blocking=False):
+            return False
+        try:
+            with self._lock:
+                snapshot = self.snapshot
+                tombstones = snapshot.index.excluded
+                tombstones_file = self.store.manifest.get("tombstones") if len(tombstones) else None
+                previous_base = self.store.manifest["base"]
+                segments = list(self.store.manifest["segments"])
+                base = self.store.new_base_name()
+
+            # The expensive work reads the published snapshot outside the lock,
+            # so ingestion and search keep going; segments appended meanwhile
+            # stay in the manifest
+            documents = snapshot.documents
+            if tombstones_file:
+                # Rebuild without the deleted rows; live rows keep their vectors
+                index = snapshot.index.without_rows(tombstones)
+                source = index
+                deleted = set(tombstones.tolist())
+                records = (record for row, record in enumerate(documents) if row not in deleted)
+            else:
+                index = snapshot.index.folded()
+                source = snapshot.index
+                records = documents
+            # A compressed index keeps its full-precision vectors next to it for re-ranking
+            exact = source.vector_blocks() if index.compressed else None
+            self.store.write_base(base, index.serialize(), records, exact)
+
+            with self._lock:
+                committed = self.store.commit_base(base, previous_base, segments, purged_tombstones=tombstones_file)
+                if committed and tombstones_file:
+                    # Rows moved, so reload the compacted base and the segments appended meanwhile
+                    self.snapshot, _ = self._read_state(self.store)
+                elif committed:
+                    self.snapshot = self._rebased(snapshot, index, base)
+            if committed:
+                logger.info(f"Saved FAISS index snapshot {base} of '{self.namespace}' with {len(documents)} chunks, "
+                            f"compacted {len(segments)} segments, purged {len(tombstones) if tombstones_file else 0} deleted rows")
+            else:
+                logger.info(f"Discarded FAISS index snapshot {base} of '{self.namespace}': index changed during compaction")
+            return committed
+        except Exception as e:
+            logger.error(f"Error saving FAISS index '{self.namespace}': {e}")
+            return False
+        finally:
+            self._compaction_lock.release()
+
+    def _rebased(self, compacted: IndexSnapshot, index: VectorIndex, base: str) -> IndexSnapshot:
+        """The current snapshot served from the base just written from ``compacted``.
+
+        ``index`` is the folded index that was written; rows added since
+        the compaction started are carried over from the current snapshot.
+        """
+        current = self.snapshot
+        index = index.with_exact(self.store.open_base_vectors(base))
+        added = np.arange(len(compacted.documents), current.index.ntotal)
+        if len(added):
+            index = index.added(current.index.reconstruct_rows(added))
+        documents = current.documents.rebase(self.store.open_base_chunks(base), len(compacted.documents.tail))
+        lexical = LexicalIndex(self.store.open_base_lexical())
+        lexical.add(record["content"] for record in documents.tail)
+        # Deltas folded into an exact flat index give the same results, so cached
+        # searches stay valid; training, compression or an approximate engine may not
+        unchanged = not compacted.index.deltas or (
+            (compacted.index.kind, compacted.index.compression_kind)
+            == (index.kind, index.compression_kind) == ("flat", "none"))
+        return IndexSnapshot(index.excluding(current.index.excluded), documents, lexical,
+                             version=current.version if unchanged else None)
+
+    def compact(self, min_segments: int, purge_ratio: float = 1.0) -> bool:
+        """Compact the segment log once it holds at least ``min_segments`` segments,
+        once deleted rows make up ``purge_ratio`` of the index, or once an index
+        that needs training has enough vectors for it"""
+        if self.store.segment_count == 0 or self.store.segment_count < min_segments:
+            if not self.index.training_due and (not len(self.index.excluded) or self.deleted_ratio < purge_ratio):
+                return False
+        start = time.perf_counter()
+        saved = self.save()
+        if saved:
+            index_compaction_seconds.observe(time.perf_counter() - start)
+        return saved
+
+    def clear(self):
+        with self._lock:
+            self.store.reset()
+            self.snapshot = IndexSnapshot.empty()
+
+    def stats(self) -> Dict[str, Any]:
+        snapshot = self.snapshot
+        return {
+            "total_vectors": snapshot.index.ntotal,
+            "total_documents": len(snapshot.documents),
+            "index_dimension": snapshot.index.d,
+            "pending_segments": self.store.segment_count,
+            "live_vectors": snapshot.index.ntotal - len(snapshot.index.excluded),
+            "delta_indexes": len(snapshot.index.deltas),
+            **snapshot.index.stats(),
+            **snapshot.lexical.stats(),
+            "index_version": snapshot.version,
+        }
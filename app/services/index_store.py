@@ -0,0 +1,355 @@
+import io
+import os
+import json
+import fcntl
+import shutil
+import logging
+import pickle
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from app.services.vector_index import VectorIndex
+from app.services.chunk_store import ChunkList, ChunkStore
+from app.services.lexical_index import LexicalStore
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "MANIFEST.json"
+SEGMENTS_DIR = "segments"
+WRITER_LOCK_FILE = "WRITER.lock"
+EXACT_VECTORS_FILE = "vectors.npy"
+
+
+def _fsync_dir(path: str):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _write_atomic(path: str, data: bytes):
+    """Write a file so that readers see either the old or the new content"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    _fsync_dir(os.path.dirname(path))
+
+
+def _write_vectors_atomic(path: str, blocks: List[np.ndarray], rows_per_copy: int = 16384):
+    """Write ``blocks`` as one float32 ``.npy`` array without holding it all in memory"""
+    tmp_path = f"{path}.tmp"
+    rows = sum(len(block) for block in blocks)
+    out = np.lib.format.open_memmap(tmp_path, mode="w+", dtype="float32", shape=(rows, blocks[0].shape[1]))
+    start = 0
+    for block in blocks:
+        for offset in range(0, len(block), rows_per_copy):
+            part = block[offset:offset + rows_per_copy]
+            out[start:start + len(part)] = part
+            start += len(part)
+    out.flush()
+    del out
+    with open(tmp_path, "rb+") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    _fsync_dir(os.path.dirname(path))
+
+
+def acquire_writer_lock(root: str) -> Optional[int]:
+    """Try to become the only process writing the stores under ``root``.
+
+    Returns the file descriptor holding the lock (released when the process
+    exits or the descriptor is closed), or None if another process has it.
+    """
+    os.makedirs(root, exist_ok=True)
+    fd = os.open(os.path.join(root, WRITER_LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return None
+    return fd
+
+
+class IndexStore:
+    """Append-only on-disk layout for the FAISS index and its chunk records.
+
+    Every processed document is written as its own segment (vectors + chunk
+    records) instead of rewriting the whole index. ``MANIFEST.json`` is the
+    commit point: a segment or base snapshot only exists once the manifest
+    names it, so files left behind by a crash are discarded on load.
+    Compaction folds the segments into a new base snapshot. Rows of deleted
+    files are listed in a tombstone file until a compaction drops them.
+
+        faiss_index/
+            MANIFEST.json
+            base-000004/index.faiss
+            base-000004/chunks/         columnar chunk store (see ChunkStore)
+            base-000004/lexical/        BM25 postings (see LexicalStore)
+            base-000004/vectors.npy     full-precision vectors, when the index is compressed
+            segments/seg-000005.npy
+            segments/seg-000005.jsonl
+            tomb-000006.npy             int64 row ids of deleted chunks
+
+    The store is not thread-safe; callers serialize access. Only one
+    process writes a store (see ``acquire_writer_lock``); others open it
+    ``read_only``, which memory-maps the base and never modifies the
+    directory, and call ``read_manifest`` to notice new commits.
+    """
+
+    def __init__(self, root: str, legacy_documents_path: Optional[str] = None, read_only: bool = False):
+        self.root = root
+        self.segments_path = os.path.join(root, SEGMENTS_DIR)
+        self.manifest_path = os.path.join(root, MANIFEST_FILE)
+        self.legacy_documents_path = legacy_documents_path
+        self.read_only = read_only
+        if not read_only:
+            os.makedirs(self.segments_path, exist_ok=True)
+        self.manifest = self._read_manifest()
+
+    def _empty_manifest(self) -> Dict[str, Any]:
+        return {"generation": 0, "next_seq": 1, "base": None, "segments": [], "tombstones": None}
+
+    def read_manifest(self) -> Dict[str, Any]:
+        """The manifest as currently committed on disk"""
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        return self._empty_manifest()
+
+    def _read_manifest(self) -> Dict[str, Any]:
+        if os.path.exists(self.manifest_path) or self.read_only:
+            return self.read_manifest()
+        manifest = self._empty_manifest()
+        return self._adopt_legacy_files(manifest)
+
+    def _ensure_writable(self):
+        if self.read_only:
+            raise RuntimeError(f"Index store {self.root} is open read-only")
+
+    def _write_manifest(self, manifest: Dict[str, Any]):
+        self._ensure_writable()
+        manifest = {**manifest, "generation": manifest["generation"] + 1}
+        _write_atomic(self.manifest_path, json.dumps(manifest).encode("utf-8"))
+        self.manifest = manifest
+
+    def _next_name(self, prefix: str) -> str:
+        self._ensure_writable()
+        seq = self.manifest["next_seq"]
+        self.manifest["next_seq"] = seq + 1
+        return f"{prefix}-{seq:06d}"
+
+    def _adopt_legacy_files(self, manifest: Dict[str, Any]) -> Dict[str, Any]:
+        """Move a pre-manifest index.faiss/documents.pkl pair into a base snapshot"""
+        legacy_index = os.path.join(self.root, "index.faiss")
+        legacy_documents = self.legacy_documents_path
+        has_index = os.path.exists(legacy_index)
+        has_documents = bool(legacy_documents) and os.path.exists(legacy_documents)
+        if not has_index and not has_documents:
+            return manifest
+        self.manifest = manifest
+        base = self._next_name("base")
+        base_path = os.path.join(self.root, base)
+        os.makedirs(base_path, exist_ok=True)
+        if has_index:
+            os.replace(legacy_index, os.path.join(base_path, "index.faiss"))
+        if has_documents:
+            os.replace(legacy_documents, os.path.join(base_path, "documents.pkl"))
+        self._write_manifest({**self.manifest, "base": base})
+        logger.info(f"Migrated legacy FAISS index files into {base}")
+        return self.manifest
+
+    def _segment_files(self, name: str) -> Tuple[str, str]:
+        return (
+            os.path.join(self.segments_path, f"{name}.npy"),
+            os.path.join(self.segments_path, f"{name}.jsonl"),
+        )
+
+    def _remove_unreferenced(self):
+        """Delete temp files, segments and bases that no manifest commit names"""
+        live_segments = set(self.manifest["segments"])
+        for entry in os.listdir(self.segments_path):
+            name = entry.rsplit(".", 1)[0]
+            if entry.endswith(".tmp") or name not in live_segments:
+                os.remove(os.path.join(self.segments_path, entry))
+        for entry in os.listdir(self.root):
+            path = os.path.join(self.root, entry)
+            if entry.startswith("base-") and entry != self.manifest["base"]:
+                shutil.rmtree(path, ignore_errors=True)
+            elif entry.startswith("tomb-") and entry != self.manifest.get("tombstones"):
+                os.remove(path)
+            elif entry.endswith(".tmp"):
+                os.remove(path)
+
+    @property
+    def segment_count(self) -> int:
+        return len(self.manifest["segments"])
+
+    def load(self) -> Tuple[VectorIndex, ChunkList, bool]:
+        """Load the base snapshot and replay committed segments.
+
+        Returns the index, the chunk records and whether the base had to be
+        migrated (a different index engine or a pickled chunk list) and so
+        should be compacted.
+        """
+        if not self.read_only:
+            self._remove_unreferenced()
+
+        index = None
+        documents = ChunkList()
+        migrated = False
+        base = self.manifest["base"]
+        if base:
+            index_file = os.path.join(self.root, base, "index.faiss")
+            chunks_path = os.path.join(self.root, base, "chunks")
+            legacy_documents_file = os.path.join(self.root, base, "documents.pkl")
+            if os.path.exists(index_file):
+                index = VectorIndex.load(index_file, memory_map=self.read_only,
+                                         exact_path=self._base_vectors_file(base))
+            if os.path.isdir(chunks_path):
+                documents = ChunkList(ChunkStore(chunks_path))
+            elif os.path.exists(legacy_documents_file):
+                # Pickled list from before the columnar store; rewritten on compaction
+                with open(legacy_documents_file, "rb") as f:
+                    documents = ChunkList(tail=pickle.load(f))
+                migrated = True
+        if index is None:
+            index = VectorIndex()
+        migrated = index.migrate() or migrated
+
+        valid_segments = []
+        for name in self.manifest["segments"]:
+            try:
+                vectors, records = self.read_segment(name)
+            except Exception as e:
+                if self.read_only:
+                    # Most likely compacted away by the writer meanwhile; the caller retries
+                    raise
+                logger.error(f"Dropping unreadable index segment {name}: {e}")
+                continue
+            if len(vectors):
+                index.add(vectors)
+            documents.extend(records)
+            valid_segments.append(name)
+
+        if valid_segments != self.manifest["segments"]:
+            self._write_manifest({**self.manifest, "segments": valid_segments})
+            self._remove_unreferenced()
+
+        return index, documents, migrated
+
+    def read_segment(self, name: str) -> Tuple[np.ndarray, List[Dict[str, Any]]]:
+        vectors_file, records_file = self._segment_files(name)
+        vectors = np.load(vectors_file)
+        with open(records_file, "r", encoding="utf-8") as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        if len(vectors) != len(records):
+            raise ValueError(f"{len(vectors)} vectors but {len(records)} records")
+        return vectors, records
+
+    def load_tombstones(self) -> np.ndarray:
+        """Sorted row ids of deleted chunks"""
+        name = self.manifest.get("tombstones")
+        if not name:
+            return np.zeros(0, dtype="int64")
+        return np.load(os.path.join(self.root, name)).astype("int64")
+
+    def write_tombstones(self, rows: np.ndarray) -> str:
+        """Durably replace the set of deleted row ids"""
+        name = f"{self._next_name('tomb')}.npy"
+        _write_atomic(os.path.join(self.root, name), _npy_bytes(np.asarray(rows, dtype="int64")))
+        self._write_manifest({**self.manifest, "tombstones": name})
+        self._remove_unreferenced()
+        return name
+
+    def append_segment(self, vectors: np.ndarray, records: List[Dict[str, Any]]) -> str:
+        """Durably append one batch of vectors and chunk records"""
+        name = self._next_name("seg")
+        vectors_file, records_file = self._segment_files(name)
+        vectors_bytes = _npy_bytes(np.asarray(vectors, dtype="float32"))
+        records_bytes = "".join(json.dumps(record, default=str) + "\n" for record in records).encode("utf-8")
+        _write_atomic(vectors_file, vectors_bytes)
+        _write_atomic(records_file, records_bytes)
+        self._write_manifest({**self.manifest, "segments": self.manifest["segments"] + [name]})
+        return name
+
+    def new_base_name(self) -> str:
+        return self._next_name("base")
+
+    def write_base(self, name: str, index_bytes: np.ndarray, documents: Iterable[Dict[str, Any]],
+                   vectors: Optional[List[np.ndarray]] = None):
+        """Write a base snapshot that is not yet committed to the manifest.
+
+        ``vectors`` are the full-precision vectors of a compressed index, in
+        row order. Only touches the new base directory, so it may run
+        without holding the caller's lock.
+        """
+        base_path = os.path.join(self.root, name)
+        os.makedirs(base_path, exist_ok=True)
+        _write_atomic(os.path.join(base_path, "index.faiss"), index_bytes.tobytes())
+        if vectors:
+            _write_vectors_atomic(os.path.join(base_path, EXACT_VECTORS_FILE), vectors)
+        chunks_path = os.path.join(base_path, "chunks")
+        ChunkStore.write(chunks_path, documents)
+        # Postings are built from the chunk store just written rather than a second pass over ``documents``
+        chunks = ChunkStore(chunks_path)
+        LexicalStore.write(os.path.join(base_path, "lexical"), (chunks.content(row) for row in range(len(chunks))))
+
+    def _base_vectors_file(self, name: str) -> Optional[str]:
+        path = os.path.join(self.root, name, EXACT_VECTORS_FILE)
+        return path if os.path.exists(path) else None
+
+    def open_base_vectors(self, name: str) -> Optional[np.ndarray]:
+        """Memory-mapped full-precision vectors of a base, or None if its index is not compressed"""
+        path = self._base_vectors_file(name)
+        return np.load(path, mmap_mode="r") if path else None
+
+    def open_base_chunks(self, name: str) -> ChunkStore:
+        return ChunkStore(os.path.join(self.root, name, "chunks"))
+
+    def open_base_lexical(self) -> Optional[LexicalStore]:
+        """Postings of the committed base, or None for bases written before they existed"""
+        base = self.manifest["base"]
+        if not base or not os.path.isdir(os.path.join(self.root, base, "lexical")):
+            return None
+        return LexicalStore(os.path.join(self.root, base, "lexical"))
+
+    def commit_base(self, name: str, previous_base: Optional[str], compacted_segments: List[str],
+                    purged_tombstones: Optional[str] = None) -> bool:
+        """Point the manifest at a new base and drop the segments it absorbed.
+
+        ``purged_tombstones`` names the tombstone file whose rows the new base
+        left out; it is cleared on commit. Returns False (and discards the new
+        base) if the store changed in a way the snapshot does not reflect,
+        e.g. it was reset or more rows were deleted meanwhile.
+        """
+        compacted = set(compacted_segments)
+        if (self.manifest["base"] != previous_base or not compacted.issubset(self.manifest["segments"])
+                or (purged_tombstones and self.manifest.get("tombstones") != purged_tombstones)):
+            shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+            return False
+        remaining = [segment for segment in self.manifest["segments"] if segment not in compacted]
+        tombstones = None if purged_tombstones else self.manifest.get("tombstones")
+        self._write_manifest({**self.manifest, "base": name, "segments": remaining, "tombstones": tombstones})
+        self._remove_unreferenced()
+        return True
+
+    def reset(self):
+        """Commit an empty manifest and remove every snapshot and segment"""
+        self._write_manifest({**self.manifest, "base": None, "segments": [], "tombstones": None})
+        self._remove_unreferenced()
+
+
+def _npy_bytes(array: np.ndarray) -> bytes:
+    buffer = io.BytesIO()
+    np.save(buffer, array)
+    return buffer.getvalue()
@@ -0,0 +1,342 @@
+import os
+import time
+import random
+import asyncio
+import logging
+import socket
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING, DESCENDING, ReturnDocument
+from app.config import get_settings
+from app.services.document_processor import document_processor
+from app.services.tenancy import DEFAULT_NAMESPACE, namespace_filter
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+JobHandler = Callable[[Dict[str, Any], AsyncIOMotorDatabase], Awaitable[None]]
+ClearHandler = Callable[[AsyncIOMotorDatabase], Awaitable[None]]
+
+# Upload statuses that mean the file is (or will be) in the index; the
+# others are "failed", "deleted", "replaced" (by a newer upload of the same
+# filename) and "cleared" (indexed, then dropped by a clear of the whole index)
+ACTIVE_STATUSES = ["queued", "processing", "processed"]
+
+
+def _remove_file(path: Optional[str]):
+    if path and os.path.exists(path):
+        os.remove(path)
+
+
+async def process_upload(job: Dict[str, Any], db: AsyncIOMotorDatabase):
+    namespace = job.get("namespace", DEFAULT_NAMESPACE)
+    await document_processor.process_document(
+        job["path"], job["file_id"], job["filename"], db,
+        namespace=namespace, uploaded_at=job.get("uploaded_at")
+    )
+    loop = asyncio.get_event_loop()
+    current = await db["uploads"].find_one({"file_id": job["file_id"]}, {"status": 1})
+    if current and current.get("status") in ("deleted", "replaced"):
+        # Deleted or superseded while it was being indexed
+        await loop.run_in_executor(None, document_processor.delete_document, job["file_id"], namespace)
+        return
+    if not current or current.get("status") != "processed":
+        return
+    # A re-upload of the same filename replaces the older versions once it is searchable
+    for old_file_id in job.get("replaces", []):
+        old = await db["uploads"].find_one_and_update(
+            {"file_id": old_file_id, **namespace_filter(namespace), "status": {"$in": ACTIVE_STATUSES}},
+            {"$set": {"status": "replaced", "replaced_by": job["file_id"]}},
+        )
+        if old is None:
+            continue
+        removed = await loop.run_in_executor(None, document_processor.delete_document, old_file_id, namespace)
+        await loop.run_in_executor(None, _remove_file, old.get("path"))
+        logger.info(f"Replaced {old_file_id} with {job['file_id']} ({removed} chunks removed)")
+
+
+async def remove_deleted_upload(upload: Dict[str, Any], db: AsyncIOMotorDatabase):
+    await asyncio.get_event_loop().run_in_executor(
+        None, document_processor.delete_document, upload["file_id"], upload.get("namespace", DEFAULT_NAMESPACE)
+    )
+
+
+async def clear_whole_index(db: AsyncIOMotorDatabase):
+    await asyncio.get_event_loop().run_in_executor(None, document_processor.clear_index)
+    # Their chunks are gone, so uploading the same content again must index it again
+    result = await db["uploads"].update_many(
+        {"status": "processed"},
+        {"$set": {"status": "cleared", "cleared_at": datetime.utcnow()}, "$unset": {"content_hash": ""}}
+    )
+    logger.info(f"Index cleared; {result.modified_count} processed uploads marked cleared")
+
+
+class IngestionQueue:
+    """Persistent ingestion job queue stored in the ``uploads`` collection.
+
+    An upload is a job: ``queued`` records are claimed atomically by a pool
+    of ``max_workers`` workers, highest ``priority`` first, and hold a lease
+    that a heartbeat keeps extending while they run. A job whose worker
+    died (process restart, crash) keeps its ``processing`` status but its
+    lease runs out, so any worker picks it up again. Failed attempts are
+    re-queued with exponential backoff until ``max_attempts`` is reached.
+
+    Uploads deleted through a worker process that cannot write the index
+    are flagged ``index_cleanup: "pending"``; ``cleanup_handler`` removes
+    their chunks in the process running the queue. Likewise a clear of the
+    whole index requested there (``request_clear``) is run by ``clear_handler``.
+    """
+
+    def __init__(
+        self,
+        handler: JobHandler,
+        cleanup_handler: Optional[JobHandler] = None,
+        clear_handler: Optional[ClearHandler] = None,
+        max_workers: int = 2,
+        max_attempts: int = 3,
+        backoff_base: float = 30.0,
+        backoff_max: float = 600.0,
+        lease_seconds: float = 120.0,
+        poll_seconds: float = 5.0,
+    ):
+        self.handler = handler
+        self.cleanup_handler = cleanup_handler
+        self.clear_handler = clear_handler
+        self.max_workers = max_workers
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+        self.running = 0
+        self._completions: Deque[float] = deque()
+        self._workers: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._db: Optional[AsyncIOMotorDatabase] = None
+        self._worker_prefix = f"{socket.gethostname()}:{os.getpid()}"
+
+    async def start(self, db: AsyncIOMotorDatabase):
+        self._db = db
+        self._wakeup = asyncio.Event()
+        # Runs in the background so an unreachable MongoDB doesn't hold up startup
+        self._workers = [asyncio.create_task(self._ensure_indexes(db))] + [
+            asyncio.create_task(self._work(f"{self._worker_prefix}:{n}"))
+            for n in range(self.max_workers)
+        ]
+        if self.cleanup_handler is not None or self.clear_handler is not None:
+            self._workers.append(asyncio.create_task(self._clean_up_deleted()))
+
+    async def _ensure_indexes(self, db: AsyncIOMotorDatabase):
+        try:
+            await db["uploads"].create_index(
+                [("status", ASCENDING), ("priority", DESCENDING), ("uploaded_at", ASCENDING)]
+            )
+            await db["uploads"].create_index([("namespace", ASCENDING), ("content_hash", ASCENDING)])
+            await db["uploads"].create_index([("namespace", ASCENDING), ("filename", ASCENDING)])
+            await db["uploads"].create_index([("index_cleanup", ASCENDING)], sparse=True)
+        except Exception as e:
+            logger.warning(f"Could not create ingestion queue indexes: {e}")
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def new_job(self, priority: int = 0) -> Dict[str, Any]:
+        """Queue fields for a new upload record"""
+        now = datetime.utcnow()
+        return {
+            "status": "queued",
+            "priority": priority,
+            "attempts": 0,
+            "next_attempt_at": now,
+        }
+
+    def notify(self):
+        """Wake an idle worker after a job was enqueued"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def claim(self, db: AsyncIOMotorDatabase, worker_id: str) -> Optional[Dict[str, Any]]:
+        now = datetime.utcnow()
+        return await db["uploads"].find_one_and_update(
+            {"$or": [
+                {"status": "queued", "next_attempt_at": {"$lte": now}},
+                # Abandoned by a worker that stopped renewing its lease
+                {"status": "processing", "lease_expires_at": {"$lt": now}},
+                # Stuck from before jobs had leases
+                {"status": "processing", "lease_expires_at": {"$exists": False}},
+            ]},
+            {
+                "$set": {
+                    "status": "processing",
+                    "worker": worker_id,
+                    "lease_expires_at": now + timedelta(seconds=self.lease_seconds),
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("priority", DESCENDING), ("uploaded_at", ASCENDING)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def _heartbeat(self, db: AsyncIOMotorDatabase, job: Dict[str, Any], worker_id: str):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            await db["uploads"].update_one(
+                {"file_id": job["file_id"], "worker": worker_id},
+                {"$set": {"lease_expires_at": datetime.utcnow() + timedelta(seconds=self.lease_seconds)}},
+            )
+
+    def _backoff(self, attempts: int) -> float:
+        delay = min(self.backoff_max, self.backoff_base * 2 ** max(attempts - 1, 0))
+        return delay * (0.5 + random.random() / 2)
+
+    async def run_job(self, db: AsyncIOMotorDatabase, job: Dict[str, Any], worker_id: str):
+        """Run one claimed job and record the outcome on its upload record"""
+        attempts = job.get("attempts", 1)
+        if attempts > self.max_attempts:
+            # Claimed again after its worker died on the last attempt
+            self.failed += 1
+            await db["uploads"].update_one(
+                {"file_id": job["file_id"]},
+                {"$set": {"status": "failed", "error": f"Gave up after {self.max_attempts} attempts",
+                          "processed_at": datetime.utcnow()},
+                 "$unset": {"lease_expires_at": "", "worker": ""}},
+            )
+            return
+
+        heartbeat = asyncio.create_task(self._heartbeat(db, job, worker_id))
+        self.running += 1
+        try:
+            await self.handler(job, db)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if attempts < self.max_attempts:
+                delay = self._backoff(attempts)
+                self.retried += 1
+                logger.warning(f"Ingestion of {job['file_id']} failed (attempt {attempts}), retrying in {delay:.0f}s: {e}")
+                update = {"status": "queued", "error": str(e),
+                          "next_attempt_at": datetime.utcnow() + timedelta(seconds=delay)}
+            else:
+                self.failed += 1
+                logger.error(f"Ingestion of {job['file_id']} failed after {attempts} attempts: {e}")
+                update = {"status": "failed", "error": str(e), "processed_at": datetime.utcnow()}
+            # A job deleted while it ran stays deleted
+            await db["uploads"].update_one(
+                {"file_id": job["file_id"], "status": "processing"},
+                {"$set": update, "$unset": {"lease_expires_at": "", "worker": ""}},
+            )
+            return
+        finally:
+            heartbeat.cancel()
+            self.running -= 1
+
+        self.completed += 1
+        self._completions.append(time.monotonic())
+        await db["uploads"].update_one(
+            {"file_id": job["file_id"]},
+            {"$set": {"processed_at": datetime.utcnow()}, "$unset": {"lease_expires_at": "", "worker": ""}},
+        )
+
+    async def _work(self, worker_id: str):
+        while True:
+            try:
+                job = await self.claim(self._db, worker_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error claiming ingestion job: {e}")
+                job = None
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_seconds)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self.run_job(self._db, job, worker_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error recording ingestion job {job.get('file_id')}: {e}")
+
+    async def request_clear(self, db: AsyncIOMotorDatabase):
+        """Ask the process running the queue to clear the whole index"""
+        await db["index_requests"].update_one(
+            {"_id": "clear"}, {"$set": {"requested_at": datetime.utcnow()}}, upsert=True
+        )
+
+    async def clear_if_requested(self, db: AsyncIOMotorDatabase) -> bool:
+        """Run a clear requested elsewhere; returns whether there was one"""
+        request = await db["index_requests"].find_one({"_id": "clear"})
+        if request is None:
+            return False
+        await self.clear_handler(db)
+        # A clear requested while this one ran stays pending
+        await db["index_requests"].delete_one({"_id": "clear", "requested_at": request["requested_at"]})
+        logger.info(f"Cleared the index as requested at {request['requested_at']}")
+        return True
+
+    async def clean_up_deleted(self, db: AsyncIOMotorDatabase) -> int:
+        """Remove the chunks of uploads deleted elsewhere; returns how many were cleaned up"""
+        if self.cleanup_handler is None:
+            return 0
+        pending = await db["uploads"].find(
+            {"index_cleanup": "pending"}, {"file_id": 1, "namespace": 1}
+        ).to_list(length=100)
+        for upload in pending:
+            await self.cleanup_handler(upload, db)
+            await db["uploads"].update_one({"file_id": upload["file_id"]}, {"$unset": {"index_cleanup": ""}})
+        return len(pending)
+
+    async def _clean_up_deleted(self):
+        while True:
+            try:
+                if self.clear_handler is not None:
+                    await self.clear_if_requested(self._db)
+                await self.clean_up_deleted(self._db)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error removing deleted uploads from the index: {e}")
+            await asyncio.sleep(self.poll_seconds)
+
+    def throughput(self, window_seconds: float = 300.0) -> float:
+        """Jobs completed per minute over the last ``window_seconds``"""
+        cutoff = time.monotonic() - window_seconds
+        while self._completions and self._completions[0] < cutoff:
+            self._completions.popleft()
+        return len(self._completions) * 60.0 / window_seconds
+
+    async def stats(self, db: AsyncIOMotorDatabase) -> Dict[str, Any]:
+        return {
+            "workers": self.max_workers if self._workers else 0,
+            "running": self.running,
+            "queued": await db["uploads"].count_documents({"status": "queued"}),
+            "completed": self.completed,
+            "failed": self.failed,
+            "retried": self.retried,
+            "jobs_per_minute": self.throughput(),
+        }
+
+
+# Global instance
+ingestion_queue = IngestionQueue(
+    process_upload,
+    cleanup_handler=remove_deleted_upload,
+    clear_handler=clear_whole_index,
+    max_workers=settings.INGESTION_WORKERS,
+    max_attempts=settings.INGESTION_MAX_ATTEMPTS,
+    backoff_base=settings.INGESTION_RETRY_BACKOFF_SECONDS,
+    backoff_max=settings.INGESTION_RETRY_BACKOFF_MAX_SECONDS,
+    lease_seconds=settings.INGESTION_LEASE_SECONDS,
+    poll_seconds=settings.INGESTION_POLL_SECONDS,
+)
@@ -0,0 +1,202 @@
+import os
+import copy
+import re
+import json
+import math
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+VOCABULARY_FILE = "vocabulary.json"
+ROWS_FILE = "rows.npy"
+FREQUENCIES_FILE = "frequencies.npy"
+LENGTHS_FILE = "lengths.npy"
+
+# Identifiers such as "SKU-1042", "rdf:type" or "v2.3" are kept whole and
+# also split into their parts, so both the code and its pieces match
+_TOKEN = re.compile(r"\w+(?:[-.:/#]\w+)*")
+_SEPARATORS = re.compile(r"[-_.:/#]")
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for match in _TOKEN.finditer(text.casefold()):
+        token = match.group()
+        tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(part for part in _SEPARATORS.split(token) if part and part != token)
+    return tokens
+
+
+def _save(path: str, write):
+    with open(path, "wb") as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class LexicalStore:
+    """Read-only BM25 postings of a base snapshot, memory-mapped from disk.
+
+        lexical/
+            vocabulary.json  term -> [start, end) slice of the postings arrays
+            rows.npy         int32 chunk row of each posting, grouped by term
+            frequencies.npy  int32 term frequency of each posting
+            lengths.npy      int32 token count per chunk row
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, VOCABULARY_FILE), "r", encoding="utf-8") as f:
+            self.vocabulary: Dict[str, List[int]] = json.load(f)
+        self.lengths = np.load(os.path.join(path, LENGTHS_FILE), mmap_mode="r")
+        if self.vocabulary:
+            self.rows = np.load(os.path.join(path, ROWS_FILE), mmap_mode="r")
+            self.frequencies = np.load(os.path.join(path, FREQUENCIES_FILE), mmap_mode="r")
+        else:
+            self.rows = self.frequencies = np.zeros(0, dtype="int32")
+        self.total_length = int(np.sum(self.lengths, dtype="int64"))
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    def postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        span = self.vocabulary.get(term)
+        if span is None:
+            return np.zeros(0, dtype="int32"), np.zeros(0, dtype="int32")
+        start, end = span
+        return self.rows[start:end], self.frequencies[start:end]
+
+    @staticmethod
+    def write(path: str, texts: Iterable[str]):
+        """Build and write the postings of ``texts``, one chunk row each"""
+        os.makedirs(path, exist_ok=True)
+        postings: Dict[str, List[int]] = {}
+        lengths = []
+        for row, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            lengths.append(sum(counts.values()))
+            for term, count in counts.items():
+                postings.setdefault(term, []).extend((row, count))
+
+        vocabulary = {}
+        rows = []
+        frequencies = []
+        for term, pairs in postings.items():
+            start = len(rows)
+            rows.extend(pairs[0::2])
+            frequencies.extend(pairs[1::2])
+            vocabulary[term] = [start, len(rows)]
+        _save(os.path.join(path, ROWS_FILE), lambda f: np.save(f, np.asarray(rows, dtype="int32")))
+        _save(os.path.join(path, FREQUENCIES_FILE), lambda f: np.save(f, np.asarray(frequencies, dtype="int32")))
+        _save(os.path.join(path, LENGTHS_FILE), lambda f: np.save(f, np.asarray(lengths, dtype="int32")))
+        _save(os.path.join(path, VOCABULARY_FILE), lambda f: f.write(json.dumps(vocabulary).encode("utf-8")))
+
+
+class LexicalIndex:
+    """BM25 inverted index over the chunk rows of one partition.
+
+    Mirrors ``ChunkList``: postings of the compacted base are served from a
+    memory-mapped ``LexicalStore`` and chunks added since live in memory,
+    one batch per ``add``. Batches are never changed once added, so
+    ``added`` can share them with the index it extends. Rows are the same
+    positions the vector index uses.
+    """
+
+    def __init__(self, base: Optional[LexicalStore] = None, k1: float = 1.2, b: float = 0.75):
+        self.base = base
+        self.k1 = k1
+        self.b = b
+        # (first row, term -> [[row, frequency], ...], token count per row)
+        self._batches: Tuple[Tuple[int, Dict[str, np.ndarray], np.ndarray], ...] = ()
+        self._size = self.base_size
+        self._total_length = base.total_length if base is not None else 0
+
+    @property
+    def base_size(self) -> int:
+        return len(self.base) if self.base is not None else 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, texts: Iterable[str]):
+        postings: Dict[str, List[int]] = {}
+        lengths = []
+        for text in texts:
+            row = self._size + len(lengths)
+            counts = Counter(tokenize(text))
+            lengths.append(sum(counts.values()))
+            for term, count in counts.items():
+                postings.setdefault(term, []).extend((row, count))
+        if not lengths:
+            return
+        batch = (
+            self._size,
+            {term: np.asarray(pairs, dtype="int64").reshape(-1, 2) for term, pairs in postings.items()},
+            np.asarray(lengths, dtype="int64"),
+        )
+        self._batches = self._batches + (batch,)
+        self._size += len(lengths)
+        self._total_length += sum(lengths)
+
+    def added(self, texts: Iterable[str]) -> "LexicalIndex":
+        """This index with ``texts`` appended as new rows; this one is left as it is"""
+        index = copy.copy(self)
+        index.add(texts)
+        return index
+
+    def _postings(self, term: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Rows, term frequencies and chunk lengths of every chunk containing ``term``"""
+        parts = []
+        if self.base is not None:
+            rows, frequencies = self.base.postings(term)
+            parts.append((rows.astype("int64"), frequencies.astype("int64"), self.base.lengths[rows].astype("int64")))
+        for first, postings, lengths in self._batches:
+            pairs = postings.get(term)
+            if pairs is not None:
+                parts.append((pairs[:, 0], pairs[:, 1], lengths[pairs[:, 0] - first]))
+        if not parts:
+            empty = np.zeros(0, dtype="int64")
+            return empty, empty, empty
+        return tuple(np.concatenate(column) for column in zip(*parts))
+
+    def search(self, query: str, k: int, excluded: Optional[np.ndarray] = None,
+               allowed: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """Top ``k`` (row, BM25 score) pairs for the query, best first, optionally only among ``allowed`` rows"""
+        total = len(self)
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not total or not terms or k <= 0:
+            return []
+        average_length = self._total_length / total or 1.0
+        all_rows = []
+        all_scores = []
+        for term in terms:
+            rows, frequencies, lengths = self._postings(term)
+            if not len(rows):
+                continue
+            idf = math.log(1 + (total - len(rows) + 0.5) / (len(rows) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * lengths / average_length)
+            all_rows.append(rows)
+            all_scores.append(idf * frequencies * (self.k1 + 1) / (frequencies + norm))
+        if not all_rows:
+            return []
+
+        rows, inverse = np.unique(np.concatenate(all_rows), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(all_scores))
+        if excluded is not None and len(excluded):
+            keep = ~np.isin(rows, excluded)
+            rows, scores = rows[keep], scores[keep]
+        if allowed is not None:
+            keep = np.isin(rows, allowed)
+            rows, scores = rows[keep], scores[keep]
+        if len(rows) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            rows, scores = rows[top], scores[top]
+        order = np.argsort(-scores, kind="stable")
+        return [(int(rows[i]), float(scores[i])) for i in order]
+
+    def stats(self) -> Dict[str, int]:
+        base_vocabulary = self.base.vocabulary if self.base is not None else {}
+        new_terms = set().union(*(postings for _, postings, _ in self._batches)) - base_vocabulary.keys()
+        return {"lexical_terms": len(base_vocabulary) + len(new_terms)}
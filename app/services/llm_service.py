@@ -1,11 +1,19 @@
-import asyncio
+import time
+import json
+import hashlib
 import logging
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple, AsyncIterator
 from langchain_openai import ChatOpenAI
-from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
+from langchain_core.messages import BaseMessage, SystemMessage, HumanMessage, AIMessage
 from langchain.prompts import ChatPromptTemplate
 from app.config import get_settings
 from app.services.document_processor import document_processor
+from app.services.concurrency import ConcurrencyLimiter
+from app.services.tenancy import DEFAULT_NAMESPACE
+from app.services.search_filter import SearchFilter
+from app.services.metrics import chat_prompt_tokens, chat_stage_seconds
+from app.services.context_packing import context_packer
+from app.services.answer_cache import AnswerCache
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
@@ -23,6 +31,24 @@ class LLMService:
                 max_tokens=1000
             )
         
+        # Answers to similar questions grounded in the same chunks are reused
+        if settings.ANSWER_CACHE_ENABLED:
+            self.answer_cache = AnswerCache(
+                settings.ANSWER_CACHE_MAX_ENTRIES,
+                settings.ANSWER_CACHE_TTL_SECONDS,
+                settings.ANSWER_CACHE_SIMILARITY
+            )
+        else:
+            self.answer_cache = None
+        
+        # Bounds concurrent chat turns; excess turns get a fast "busy" reply
+        self.limiter = ConcurrencyLimiter(
+            "llm",
+            max_concurrency=settings.LLM_MAX_CONCURRENCY,
+            max_queue=settings.LLM_MAX_QUEUE,
+            queue_timeout=settings.LLM_QUEUE_TIMEOUT_SECONDS
+        )
+        
         self.system_prompt = """You are a helpful AI assistant. Answer questions directly and naturally without referencing sources or context.
 
 CRITICAL INSTRUCTIONS:
@@ -38,76 +64,135 @@ Context from documents:
 
 Answer the user's question naturally without mentioning this context."""
 
+    async def _retrieve(
+        self,
+        message: str,
+        use_rag: bool,
+        k_documents: int,
+        namespace: str,
+        search_filter: Optional[SearchFilter]
+    ) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        """Search the namespace's documents (those matching ``search_filter``, if given) for context.
+
+        Returns the results and the index version they came from, or None
+        for the version when the index changed during the search.
+        """
+        if not use_rag:
+            logger.info(f"RAG disabled for query: '{message[:100]}...')")
+            return [], None
+        
+        version = document_processor.index_version(namespace)
+        search_results = await document_processor.search_similar_documents(
+            message, k_documents, namespace, search_filter=search_filter
+        )
+        if document_processor.index_version(namespace) != version:
+            version = None
+        
+        if search_results:
+            logger.info(f"Found {len(search_results)} relevant documents for query: '{message[:100]}...'")
+        else:
+            logger.info(f"No relevant documents found for query: '{message[:100]}...'")
+        return search_results, version
+
+    def _build_messages(
+        self,
+        message: str,
+        chat_history: Optional[List[Dict[str, Any]]],
+        search_results: List[Dict[str, Any]]
+    ) -> Tuple[List[BaseMessage], str, List[Dict[str, Any]], Dict[str, int]]:
+        """Build the prompt messages for the LLM, packed into the context and history token budgets"""
+        # Merge overlapping chunks and fit context and history into their budgets
+        packed = context_packer.pack(search_results, chat_history)
+        context = packed.context
+        sources = []
+        for i, result in enumerate(packed.sources):
+            sources.append({
+                "filename": result['metadata']['filename'],
+                "file_id": result['metadata']['file_id'],
+                "similarity_score": result['similarity_score'],
+                "score": result['score'],
+                "score_kind": result['score_kind'],
+                "content_preview": result['content'][:200] + "..." if len(result['content']) > 200 else result['content']
+            })
+            
+            # Log each source with similarity score and content preview
+            logger.info(f"  Source {i+1}: {result['metadata']['filename']} "
+                       f"({result['score_kind']}: {result['score']:.3f}) - "
+                       f"Content preview: {result['content'][:150]}...")
+        
+        token_report = packed.token_report()
+        for part, tokens in token_report.items():
+            chat_prompt_tokens.observe(tokens, part=part)
+        logger.info(f"Prompt packing: {len(search_results)} chunks -> {len(packed.sources)} in context "
+                   f"({packed.context_tokens} tokens), {len(packed.history)} history messages "
+                   f"({packed.history_tokens} tokens), {packed.tokens_saved} tokens saved")
+            
+        # Prepare messages for the LLM
+        messages = []
+        
+        # Add system message with context
+        system_content = self.system_prompt.format(context=context if context else "No relevant context found.")
+        messages.append(SystemMessage(content=system_content))
+        
+        # Log the context being sent to LLM
+        if context:
+            logger.info(f"Sending context to LLM (length: {len(context)} chars):")
+            logger.debug(f"Context content:\n{context[:500]}...")
+        else:
+            logger.info("No context sent to LLM - using general knowledge")
+        
+        # Add the chat history that fits; user messages are stored under the user's email
+        for msg in packed.history:
+            if msg.get("sender") == "assistant":
+                messages.append(AIMessage(content=msg.get("message", "")))
+            else:
+                messages.append(HumanMessage(content=msg.get("message", "")))
+        
+        # Add current user message
+        messages.append(HumanMessage(content=message))
+        
+        return messages, context, sources, token_report
+
     async def generate_response(
         self, 
         message: str, 
         chat_history: List[Dict[str, Any]] = None,
         use_rag: bool = True,
-        k_documents: int = 5
+        k_documents: int = 5,
+        namespace: str = DEFAULT_NAMESPACE,
+        search_filter: Optional[SearchFilter] = None
+    ) -> Dict[str, Any]:
+        """Generate LLM response with optional RAG (Retrieval Augmented Generation).
+
+        Raises ``ServiceBusyError`` when the LLM queue is full.
+        """
+        async with self.limiter.slot():
+            return await self._generate_response(message, chat_history, use_rag, k_documents, namespace, search_filter)
+
+    async def _generate_response(
+        self,
+        message: str,
+        chat_history: List[Dict[str, Any]],
+        use_rag: bool,
+        k_documents: int,
+        namespace: str,
+        search_filter: Optional[SearchFilter]
     ) -> Dict[str, Any]:
-        """Generate LLM response with optional RAG (Retrieval Augmented Generation)"""
+        context = ""
+        sources = []
         try:
-            context = ""
-            sources = []
-            
-            if use_rag:
-                # Search for relevant documents
-                search_results = await document_processor.search_similar_documents(message, k_documents)
-                
-                if search_results:
-                    context_parts = []
-                    logger.info(f"Found {len(search_results)} relevant documents for query: '{message[:100]}...'")
-                    
-                    for i, result in enumerate(search_results):
-                        context_parts.append(
-                            f"Source {i+1} (from {result['metadata']['filename']}):\n{result['content']}\n"
-                        )
-                        sources.append({
-                            "filename": result['metadata']['filename'],
-                            "file_id": result['metadata']['file_id'],
-                            "similarity_score": result['similarity_score'],
-                            "content_preview": result['content'][:200] + "..." if len(result['content']) > 200 else result['content']
-                        })
-                        
-                        # Log each source with similarity score and content preview
-                        logger.info(f"  Source {i+1}: {result['metadata']['filename']} "
-                                   f"(similarity: {result['similarity_score']:.3f}) - "
-                                   f"Content preview: {result['content'][:150]}...")
-                    
-                    context = "\n".join(context_parts)
-                    logger.info(f"Total context length: {len(context)} characters")
-                else:
-                    logger.info(f"No relevant documents found for query: '{message[:100]}...'")
-            else:
-                logger.info(f"RAG disabled for query: '{message[:100]}...')")
-                
-            # Prepare messages for the LLM
-            messages = []
-            
-            # Add system message with context
-            system_content = self.system_prompt.format(context=context if context else "No relevant context found.")
-            messages.append(SystemMessage(content=system_content))
-            
-            # Log the context being sent to LLM
-            if context:
-                logger.info(f"Sending context to LLM (length: {len(context)} chars):")
-                logger.debug(f"Context content:\n{context[:500]}...")
-            else:
-                logger.info("No context sent to LLM - using general knowledge")
+            search_results, version = await self._retrieve(message, use_rag, k_documents, namespace, search_filter)
+            cache_key = self._answer_cache_key(message, chat_history, namespace, search_results, version)
+            cached = self.answer_cache.get(*cache_key) if cache_key is not None else None
+            if cached is not None:
+                logger.info(f"Answer cache hit for query: '{message[:100]}...'")
+                return {**cached, "context_tokens": None, "cached": True}
             
-            # Add chat history if provided
-            if chat_history:
-                for msg in chat_history[-10:]:  # Last 10 messages for context
-                    if msg.get("sender") == "user":
-                        messages.append(HumanMessage(content=msg.get("message", "")))
-                    elif msg.get("sender") == "assistant":
-                        messages.append(AIMessage(content=msg.get("message", "")))
-            
-            # Add current user message
-            messages.append(HumanMessage(content=message))
+            messages, context, sources, token_report = self._build_messages(message, chat_history, search_results)
             
             # Generate response
-            response = await self._generate_async(messages)
+            with chat_stage_seconds.time(stage="llm"):
+                response = await self._generate_async(messages)
             
             # Log the response details
             context_used = bool(context)
@@ -115,40 +200,141 @@ Answer the user's question naturally without mentioning this context."""
                        f"Sources: {len(sources)}, Response length: {len(response.content)} chars")
             logger.debug(f"LLM Response content: {response.content[:200]}...")
             
-            return {
+            answer = {
                 "response": response.content,
                 "sources": sources,
                 "context_used": context_used,
                 "model": "gpt-3.5-turbo"
             }
+            if cache_key is not None:
+                self.answer_cache.set(*cache_key, answer)
+            return {**answer, "context_tokens": token_report, "cached": False}
             
         except Exception as e:
             logger.error(f"Error generating LLM response: {e}")
+            return self._error_response(e, context, sources)
+
+    async def generate_response_stream(
+        self,
+        message: str,
+        chat_history: List[Dict[str, Any]] = None,
+        use_rag: bool = True,
+        k_documents: int = 5,
+        namespace: str = DEFAULT_NAMESPACE,
+        search_filter: Optional[SearchFilter] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Stream an LLM response as it is generated.
+
+        Yields ``{"type": "delta", "content": ...}`` events for each token
+        batch from the model, then one ``{"type": "final", ...}`` event with
+        the same fields ``generate_response`` returns. Raises
+        ``ServiceBusyError`` before yielding anything when the LLM queue is full.
+        """
+        async with self.limiter.slot():
+            async for event in self._generate_response_stream(
+                message, chat_history, use_rag, k_documents, namespace, search_filter
+            ):
+                yield event
+
+    async def _generate_response_stream(
+        self,
+        message: str,
+        chat_history: List[Dict[str, Any]],
+        use_rag: bool,
+        k_documents: int,
+        namespace: str,
+        search_filter: Optional[SearchFilter]
+    ) -> AsyncIterator[Dict[str, Any]]:
+        context = ""
+        sources = []
+        parts = []
+        try:
+            search_results, version = await self._retrieve(message, use_rag, k_documents, namespace, search_filter)
+            cache_key = self._answer_cache_key(message, chat_history, namespace, search_results, version)
+            cached = self.answer_cache.get(*cache_key) if cache_key is not None else None
+            if cached is not None:
+                logger.info(f"Answer cache hit for query: '{message[:100]}...'")
+                yield {"type": "delta", "content": cached["response"]}
+                yield {"type": "final", **cached, "context_tokens": None, "cached": True}
+                return
             
-            # If OpenAI is not configured, provide a helpful response with context
-            if "OpenAI API key not configured" in str(e) and context:
-                return {
-                    "response": f"I found relevant information in your documents but cannot generate a full response without OpenAI API configuration. Here's what I found:\n\n{context[:500]}...",
-                    "sources": sources,
-                    "context_used": True,
-                    "error": "OpenAI API key not configured"
-                }
+            messages, context, sources, token_report = self._build_messages(message, chat_history, search_results)
+            if not self.llm:
+                raise ValueError("OpenAI API key not configured. Cannot generate responses.")
             
+            started = time.perf_counter()
+            async for chunk in self.llm.astream(messages):
+                if chunk.content:
+                    if not parts:
+                        chat_stage_seconds.observe(time.perf_counter() - started, stage="llm_first_token")
+                    parts.append(chunk.content)
+                    yield {"type": "delta", "content": chunk.content}
+            chat_stage_seconds.observe(time.perf_counter() - started, stage="llm")
+            
+            response = "".join(parts)
+            logger.info(f"LLM Response streamed - Context used: {bool(context)}, "
+                       f"Sources: {len(sources)}, Response length: {len(response)} chars")
+            answer = {
+                "response": response,
+                "sources": sources,
+                "context_used": bool(context),
+                "model": "gpt-3.5-turbo"
+            }
+            if cache_key is not None:
+                self.answer_cache.set(*cache_key, answer)
+            yield {"type": "final", **answer, "context_tokens": token_report, "cached": False}
+            
+        except Exception as e:
+            logger.error(f"Error streaming LLM response: {e}")
+            yield {"type": "final", **self._error_response(e, context, sources)}
+
+    def _answer_cache_key(
+        self,
+        message: str,
+        chat_history: Optional[List[Dict[str, Any]]],
+        namespace: str,
+        search_results: List[Dict[str, Any]],
+        version: Optional[int]
+    ) -> Optional[tuple]:
+        """Answer cache arguments for this retrieval, or None when its answer must not be cached.
+
+        Only answers grounded in retrieved chunks are cached. They are keyed
+        on the chunks and on the history that goes into the prompt, so an
+        answer shaped by one conversation is never served in another; the
+        query embedding is the one the search just computed, if any.
+        """
+        if self.answer_cache is None or version is None or not search_results:
+            return None
+        history, _ = context_packer.pack_history(chat_history or [])
+        history_digest = hashlib.sha256(json.dumps(
+            [[msg.get("sender") == "assistant", msg.get("message", "")] for msg in history]
+        ).encode("utf-8")).hexdigest()
+        grounding = (frozenset(result["row"] for result in search_results), history_digest)
+        return namespace, version, grounding, message, document_processor.cached_query_vector(message)
+
+    def _error_response(self, error: Exception, context: str, sources: List[Dict[str, Any]]) -> Dict[str, Any]:
+        # If OpenAI is not configured, provide a helpful response with context
+        if "OpenAI API key not configured" in str(error) and context:
             return {
-                "response": "I apologize, but I encountered an error while generating a response. Please try again.",
-                "sources": [],
-                "context_used": False,
-                "error": str(e)
+                "response": f"I found relevant information in your documents but cannot generate a full response without OpenAI API configuration. Here's what I found:\n\n{context[:500]}...",
+                "sources": sources,
+                "context_used": True,
+                "error": "OpenAI API key not configured"
             }
+        
+        return {
+            "response": "I apologize, but I encountered an error while generating a response. Please try again.",
+            "sources": [],
+            "context_used": False,
+            "error": str(error)
+        }
 
     async def _generate_async(self, messages):
-        """Generate response asynchronously"""
+        """Generate response with the client's native async API"""
         if not self.llm:
             raise ValueError("OpenAI API key not configured. Cannot generate responses.")
         
-        loop = asyncio.get_event_loop()
-        response = await loop.run_in_executor(None, self.llm, messages)
-        return response
+        return await self.llm.ainvoke(messages)
 
     async def generate_summary(self, text: str, max_length: int = 200) -> str:
         """Generate a summary of the provided text"""
@@ -160,7 +346,8 @@ Answer the user's question naturally without mentioning this context."""
 Summary:"""
             
             messages = [HumanMessage(content=prompt)]
-            response = await self._generate_async(messages)
+            async with self.limiter.slot():
+                response = await self._generate_async(messages)
             return response.content
             
         except Exception as e:
@@ -177,7 +364,8 @@ Summary:"""
 Questions:"""
             
             messages = [HumanMessage(content=prompt)]
-            response = await self._generate_async(messages)
+            async with self.limiter.slot():
+                response = await self._generate_async(messages)
             
             # Parse questions from response
             questions = []
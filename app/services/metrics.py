@@ -0,0 +1,177 @@
+import time
+import logging
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; covers a cached search (milliseconds) up to a slow LLM answer or a large file
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# Prompt sizes in tokens
+TOKEN_BUCKETS = (0, 50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000)
+
+GaugeValue = Union[float, Dict[Tuple[str, ...], float]]
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else f"{int(value)}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    """Cumulative histogram of observed values, one series per label combination"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> (count per bucket, +Inf last; sum)
+        self._series: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            counts, total = series
+            counts[bisect_left(self.buckets, value)] += 1
+            total[0] += value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """Observe how long the block takes, whether or not it raises"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels: str) -> int:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            return sum(series[0]) if series else 0
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((key, list(counts), total[0]) for key, (counts, total) in self._series.items())
+        for key, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """A value read from the application when metrics are scraped.
+
+    ``collect`` returns a number, or with ``labelnames`` a dict from label
+    values to numbers.
+    """
+
+    def __init__(self, name: str, documentation: str, collect: Callable[[], GaugeValue],
+                 labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.collect = collect
+        self.labelnames = tuple(labelnames)
+
+    def render(self) -> List[str]:
+        try:
+            value = self.collect()
+        except Exception as e:
+            logger.warning(f"Could not collect metric {self.name}: {e}")
+            return []
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        if not self.labelnames:
+            lines.append(f"{self.name} {_format_value(value)}")
+            return lines
+        for key, number in sorted(value.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, key)} {_format_value(number)}")
+        return lines
+
+
+class MetricsRegistry:
+    """The metrics of this process, rendered in the Prometheus text exposition format.
+
+    Each uvicorn worker keeps its own; ingestion and compaction metrics only
+    come from the worker that writes the index.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, Union[Histogram, Gauge]] = {}
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics[name] = metric
+        return metric
+
+    def gauge(self, name: str, documentation: str, collect: Callable[[], GaugeValue],
+              labelnames: Sequence[str] = ()) -> Gauge:
+        metric = Gauge(name, documentation, collect, labelnames)
+        self._metrics[name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# Global instance
+metrics = MetricsRegistry()
+
+chat_turn_seconds = metrics.histogram(
+    "chat_turn_seconds", "Chat turns from receiving the message to sending the answer", ["stream"]
+)
+chat_stage_seconds = metrics.histogram(
+    "chat_turn_stage_seconds",
+    "Time spent in each stage of a chat turn (store_message, rag_decision, embed_query, search, "
+    "llm_first_token, llm, store_answer) and in loading the history when a WebSocket connects (history_load)",
+    ["stage"]
+)
+chat_prompt_tokens = metrics.histogram(
+    "chat_prompt_tokens",
+    "Tokens of retrieved context and chat history sent per turn, and tokens saved by merging overlapping "
+    "chunks and trimming both to their budgets (part=saved)",
+    ["part"], buckets=TOKEN_BUCKETS
+)
+document_processing_seconds = metrics.histogram(
+    "document_processing_seconds", "Whole uploads through process_document", ["outcome"]
+)
+document_stage_seconds = metrics.histogram(
+    "document_processing_stage_seconds",
+    "Time spent in each stage of process_document (extract, split, embed, index, save), per chunk batch",
+    ["stage"]
+)
+index_compaction_seconds = metrics.histogram(
+    "index_compaction_seconds", "Compactions that wrote a new base snapshot of a partition"
+)
@@ -0,0 +1,70 @@
+import fnmatch
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Dict, FrozenSet, Optional
+
+
+def _parse_datetime(value: Any) -> Optional[datetime]:
+    """An ISO 8601 date or time as naive UTC, like the stored ``uploaded_at`` values"""
+    if value is None:
+        return None
+    if not isinstance(value, datetime):
+        value = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+@dataclass(frozen=True)
+class SearchFilter:
+    """Restricts a search to chunks whose file metadata matches every given field.
+
+    ``filename`` is a case-insensitive glob (``"report-*.pdf"``). Upload
+    dates are compared with the chunk's ``uploaded_at`` metadata; chunks
+    indexed before it was recorded never match a date bound. Instances are
+    hashable, so they can be part of cache keys.
+    """
+
+    file_ids: Optional[FrozenSet[str]] = None
+    filename: Optional[str] = None
+    uploaded_after: Optional[datetime] = None
+    uploaded_before: Optional[datetime] = None
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> Optional["SearchFilter"]:
+        """Parse a filter from a JSON payload; None when it sets no field.
+
+        Raises ``ValueError`` for malformed values.
+        """
+        if not data:
+            return None
+        if not isinstance(data, dict):
+            raise ValueError("filter must be an object")
+        file_ids = data.get("file_ids")
+        if isinstance(file_ids, str):
+            file_ids = [file_ids]
+        search_filter = cls(
+            file_ids=frozenset(str(file_id) for file_id in file_ids) if file_ids is not None else None,
+            filename=data.get("filename") or None,
+            uploaded_after=_parse_datetime(data.get("uploaded_after")),
+            uploaded_before=_parse_datetime(data.get("uploaded_before")),
+        )
+        return search_filter if search_filter != cls() else None
+
+    def matches(self, metadata: Dict[str, Any]) -> bool:
+        if self.file_ids is not None and metadata.get("file_id") not in self.file_ids:
+            return False
+        if self.filename is not None and not fnmatch.fnmatchcase(
+            str(metadata.get("filename", "")).casefold(), self.filename.casefold()
+        ):
+            return False
+        if self.uploaded_after is not None or self.uploaded_before is not None:
+            uploaded_at = metadata.get("uploaded_at")
+            if not uploaded_at:
+                return False
+            uploaded_at = _parse_datetime(uploaded_at)
+            if self.uploaded_after is not None and uploaded_at < self.uploaded_after:
+                return False
+            if self.uploaded_before is not None and uploaded_at >= self.uploaded_before:
+                return False
+        return True
@@ -0,0 +1,32 @@
+import hashlib
+from typing import Any, Dict
+from app.config import get_settings
+
+settings = get_settings()
+
+# Namespace of uploads made before indexes were partitioned, and of every
+# upload when partitioning is turned off
+DEFAULT_NAMESPACE = "default"
+
+
+def namespace_for_claims(claims: Dict[str, Any]) -> str:
+    """Index namespace for a decoded JWT: its workspace if it names one, else its user"""
+    if settings.INDEX_PARTITION_BY == "none":
+        return DEFAULT_NAMESPACE
+    workspace = claims.get("workspace")
+    if workspace:
+        return f"workspace:{workspace}"
+    return f"user:{claims['sub']}"
+
+
+def namespace_directory(namespace: str) -> str:
+    """Filesystem-safe directory name for a namespace"""
+    return hashlib.sha256(namespace.encode("utf-8")).hexdigest()[:32]
+
+
+def namespace_filter(namespace: str) -> Dict[str, Any]:
+    """MongoDB filter for the uploads of a namespace"""
+    if namespace == DEFAULT_NAMESPACE:
+        # Uploads from before partitioning have no namespace field
+        return {"namespace": {"$in": [namespace, None]}}
+    return {"namespace": namespace}
@@ -0,0 +1,91 @@
+import asyncio
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+from app.config import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+DEFAULT_MODEL = "gpt-3.5-turbo"
+# Rough characters-per-token ratio for English text with OpenAI tokenizers
+CHARS_PER_TOKEN = 4
+
+# model -> loaded encoding, or None once loading it failed
+_encodings: Dict[str, Any] = {}
+_loaders: Dict[str, threading.Thread] = {}
+_loaders_lock = threading.Lock()
+
+
+def _load_encoding(model: str):
+    try:
+        import tiktoken
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            encoding = tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        # tiktoken downloads its BPE files on first use; fall back when offline
+        logger.warning(f"tiktoken unavailable for {model}, estimating token counts: {e}")
+        encoding = None
+    _encodings[model] = encoding
+
+
+def _loader(model: str) -> threading.Thread:
+    with _loaders_lock:
+        thread = _loaders.get(model)
+        if thread is None:
+            thread = threading.Thread(target=_load_encoding, args=(model,), name=f"tiktoken-{model}", daemon=True)
+            _loaders[model] = thread
+            thread.start()
+        return thread
+
+
+def _on_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
+def _get_encoding(model: str):
+    """The model's tokenizer, or None to estimate while (or because) it cannot be loaded.
+
+    The first use may download tiktoken's files with no timeout of its own,
+    so loading runs in a thread: other threads wait for it at most
+    ``TOKENIZER_LOAD_TIMEOUT_SECONDS`` and the event loop never waits.
+    """
+    if model in _encodings:
+        return _encodings[model]
+    loader = _loader(model)
+    if not _on_event_loop():
+        loader.join(settings.TOKENIZER_LOAD_TIMEOUT_SECONDS)
+    return _encodings.get(model)
+
+
+def warm_up(model: str = DEFAULT_MODEL) -> bool:
+    """Load the tokenizer ahead of the first request (off the event loop); returns whether it is usable"""
+    return _get_encoding(model) is not None
+
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    """Count tokens with the model's tokenizer, or estimate from length"""
+    encoding = _get_encoding(model or DEFAULT_MODEL)
+    if encoding is None:
+        return len(text) // CHARS_PER_TOKEN + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model: Optional[str] = None) -> str:
+    """The longest prefix of ``text`` that ``count_tokens`` puts at ``max_tokens`` or fewer"""
+    if max_tokens <= 0:
+        return ""
+    encoding = _get_encoding(model or DEFAULT_MODEL)
+    if encoding is None:
+        return text[:(max_tokens - 1) * CHARS_PER_TOKEN]
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
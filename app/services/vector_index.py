@@ -0,0 +1,519 @@
+import copy
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+import faiss
+import numpy as np
+
+from app.config import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+INDEX_TYPES = ("flat", "ivf_flat", "hnsw")
+COMPRESSIONS = ("none", "fp16", "sq8", "pq")
+
+_SQ_TYPES = {"fp16": faiss.ScalarQuantizer.QT_fp16, "sq8": faiss.ScalarQuantizer.QT_8bit}
+
+
+def _index_kind(index: faiss.Index) -> str:
+    """Map a concrete FAISS index to one of the configured engine names"""
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf_flat"
+    return "flat"
+
+
+def _storage(index: faiss.Index) -> faiss.Index:
+    """The index that holds the vector codes (an HNSW graph keeps them in a separate one)"""
+    if isinstance(index, faiss.IndexHNSW):
+        return faiss.downcast_index(index.storage)
+    return index
+
+
+def _index_compression(index: faiss.Index) -> str:
+    """Map a concrete FAISS index to one of the configured compression names"""
+    storage = _storage(index)
+    if isinstance(storage, (faiss.IndexPQ, faiss.IndexIVFPQ)):
+        return "pq"
+    if isinstance(storage, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer)):
+        return "fp16" if storage.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else "sq8"
+    return "none"
+
+
+def reconstruct_all(index: faiss.Index) -> np.ndarray:
+    """Read every stored vector back out of an index"""
+    if index.ntotal == 0:
+        return np.zeros((0, index.d), dtype="float32")
+    if isinstance(index, faiss.IndexIVF) and index.direct_map.no():
+        index.make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+
+class _RowSelector:
+    """FAISS selector over a set of row ids; owns the id array it points into"""
+
+    def __init__(self, ids: np.ndarray, exclude: bool):
+        self.ids = np.ascontiguousarray(ids, dtype="int64")
+        self._batch = faiss.IDSelectorBatch(len(self.ids), faiss.swig_ptr(self.ids))
+        self.selector = faiss.IDSelectorNot(self._batch) if exclude else self._batch
+
+
+def _merge(results, k: int, n_queries: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Combine per-part (distances, labels) into the overall ``k`` nearest"""
+    if not results:
+        return np.full((n_queries, k), np.inf, dtype="float32"), np.full((n_queries, k), -1, dtype="int64")
+    if len(results) == 1 and results[0][1].shape[1] == k:
+        return results[0]
+    distances = np.hstack([d for d, _ in results])
+    labels = np.hstack([l for _, l in results])
+    distances = np.where(labels >= 0, distances, np.inf)
+    order = np.argsort(distances, axis=1, kind="stable")[:, :k]
+    return np.take_along_axis(distances, order, axis=1), np.take_along_axis(labels, order, axis=1)
+
+
+class VectorIndex:
+    """FAISS index wrapper with a configurable engine and compression.
+
+    ``flat`` is an exact brute-force scan, ``ivf_flat`` partitions vectors
+    into ``nlist`` inverted lists and probes ``nprobe`` of them per query,
+    and ``hnsw`` walks a navigable small-world graph. Any engine can store
+    its vectors compressed: ``fp16`` halves them, ``sq8`` keeps one byte
+    per dimension and ``pq`` ``FAISS_PQ_M`` bytes per vector. IVF, SQ8 and
+    PQ need training, so such an index stays flat until
+    ``FAISS_IVF_MIN_TRAIN_SIZE`` vectors have been added and is then
+    trained and rebuilt by the next in-place ``add`` or ``folded``.
+
+    A compressed index over-fetches ``FAISS_RERANK_FACTOR`` times the
+    requested neighbours and re-scores them against the full-precision
+    ``exact`` vectors of the base, kept in a memory-mapped file next to the
+    index on disk, so only the candidates' pages are ever read.
+
+    Vector ids are row positions in the chunk list. Rows of deleted files
+    are excluded from search with an ID selector until compaction drops them
+    with ``without_rows``, so deleting never renumbers the live rows.
+
+    An index that searches may be using is never modified: ``added``,
+    ``excluding``, ``without_rows`` and ``folded`` return a new
+    ``VectorIndex`` that shares the FAISS indexes it did not change. Rows
+    added that way go to small flat ``deltas`` searched alongside the base
+    until a compaction folds them in. In-place ``add`` and ``set_excluded``
+    are for building an index before it is shared.
+
+    A base backed by files, i.e. an IVF index loaded with ``memory_map=True``
+    (its inverted lists stay in the shared, read-only file mapping) or one
+    whose exact vectors are memory-mapped, always takes new vectors in a delta.
+    """
+
+    def __init__(self, dimension: int = None, index_type: str = None, index: faiss.Index = None,
+                 memory_mapped: bool = False, compression: str = None):
+        self.dimension = dimension or settings.EMBEDDING_DIMENSION
+        self.index_type = (index_type or settings.FAISS_INDEX_TYPE).lower()
+        if self.index_type not in INDEX_TYPES:
+            raise ValueError(f"Unsupported FAISS index type: {self.index_type}")
+        self.compression = (compression or settings.FAISS_COMPRESSION).lower()
+        if self.compression not in COMPRESSIONS:
+            raise ValueError(f"Unsupported FAISS compression: {self.compression}")
+        if self.compression == "pq" and self.dimension % settings.FAISS_PQ_M:
+            raise ValueError(f"FAISS_PQ_M ({settings.FAISS_PQ_M}) must divide the dimension ({self.dimension})")
+        self.index = index if index is not None else self._create_empty()
+        self.memory_mapped = memory_mapped
+        # Full-precision vectors of the base rows, when the base is compressed
+        self.exact: Optional[np.ndarray] = None
+        self.deltas: Tuple[faiss.Index, ...] = ()
+        self.excluded = np.zeros(0, dtype="int64")
+        self._exclusions: List[Optional[_RowSelector]] = [None]
+        self._prepare()
+
+    @property
+    def ntotal(self) -> int:
+        return self.index.ntotal + sum(delta.ntotal for delta in self.deltas)
+
+    @property
+    def d(self) -> int:
+        return self.index.d
+
+    def _parts(self) -> List[Tuple[faiss.Index, int, Optional[_RowSelector]]]:
+        """(index, first row, exclusion selector) of the base and each delta"""
+        parts = [(self.index, 0, self._exclusions[0])]
+        first = self.index.ntotal
+        for delta, exclusion in zip(self.deltas, self._exclusions[1:]):
+            if delta.ntotal:
+                parts.append((delta, first, exclusion))
+            first += delta.ntotal
+        return parts
+
+    def vector_blocks(self) -> List[np.ndarray]:
+        """Every stored vector in row order, at full precision where it is kept, as one array per part"""
+        blocks = [self.exact if self.exact is not None else reconstruct_all(self.index)]
+        return blocks + [reconstruct_all(delta) for delta in self.deltas]
+
+    def vectors(self) -> np.ndarray:
+        """Every stored vector, in row order"""
+        return np.vstack(self.vector_blocks())
+
+    @property
+    def kind(self) -> str:
+        return _index_kind(self.index)
+
+    @property
+    def compression_kind(self) -> str:
+        return self._compression_kind
+
+    @property
+    def compressed(self) -> bool:
+        return self.compression_kind != "none"
+
+    @property
+    def _needs_training(self) -> bool:
+        return self.index_type == "ivf_flat" or self.compression in ("sq8", "pq")
+
+    @property
+    def training_pending(self) -> bool:
+        """True while an index that needs training is still collecting vectors in flat form"""
+        return self._needs_training and isinstance(self.index, faiss.IndexFlat)
+
+    @property
+    def training_due(self) -> bool:
+        """True once an index still waiting for training holds enough vectors to be trained"""
+        return self.training_pending and self.ntotal >= self._min_train_size()
+
+    def _centroids(self) -> int:
+        """Largest number of k-means centroids training has to fit"""
+        centroids = settings.FAISS_IVF_NLIST if self.index_type == "ivf_flat" else 0
+        # 8-bit codes: 256 levels per dimension (SQ8) or per sub-vector (PQ)
+        return max(centroids, 256 if self.compression in ("sq8", "pq") else 0)
+
+    def _min_train_size(self) -> int:
+        size = settings.FAISS_IVF_MIN_TRAIN_SIZE or self._centroids() * 39
+        # PQ codebooks cannot be trained on fewer points than they have codes
+        return max(size, 256) if self.compression == "pq" else size
+
+    def _create_empty(self) -> faiss.Index:
+        if self._needs_training:
+            # Trained indexes cannot be built without data, so they start flat
+            return faiss.IndexFlatL2(self.dimension)
+        return self._create_index()
+
+    def _create_index(self, vectors: Optional[np.ndarray] = None) -> faiss.Index:
+        """An empty index of the configured engine and compression, trained on ``vectors`` if it needs it"""
+        d = self.dimension
+        if self.index_type == "ivf_flat":
+            quantizer = faiss.IndexFlatL2(d)
+            nlist = min(settings.FAISS_IVF_NLIST, max(1, len(vectors) // 39))
+            if self.compression == "pq":
+                index = faiss.IndexIVFPQ(quantizer, d, nlist, settings.FAISS_PQ_M, 8)
+            elif self.compression in _SQ_TYPES:
+                index = faiss.IndexIVFScalarQuantizer(quantizer, d, nlist, _SQ_TYPES[self.compression])
+            else:
+                index = faiss.IndexIVFFlat(quantizer, d, nlist)
+        elif self.index_type == "hnsw":
+            if self.compression == "pq":
+                index = faiss.IndexHNSWPQ(d, settings.FAISS_PQ_M, settings.FAISS_HNSW_M)
+            elif self.compression in _SQ_TYPES:
+                index = faiss.IndexHNSWSQ(d, _SQ_TYPES[self.compression], settings.FAISS_HNSW_M)
+            else:
+                index = faiss.IndexHNSWFlat(d, settings.FAISS_HNSW_M)
+            index.hnsw.efConstruction = settings.FAISS_HNSW_EF_CONSTRUCTION
+        elif self.compression == "pq":
+            index = faiss.IndexPQ(d, settings.FAISS_PQ_M, 8)
+        elif self.compression in _SQ_TYPES:
+            index = faiss.IndexScalarQuantizer(d, _SQ_TYPES[self.compression])
+        else:
+            index = faiss.IndexFlatL2(d)
+
+        if not index.is_trained and vectors is None:
+            # Only HNSW over fp16 codes: nothing to learn, but its storage still wants a train call
+            index.train(np.zeros((0, d), dtype="float32"))
+        elif not index.is_trained:
+            sample_size = min(len(vectors), max(self._centroids(), 1) * 256)
+            if sample_size < len(vectors):
+                rng = np.random.default_rng(0)
+                sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+            else:
+                sample = vectors
+            index.train(sample)
+            logger.info(f"Trained {type(index).__name__} on {sample_size} vectors")
+        return index
+
+    def _prepare(self):
+        """Apply the search settings and build what searching needs up front,
+        so concurrent searches only ever read the index"""
+        self._compression_kind = _index_compression(self.index)
+        if isinstance(self.index, faiss.IndexIVF):
+            self.index.nprobe = min(settings.FAISS_IVF_NPROBE, self.index.nlist)
+            # Reconstructing rows for filtered searches needs the id -> list map
+            if self.index.direct_map.no():
+                self.index.make_direct_map()
+        elif isinstance(self.index, faiss.IndexHNSW):
+            self.index.hnsw.efSearch = settings.FAISS_HNSW_EF_SEARCH
+
+    def _rebuild(self, vectors: np.ndarray):
+        """Replace the underlying index with an in-memory one of the configured engine"""
+        if self._needs_training and len(vectors) < self._min_train_size():
+            index = faiss.IndexFlatL2(self.dimension)
+        else:
+            index = self._create_index(vectors)
+        if len(vectors):
+            index.add(vectors)
+        self.index = index
+        self.memory_mapped = False
+        self.deltas = ()
+        self._prepare()
+        self.exact = np.ascontiguousarray(vectors, dtype="float32") if self.compressed else None
+        self.set_excluded(self.excluded)
+
+    def add(self, vectors: np.ndarray):
+        """Add vectors in place, training an index that needs it once enough data is available"""
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        if self.memory_mapped or isinstance(self.exact, np.memmap) or self.deltas:
+            # The mapped files are read-only
+            self._add_delta(vectors)
+            return
+        if self.training_pending and self.index.ntotal + len(vectors) >= self._min_train_size():
+            self._rebuild(np.vstack([reconstruct_all(self.index), vectors]))
+            return
+        if self.compressed:
+            self.exact = np.vstack([self.vector_blocks()[0], vectors])
+        self.index.add(vectors)
+
+    def _add_delta(self, vectors: np.ndarray):
+        delta = faiss.IndexFlatL2(self.d)
+        delta.add(vectors)
+        self.deltas = self.deltas + (delta,)
+        self.set_excluded(self.excluded)
+
+    def added(self, vectors: np.ndarray) -> "VectorIndex":
+        """This index with ``vectors`` appended as new rows; this one is left as it is.
+
+        It never trains: an index that becomes ``training_due`` keeps its new
+        rows in flat deltas until a compaction folds (and trains) them.
+        """
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        index = copy.copy(self)
+        if len(vectors):
+            index._add_delta(vectors)
+        return index
+
+    def with_exact(self, exact: Optional[np.ndarray]) -> "VectorIndex":
+        """This index reading its base's full-precision vectors from ``exact``"""
+        index = copy.copy(self)
+        index.exact = exact if self.compressed else None
+        return index
+
+    def set_excluded(self, rows: np.ndarray):
+        """Leave these row ids out of every search"""
+        self.excluded = np.ascontiguousarray(rows, dtype="int64")
+        # Each part numbers its rows from zero
+        self._exclusions = []
+        first = 0
+        for index in (self.index,) + self.deltas:
+            in_part = self.excluded[(self.excluded >= first) & (self.excluded < first + index.ntotal)] - first
+            self._exclusions.append(_RowSelector(in_part, exclude=True) if len(in_part) else None)
+            first += index.ntotal
+
+    def excluding(self, rows: np.ndarray) -> "VectorIndex":
+        """This index with ``rows`` left out of search instead; this one is left as it is"""
+        index = copy.copy(self)
+        index.set_excluded(rows)
+        return index
+
+    @staticmethod
+    def _search_params(index: faiss.Index, selector: Optional[_RowSelector]) -> Optional[faiss.SearchParameters]:
+        if selector is None:
+            return None
+        # Parameter objects replace the index's own settings, so carry them over
+        if isinstance(index, faiss.IndexIVF):
+            return faiss.SearchParametersIVF(sel=selector.selector, nprobe=index.nprobe)
+        if isinstance(index, faiss.IndexHNSW):
+            return faiss.SearchParametersHNSW(sel=selector.selector, efSearch=index.hnsw.efSearch)
+        return faiss.SearchParameters(sel=selector.selector)
+
+    @staticmethod
+    def _supports_selector(index: faiss.Index) -> bool:
+        # A plain PQ scan rejects ID selectors in this FAISS version
+        return not isinstance(index, faiss.IndexPQ)
+
+    def reconstruct_rows(self, rows: np.ndarray) -> np.ndarray:
+        """Vectors of the given rows, at full precision where it is kept"""
+        vectors = np.zeros((len(rows), self.d), dtype="float32")
+        for index, first, _ in self._parts():
+            in_part = (rows >= first) & (rows < first + index.ntotal)
+            if in_part.any():
+                part_rows = np.ascontiguousarray(rows[in_part] - first)
+                if first == 0 and self.exact is not None:
+                    vectors[in_part] = self.exact[part_rows]
+                else:
+                    vectors[in_part] = index.reconstruct_batch(part_rows)
+        return vectors
+
+    def search(self, vectors: np.ndarray, k: int, allowed: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Nearest rows to each query vector; with ``allowed``, only among those rows.
+
+        ``allowed`` must already leave out excluded rows. Small allowed sets
+        are scanned exactly, which is both faster and more accurate than
+        walking an HNSW graph or IVF lists that mostly hold other rows;
+        larger ones are pushed into the index search as an ID selector.
+        """
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        if allowed is not None:
+            allowed = np.ascontiguousarray(allowed, dtype="int64")
+            if len(allowed) <= settings.SEARCH_FILTER_EXACT_MAX_ROWS or not self._supports_selector(self.index):
+                return self._search_exact(vectors, k, allowed)
+
+        # Compressed distances only pick the candidates; exact ones rank them
+        fetch = k * max(settings.FAISS_RERANK_FACTOR, 1) if self.compressed else k
+        results = []
+        for index, first, exclusion in self._parts():
+            if allowed is None:
+                selector = exclusion
+            else:
+                in_part = allowed[(allowed >= first) & (allowed < first + index.ntotal)]
+                if not len(in_part):
+                    continue
+                selector = _RowSelector(in_part - first, exclude=False)
+            if selector is not None and not self._supports_selector(index):
+                # Fetch enough to drop the excluded rows afterwards
+                distances, labels = index.search(vectors, fetch + len(selector.ids))
+                dropped = np.isin(labels, selector.ids)
+                labels = np.where(dropped, -1, labels)
+            else:
+                params = self._search_params(index, selector)
+                if params is None:
+                    distances, labels = index.search(vectors, fetch)
+                else:
+                    distances, labels = index.search(vectors, fetch, params=params)
+            if first:
+                labels = np.where(labels >= 0, labels + first, -1)
+            results.append((distances, labels))
+        distances, labels = _merge(results, fetch, len(vectors))
+        if self.compressed:
+            return self._rerank(vectors, labels, k)
+        return distances, labels
+
+    def _rerank(self, vectors: np.ndarray, candidates: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Re-score each query's candidate rows at full precision and keep the ``k`` nearest"""
+        distances = np.full((len(vectors), k), np.inf, dtype="float32")
+        labels = np.full((len(vectors), k), -1, dtype="int64")
+        for i, (query, rows) in enumerate(zip(vectors, candidates)):
+            rows = rows[rows >= 0]
+            if not len(rows):
+                continue
+            exact = np.sum((self.reconstruct_rows(rows) - query) ** 2, axis=1)
+            order = np.argsort(exact, kind="stable")[:k]
+            distances[i, :len(order)] = exact[order]
+            labels[i, :len(order)] = rows[order]
+        return distances, labels
+
+    def _search_exact(self, vectors: np.ndarray, k: int, allowed: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        distances = np.full((len(vectors), k), np.inf, dtype="float32")
+        labels = np.full((len(vectors), k), -1, dtype="int64")
+        if len(allowed):
+            candidates = self.reconstruct_rows(allowed)
+            found_distances, positions = faiss.knn(vectors, candidates, min(k, len(allowed)))
+            distances[:, :positions.shape[1]] = found_distances
+            labels[:, :positions.shape[1]] = allowed[positions]
+        return distances, labels
+
+    def without_rows(self, rows: np.ndarray) -> "VectorIndex":
+        """A rebuilt copy without ``rows``; later rows move down to close the gaps"""
+        keep = np.ones(self.ntotal, dtype=bool)
+        keep[np.asarray(rows, dtype="int64")] = False
+        index = copy.copy(self)
+        index.excluded = np.zeros(0, dtype="int64")
+        index._rebuild(self.vectors()[keep])
+        return index
+
+    def folded(self) -> "VectorIndex":
+        """An equivalent index with the deltas merged into the base, ready to be written.
+
+        Its ``exact`` vectors are not kept; write them from this index's
+        ``vector_blocks``.
+        """
+        if not self.deltas:
+            return self
+        if self.memory_mapped:
+            raise RuntimeError("A memory-mapped index with added vectors cannot be written")
+        index = copy.copy(self)
+        index.index = faiss.clone_index(self.index)
+        index.exact = None
+        index.deltas = ()
+        index._prepare()
+        delta_vectors = np.vstack([reconstruct_all(delta) for delta in self.deltas])
+        if self.compressed:
+            index.index.add(delta_vectors)
+        else:
+            # May train and compress the index
+            index.add(delta_vectors)
+        index.exact = None
+        index.set_excluded(self.excluded)
+        return index
+
+    def migrate(self) -> bool:
+        """Rebuild the index if its engine or compression differs from the configured one.
+
+        Returns True when the stored vectors were moved to a new index.
+        """
+        current = (self.kind, self.compression_kind)
+        if current == (self.index_type, self.compression) or (
+                self.training_pending and self.ntotal < self._min_train_size()):
+            return False
+        logger.info(f"Migrating FAISS index from {'/'.join(current)} to {self.index_type}/{self.compression} "
+                    f"({self.ntotal} vectors)")
+        self._rebuild(self.vectors())
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {
+            "index_engine": self.index_type,
+            "index_type": type(self.index).__name__,
+            "training_pending": self.training_pending,
+        }
+        if isinstance(self.index, faiss.IndexIVF):
+            stats["nlist"] = self.index.nlist
+            stats["nprobe"] = self.index.nprobe
+        elif isinstance(self.index, faiss.IndexHNSW):
+            stats["ef_search"] = self.index.hnsw.efSearch
+        stats["compression"] = self.compression_kind
+        stats["bytes_per_vector"] = _storage(self.index).code_size
+        stats["deleted_vectors"] = len(self.excluded)
+        stats["memory_mapped"] = self.memory_mapped
+        return stats
+
+    def save(self, path: str):
+        faiss.write_index(self.folded().index, path)
+
+    def serialize(self) -> np.ndarray:
+        return faiss.serialize_index(self.folded().index)
+
+    @classmethod
+    def load(cls, path: str, dimension: Optional[int] = None, index_type: Optional[str] = None,
+             memory_map: bool = False, exact_path: Optional[str] = None) -> "VectorIndex":
+        """Load an index from disk; call ``migrate`` to convert its engine.
+
+        With ``memory_map`` an IVF index's inverted lists are mapped read-only
+        instead of copied, so processes loading the same file share them.
+        FAISS copies flat and HNSW indexes into memory either way.
+        ``exact_path`` is an ``.npy`` file of the full-precision vectors of
+        a compressed index; it is always memory-mapped.
+        """
+        if memory_map:
+            index = faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+            mapped = isinstance(index, faiss.IndexIVF)
+        else:
+            index = faiss.read_index(path)
+            mapped = False
+        loaded = cls(dimension=dimension or index.d, index_type=index_type, index=index, memory_mapped=mapped)
+        if exact_path and loaded.compressed:
+            exact = np.load(exact_path, mmap_mode="r")
+            if len(exact) == index.ntotal:
+                loaded.exact = exact
+            else:
+                logger.warning(f"Ignoring {exact_path}: {len(exact)} vectors for {index.ntotal} index rows")
+        return loaded
+
+    @classmethod
+    def deserialize(cls, data: np.ndarray, index_type: Optional[str] = None) -> "VectorIndex":
+        index = faiss.deserialize_index(data)
+        return cls(dimension=index.d, index_type=index_type, index=index)
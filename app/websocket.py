@@ -3,16 +3,26 @@ from jose import jwt, JWTError
 from app.database import get_mongo_db
 from app.schemas.chat import ChatMessage
 from app.services.llm_service import llm_service
+from app.services.concurrency import ServiceBusyError
+from app.services.chat_history import chat_history_store
+from app.services.tenancy import namespace_for_claims
+from app.services.search_filter import SearchFilter
+from app.services.metrics import chat_stage_seconds, chat_turn_seconds
+from app.config import get_settings
 from motor.motor_asyncio import AsyncIOMotorDatabase
 import os
+import time
+import asyncio
 import logging
-from typing import Dict, List
+from contextlib import aclosing
+from typing import Any, Deque, Dict, Set
 from datetime import datetime
 
 SECRET_KEY = os.getenv("SECRET_KEY", "secret")
 ALGORITHM = "HS256"
 
 logger = logging.getLogger(__name__)
+settings = get_settings()
 active_connections: Dict[str, WebSocket] = {}
 
 # Specific phrases that typically don't need document context
@@ -82,6 +92,30 @@ async def _should_use_rag(user_message: str, message_type: str) -> bool:
     # Default to no RAG for short, unclear messages
     return False
 
+def _format_ai_response(llm_response: Dict, should_use_rag: bool) -> str:
+    """Append the sources list or a no-context note to the LLM answer"""
+    ai_response_content = llm_response["response"]
+    
+    # Add context indicator and sources if available
+    if should_use_rag and llm_response.get("context_used"):
+        if llm_response.get("sources"):
+            # Deduplicate sources by filename
+            unique_sources = {}
+            for source in llm_response["sources"]:
+                filename = source['filename']
+                if filename not in unique_sources:
+                    unique_sources[filename] = source
+            
+            ai_response_content += "\n\n📚 **Sources:**\n"
+            for i, (filename, source) in enumerate(unique_sources.items(), 1):
+                ai_response_content += f"{i}. {filename}\n"
+        else:
+            ai_response_content += "\n\n💡 *I searched your documents but didn't find specific relevant information for this question.*"
+    elif should_use_rag and not llm_response.get("context_used"):
+        ai_response_content += "\n\n📄 *No relevant documents found - answering from general knowledge.*"
+    
+    return ai_response_content
+
 async def get_current_user(websocket: WebSocket, db: AsyncIOMotorDatabase):
     token = websocket.query_params.get("token")
     if not token:
@@ -95,11 +129,147 @@ async def get_current_user(websocket: WebSocket, db: AsyncIOMotorDatabase):
         user = await db["users"].find_one({"email": email})
         if not user:
             raise JWTError()
+        # Index partition this connection searches
+        user["namespace"] = namespace_for_claims(payload)
         return user
     except JWTError:
         await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
         return None
 
+async def _send_busy(websocket: WebSocket, reason: str = "The assistant is busy right now. Please try again in a moment."):
+    """Tell the client its message was not processed because of load"""
+    busy_message = ChatMessage(
+        sender="assistant",
+        message=reason,
+        timestamp=datetime.utcnow()
+    )
+    busy_dict = busy_message.model_dump()
+    busy_dict["timestamp"] = busy_dict["timestamp"].isoformat()
+    busy_dict["type"] = "busy"
+    await websocket.send_json(busy_dict)
+
+async def _handle_turn(websocket: WebSocket, db: AsyncIOMotorDatabase, user: Dict, user_id: str, data: Dict, history: Deque[Dict[str, Any]]):
+    """Store the user's message, generate the answer and send it back.
+
+    ``history`` is the connection's window of recent messages; it is kept
+    in step with what is stored so turns never re-read the conversation.
+    """
+    started = time.perf_counter()
+    user_message = data.get("message", "")
+    message_type = data.get("type", "chat")  # chat or rag
+    stream = bool(data.get("stream", False))  # send the answer as delta frames
+    try:
+        # Optional {"file_ids": [...], "filename": "*.pdf", "uploaded_after": ..., "uploaded_before": ...}
+        search_filter = SearchFilter.from_dict(data.get("filter"))
+    except (TypeError, ValueError) as e:
+        error_message = ChatMessage(sender="assistant", message=f"Invalid filter: {e}", timestamp=datetime.utcnow())
+        error_dict = error_message.model_dump()
+        error_dict["timestamp"] = error_dict["timestamp"].isoformat()
+        error_dict["type"] = "error"
+        await websocket.send_json(error_dict)
+        return
+    
+    # Create user message
+    user_chat_message = ChatMessage(
+        sender=user["email"], 
+        message=user_message, 
+        timestamp=datetime.utcnow()
+    )
+    
+    # The prompt adds the current message itself, so the history sent with it stops before it
+    chat_history = list(history)
+    
+    # Store user message in MongoDB
+    with chat_stage_seconds.time(stage="store_message"):
+        await chat_history_store.append(db, user_id, user_chat_message.model_dump())
+    history.append(user_chat_message.model_dump())
+    
+    # Send user message back to confirm receipt
+    user_message_dict = user_chat_message.model_dump()
+    user_message_dict["timestamp"] = user_message_dict["timestamp"].isoformat()
+    await websocket.send_json(user_message_dict)
+    
+    # Generate AI response
+    try:
+        # Always try RAG first - search for relevant context automatically
+        # Only skip RAG if explicitly requested or if it's a greeting/simple response
+        # A filter names documents to search, so it always uses them
+        with chat_stage_seconds.time(stage="rag_decision"):
+            should_use_rag = search_filter is not None or await _should_use_rag(user_message, message_type)
+        
+        logger.info(f"Processing message: '{user_message[:50]}...' | RAG: {should_use_rag} | Type: {message_type} | Stream: {stream}")
+        
+        if stream:
+            llm_response = None
+            async with aclosing(llm_service.generate_response_stream(
+                user_message,
+                chat_history=chat_history,
+                use_rag=should_use_rag,
+                namespace=user["namespace"],
+                search_filter=search_filter
+            )) as events:
+                async for event in events:
+                    if event["type"] == "delta":
+                        await websocket.send_json({
+                            "type": "delta",
+                            "sender": "assistant",
+                            "delta": event["content"]
+                        })
+                    else:
+                        llm_response = event
+        else:
+            llm_response = await llm_service.generate_response(
+                user_message, 
+                chat_history=chat_history,
+                use_rag=should_use_rag,
+                namespace=user["namespace"],
+                search_filter=search_filter
+            )
+        
+        # Create AI response message
+        ai_response_content = _format_ai_response(llm_response, should_use_rag)
+        
+        ai_message = ChatMessage(
+            sender="assistant",
+            message=ai_response_content,
+            timestamp=datetime.utcnow()
+        )
+        
+        # Store AI message in MongoDB
+        with chat_stage_seconds.time(stage="store_answer"):
+            await chat_history_store.append(db, user_id, ai_message.model_dump())
+        history.append(ai_message.model_dump())
+        
+        # Send AI response
+        ai_message_dict = ai_message.model_dump()
+        ai_message_dict["timestamp"] = ai_message_dict["timestamp"].isoformat()
+        ai_message_dict["llm_metadata"] = {
+            "sources": llm_response.get("sources", []),
+            "context_used": llm_response.get("context_used", False),
+            "context_tokens": llm_response.get("context_tokens"),
+            "cached": llm_response.get("cached", False),
+            "model": llm_response.get("model", "unknown")
+        }
+        if stream:
+            # Complete message that replaces the streamed deltas
+            ai_message_dict["type"] = "final"
+        chat_turn_seconds.observe(time.perf_counter() - started, stream=str(stream).lower())
+        await websocket.send_json(ai_message_dict)
+        
+    except ServiceBusyError as e:
+        logger.warning(f"Rejecting chat turn for {user_id}: {e}")
+        await _send_busy(websocket)
+    except Exception as e:
+        logger.error(f"Error generating AI response: {e}")
+        error_message = ChatMessage(
+            sender="assistant",
+            message="I apologize, but I encountered an error. Please try again.",
+            timestamp=datetime.utcnow()
+        )
+        error_dict = error_message.model_dump()
+        error_dict["timestamp"] = error_dict["timestamp"].isoformat()
+        await websocket.send_json(error_dict)
+
 async def websocket_endpoint(websocket: WebSocket, db: AsyncIOMotorDatabase):
     user = await get_current_user(websocket, db)
     if not user:
@@ -107,103 +277,24 @@ async def websocket_endpoint(websocket: WebSocket, db: AsyncIOMotorDatabase):
     user_id = str(user["_id"])
     await websocket.accept()
     active_connections[user_id] = websocket
+    with chat_stage_seconds.time(stage="history_load"):
+        history = await chat_history_store.load_window(db, user_id)
+    # Turns run as tasks so the connection can keep reading (and refuse
+    # messages beyond the per-connection limit) while an answer is generated
+    in_flight: Set[asyncio.Task] = set()
     try:
         while True:
             data = await websocket.receive_json()
-            user_message = data.get("message", "")
-            message_type = data.get("type", "chat")  # chat or rag
-            
-            # Create user message
-            user_chat_message = ChatMessage(
-                sender=user["email"], 
-                message=user_message, 
-                timestamp=datetime.utcnow()
-            )
-            
-            # Store user message in MongoDB
-            await db["chats"].update_one(
-                {"user_id": user_id},
-                {"$push": {"messages": user_chat_message.model_dump()}},
-                upsert=True
-            )
-            
-            # Send user message back to confirm receipt
-            user_message_dict = user_chat_message.model_dump()
-            user_message_dict["timestamp"] = user_message_dict["timestamp"].isoformat()
-            await websocket.send_json(user_message_dict)
+            if len(in_flight) >= settings.WS_MAX_IN_FLIGHT_PER_CONNECTION:
+                await _send_busy(websocket, "Please wait for the current answer before sending another message.")
+                continue
             
-            # Get chat history for context
-            chat_doc = await db["chats"].find_one({"user_id": user_id})
-            chat_history = chat_doc.get("messages", []) if chat_doc else []
-            
-            # Generate AI response
-            try:
-                # Always try RAG first - search for relevant context automatically
-                # Only skip RAG if explicitly requested or if it's a greeting/simple response
-                should_use_rag = await _should_use_rag(user_message, message_type)
-                
-                logger.info(f"Processing message: '{user_message[:50]}...' | RAG: {should_use_rag} | Type: {message_type}")
-                
-                llm_response = await llm_service.generate_response(
-                    user_message, 
-                    chat_history=chat_history[-20:],  # Last 20 messages for context
-                    use_rag=should_use_rag
-                )
-                
-                # Create AI response message
-                ai_response_content = llm_response["response"]
-                
-                # Add context indicator and sources if available
-                if should_use_rag and llm_response.get("context_used"):
-                    if llm_response.get("sources"):
-                        # Deduplicate sources by filename
-                        unique_sources = {}
-                        for source in llm_response["sources"]:
-                            filename = source['filename']
-                            if filename not in unique_sources:
-                                unique_sources[filename] = source
-                        
-                        ai_response_content += "\n\n📚 **Sources:**\n"
-                        for i, (filename, source) in enumerate(unique_sources.items(), 1):
-                            ai_response_content += f"{i}. {filename}\n"
-                    else:
-                        ai_response_content += "\n\n💡 *I searched your documents but didn't find specific relevant information for this question.*"
-                elif should_use_rag and not llm_response.get("context_used"):
-                    ai_response_content += "\n\n📄 *No relevant documents found - answering from general knowledge.*"
-                
-                ai_message = ChatMessage(
-                    sender="assistant",
-                    message=ai_response_content,
-                    timestamp=datetime.utcnow()
-                )
-                
-                # Store AI message in MongoDB
-                await db["chats"].update_one(
-                    {"user_id": user_id},
-                    {"$push": {"messages": ai_message.model_dump()}},
-                    upsert=True
-                )
-                
-                # Send AI response
-                ai_message_dict = ai_message.model_dump()
-                ai_message_dict["timestamp"] = ai_message_dict["timestamp"].isoformat()
-                ai_message_dict["llm_metadata"] = {
-                    "sources": llm_response.get("sources", []),
-                    "context_used": llm_response.get("context_used", False),
-                    "model": llm_response.get("model", "unknown")
-                }
-                await websocket.send_json(ai_message_dict)
-                
-            except Exception as e:
-                logger.error(f"Error generating AI response: {e}")
-                error_message = ChatMessage(
-                    sender="assistant",
-                    message="I apologize, but I encountered an error. Please try again.",
-                    timestamp=datetime.utcnow()
-                )
-                error_dict = error_message.model_dump()
-                error_dict["timestamp"] = error_dict["timestamp"].isoformat()
-                await websocket.send_json(error_dict)
+            task = asyncio.create_task(_handle_turn(websocket, db, user, user_id, data, history))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
                 
     except WebSocketDisconnect:
-        active_connections.pop(user_id, None) 
\ No newline at end of file
+        active_connections.pop(user_id, None)
+    finally:
+        for task in in_flight:
+            task.cancel()
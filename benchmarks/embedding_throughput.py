@@ -0,0 +1,94 @@
+"""
+Embedding throughput: one blocking call per upload vs the shared scheduler.
+
+Usage:
+    python -m benchmarks.embedding_throughput --uploads 8 --chunks 300
+
+Starts the fake OpenAI server in-process (rate limited to
+``--max-concurrent`` requests), then embeds ``--uploads`` documents at once,
+first the old way (each upload sends all of its chunks in a single request)
+and then through ``EmbeddingScheduler``.
+"""
+
+import argparse
+import asyncio
+import time
+
+import openai
+
+from app.services.embedding_scheduler import EmbeddingScheduler
+from benchmarks.fake_openai import FakeConfig, serve_in_background
+
+
+def make_documents(uploads: int, chunks: int):
+    return [
+        [f"upload {u} chunk {c} " + "lorem ipsum dolor sit amet " * 30 for c in range(chunks)]
+        for u in range(uploads)
+    ]
+
+
+async def run_naive(client: openai.AsyncOpenAI, documents) -> float:
+    async def embed_upload(texts):
+        for attempt in range(20):
+            try:
+                return await client.embeddings.create(model="text-embedding-ada-002", input=texts)
+            except openai.RateLimitError:
+                await asyncio.sleep(0.5 * 2 ** min(attempt, 4))
+        raise RuntimeError("gave up after repeated 429s")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(embed_upload(texts) for texts in documents))
+    return time.perf_counter() - start
+
+
+async def run_scheduled(client: openai.AsyncOpenAI, documents, args) -> tuple:
+    async def embed_batch(texts):
+        response = await client.embeddings.create(model="text-embedding-ada-002", input=texts)
+        return [item.embedding for item in response.data]
+
+    scheduler = EmbeddingScheduler(
+        embed_batch,
+        max_batch_size=args.batch_size,
+        max_concurrency=args.concurrency,
+        backoff_base=0.1,
+    )
+    start = time.perf_counter()
+    await asyncio.gather(*(scheduler.embed(texts) for texts in documents))
+    return time.perf_counter() - start, scheduler.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uploads", type=int, default=8)
+    parser.add_argument("--chunks", type=int, default=300)
+    parser.add_argument("--dimension", type=int, default=64,
+                        help="small vectors keep JSON encoding from dominating the run")
+    parser.add_argument("--latency-ms", type=float, default=100.0)
+    parser.add_argument("--per-input-ms", type=float, default=2.0)
+    parser.add_argument("--max-concurrent", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=128)
+    args = parser.parse_args()
+
+    base_url = serve_in_background(FakeConfig(
+        dimension=args.dimension,
+        latency_ms=args.latency_ms,
+        per_input_ms=args.per_input_ms,
+        max_concurrent=args.max_concurrent,
+    ))
+    client = openai.AsyncOpenAI(api_key="fake", base_url=base_url, max_retries=0)
+    documents = make_documents(args.uploads, args.chunks)
+    total = args.uploads * args.chunks
+
+    naive = asyncio.run(run_naive(client, documents))
+    client = openai.AsyncOpenAI(api_key="fake", base_url=base_url, max_retries=0)
+    scheduled, stats = asyncio.run(run_scheduled(client, documents, args))
+
+    print(f"{args.uploads} uploads x {args.chunks} chunks, server limit {args.max_concurrent} concurrent requests")
+    print(f"one request per upload : {naive:6.2f}s  {total / naive:8.1f} chunks/s")
+    print(f"embedding scheduler    : {scheduled:6.2f}s  {total / scheduled:8.1f} chunks/s  "
+          f"({stats['batches']} batches, {stats['rate_limited']} rate limited)")
+
+
+if __name__ == "__main__":
+    main()
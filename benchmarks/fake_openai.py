@@ -0,0 +1,226 @@
+"""
+Local stand-in for the OpenAI API, for load tests that must not cost money.
+
+Usage:
+    python -m benchmarks.fake_openai --port 8100 --latency-ms 150 --max-concurrent 4
+
+Point the app at it with ``OPENAI_API_BASE=http://localhost:8100/v1`` and any
+``OPENAI_API_KEY``. Embeddings are deterministic (seeded from the input) and
+unit length. Chat completions answer with ``--reply-tokens`` words after
+``--first-token-ms``, then one word every ``--token-ms`` (streamed as
+server-sent events when the request asks for ``stream``). Requests beyond
+``--max-concurrent`` get a 429 with Retry-After, like a rate-limited account.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import socket
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, Dict, List, Union
+
+import numpy as np
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+@dataclass
+class FakeConfig:
+    dimension: int = 1536
+    latency_ms: float = 150.0
+    per_input_ms: float = 0.5
+    max_concurrent: int = 0  # 0 disables the rate limit
+    retry_after_seconds: float = 0.5
+    first_token_ms: float = 300.0
+    token_ms: float = 20.0
+    reply_tokens: int = 60
+
+
+def fake_embedding(value: Union[str, List[int]], dimension: int) -> List[float]:
+    """Deterministic unit vector for a string or a list of token ids"""
+    digest = hashlib.sha256(json.dumps(value).encode("utf-8")).digest()
+    rng = np.random.default_rng(int.from_bytes(digest[:8], "little"))
+    vector = rng.normal(size=dimension)
+    return (vector / np.linalg.norm(vector)).astype("float32").tolist()
+
+
+_WORDS = ("the", "index", "answer", "document", "chunk", "search", "context", "model",
+          "upload", "vector", "token", "result", "query", "source", "stream", "batch")
+
+
+def fake_reply(messages: List[Dict[str, Any]], tokens: int) -> List[str]:
+    """Deterministic reply to a conversation, as a list of one-word tokens"""
+    digest = hashlib.sha256(json.dumps(messages, sort_keys=True).encode("utf-8")).digest()
+    rng = np.random.default_rng(int.from_bytes(digest[:8], "little"))
+    words = rng.choice(len(_WORDS), size=tokens)
+    return [(" " if i else "") + _WORDS[w] for i, w in enumerate(words)]
+
+
+def _prompt_tokens(messages: List[Dict[str, Any]]) -> int:
+    return sum(len(str(message.get("content") or "")) // 4 + 4 for message in messages)
+
+
+def create_app(config: FakeConfig = None) -> FastAPI:
+    config = config or FakeConfig()
+    app = FastAPI(title="Fake OpenAI API")
+    app.state.config = config
+    app.state.active = 0
+    app.state.requests = 0
+    app.state.rate_limited = 0
+
+    app.state.chat_requests = 0
+
+    def rate_limited():
+        app.state.rate_limited += 1
+        return JSONResponse(
+            status_code=429,
+            content={"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+            headers={"retry-after": str(config.retry_after_seconds)},
+        )
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        inputs: Any = body["input"]
+        if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        app.state.requests += 1
+        if config.max_concurrent and app.state.active >= config.max_concurrent:
+            return rate_limited()
+        app.state.active += 1
+        try:
+            await asyncio.sleep((config.latency_ms + config.per_input_ms * len(inputs)) / 1000)
+        finally:
+            app.state.active -= 1
+        tokens = sum(len(item) // 4 + 1 if isinstance(item, str) else len(item) for item in inputs)
+        return {
+            "object": "list",
+            "data": [
+                {"object": "embedding", "index": i, "embedding": fake_embedding(item, config.dimension)}
+                for i, item in enumerate(inputs)
+            ],
+            "model": body.get("model", "text-embedding-ada-002"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        }
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        messages = body.get("messages", [])
+        model = body.get("model", "gpt-3.5-turbo")
+        app.state.requests += 1
+        app.state.chat_requests += 1
+        if config.max_concurrent and app.state.active >= config.max_concurrent:
+            return rate_limited()
+        reply = fake_reply(messages, config.reply_tokens)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        usage = {
+            "prompt_tokens": _prompt_tokens(messages),
+            "completion_tokens": len(reply),
+            "total_tokens": _prompt_tokens(messages) + len(reply),
+        }
+
+        if not body.get("stream"):
+            app.state.active += 1
+            try:
+                await asyncio.sleep((config.first_token_ms + config.token_ms * max(len(reply) - 1, 0)) / 1000)
+            finally:
+                app.state.active -= 1
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(reply)},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage,
+            }
+
+        def chunk(delta: Dict[str, Any], finish_reason=None) -> str:
+            payload = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            return f"data: {json.dumps(payload)}\n\n"
+
+        async def events():
+            app.state.active += 1
+            try:
+                await asyncio.sleep(config.first_token_ms / 1000)
+                yield chunk({"role": "assistant", "content": ""})
+                for i, token in enumerate(reply):
+                    if i:
+                        await asyncio.sleep(config.token_ms / 1000)
+                    yield chunk({"content": token})
+                yield chunk({}, finish_reason="stop")
+                yield "data: [DONE]\n\n"
+            finally:
+                app.state.active -= 1
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/stats")
+    async def stats():
+        return {
+            "requests": app.state.requests,
+            "chat_requests": app.state.chat_requests,
+            "rate_limited": app.state.rate_limited,
+            "active": app.state.active,
+        }
+
+    return app
+
+
+def serve_in_background(config: FakeConfig = None, host: str = "127.0.0.1") -> str:
+    """Run the fake server on a free port in a daemon thread; returns its ``/v1`` base URL"""
+    import uvicorn
+
+    with socket.socket() as sock:
+        sock.bind((host, 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(create_app(config), host=host, port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://{host}:{port}/v1"
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--dimension", type=int, default=1536)
+    parser.add_argument("--latency-ms", type=float, default=150.0)
+    parser.add_argument("--per-input-ms", type=float, default=0.5)
+    parser.add_argument("--max-concurrent", type=int, default=0)
+    parser.add_argument("--first-token-ms", type=float, default=300.0)
+    parser.add_argument("--token-ms", type=float, default=20.0)
+    parser.add_argument("--reply-tokens", type=int, default=60)
+    args = parser.parse_args()
+    config = FakeConfig(
+        dimension=args.dimension,
+        latency_ms=args.latency_ms,
+        per_input_ms=args.per_input_ms,
+        max_concurrent=args.max_concurrent,
+        first_token_ms=args.first_token_ms,
+        token_ms=args.token_ms,
+        reply_tokens=args.reply_tokens,
+    )
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Recall, latency and memory report for the configurable FAISS index engines
+and compressions.
+
+Usage:
+    python -m benchmarks.index_recall                     # synthetic vectors
+    python -m benchmarks.index_recall --index data/faiss_index/base-000042/index.faiss
+
+Every engine is measured against exact (flat) search results, sweeping the
+IVF ``nprobe`` and HNSW ``efSearch`` knobs so a deployment can pick the
+cheapest setting that still meets its recall target. Compressed flat
+indexes are measured with and without re-ranking (``rerank x1`` ranks by
+the compressed distances alone); ``MB`` is the index's size in memory, per
+worker process, excluding the full-precision vectors a compressed index
+reads from disk when re-ranking.
+"""
+
+import argparse
+import time
+from typing import List
+
+import faiss
+import numpy as np
+
+from app.services import vector_index
+from app.services.vector_index import VectorIndex, reconstruct_all
+
+
+def synthetic_vectors(n: int, dimension: int, clusters: int = 64, seed: int = 0) -> np.ndarray:
+    """Clustered gaussian vectors, closer to real embeddings than uniform noise"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dimension)).astype("float32")
+    assignment = rng.integers(0, clusters, size=n)
+    vectors = centers[assignment] + 0.3 * rng.normal(size=(n, dimension)).astype("float32")
+    return vectors.astype("float32")
+
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+    return hits / truth.size
+
+
+def measure(index: VectorIndex, queries: np.ndarray, truth: np.ndarray, k: int) -> dict:
+    latencies = []
+    found = []
+    for query in queries:
+        start = time.perf_counter()
+        _, ids = index.search(query.reshape(1, -1), k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        found.append(ids[0])
+    return {
+        "recall": recall_at_k(np.array(found), truth),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+    }
+
+
+def index_mb(index: VectorIndex) -> float:
+    return len(faiss.serialize_index(index.index)) / 1024 / 1024
+
+
+def pq_subquantizers(dimension: int, configured: int) -> int:
+    """Largest PQ sub-quantizer count up to ``configured`` that divides the dimension"""
+    return next(m for m in range(min(configured, dimension), 0, -1) if dimension % m == 0)
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index", help="existing index.faiss to take vectors from")
+    parser.add_argument("--vectors", type=int, default=20000, help="synthetic corpus size")
+    parser.add_argument("--dimension", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[16, 32, 64, 128])
+    parser.add_argument("--compressions", nargs="+", default=["fp16", "sq8", "pq"],
+                        choices=["fp16", "sq8", "pq"])
+    parser.add_argument("--rerank-factor", type=int, nargs="+", default=[1, 4, 16, 64])
+    args = parser.parse_args(argv)
+
+    if args.index:
+        vectors = reconstruct_all(faiss.read_index(args.index))
+    else:
+        vectors = synthetic_vectors(args.vectors + args.queries, args.dimension)
+    rng = np.random.default_rng(1)
+    query_ids = rng.choice(len(vectors), size=min(args.queries, len(vectors) // 10 or 1), replace=False)
+    queries = vectors[query_ids] + 0.05 * rng.normal(size=(len(query_ids), vectors.shape[1])).astype("float32")
+    dimension = vectors.shape[1]
+
+    exact = VectorIndex(dimension=dimension, index_type="flat", compression="none")
+    exact.add(vectors)
+    _, truth = exact.search(queries, args.k)
+
+    rows = [("flat", "-", measure(exact, queries, truth, args.k), 0.0, index_mb(exact))]
+
+    start = time.perf_counter()
+    ivf = VectorIndex(dimension=dimension, index_type="ivf_flat", compression="none")
+    ivf.add(vectors)
+    ivf_build = time.perf_counter() - start
+    if ivf.training_pending:
+        print(f"ivf_flat skipped: {len(vectors)} vectors is below the IVF training size")
+    else:
+        for nprobe in args.nprobe:
+            ivf.index.nprobe = min(nprobe, ivf.index.nlist)
+            rows.append(("ivf_flat", f"nprobe={ivf.index.nprobe}", measure(ivf, queries, truth, args.k),
+                         ivf_build, index_mb(ivf)))
+
+    start = time.perf_counter()
+    hnsw = VectorIndex(dimension=dimension, index_type="hnsw", compression="none")
+    hnsw.add(vectors)
+    hnsw_build = time.perf_counter() - start
+    for ef_search in args.ef_search:
+        hnsw.index.hnsw.efSearch = ef_search
+        rows.append(("hnsw", f"efSearch={ef_search}", measure(hnsw, queries, truth, args.k),
+                     hnsw_build, index_mb(hnsw)))
+
+    pq_m = pq_subquantizers(dimension, vector_index.settings.FAISS_PQ_M)
+    if "pq" in args.compressions and pq_m != vector_index.settings.FAISS_PQ_M:
+        print(f"pq: FAISS_PQ_M={vector_index.settings.FAISS_PQ_M} does not divide dimension {dimension}, "
+              f"using {pq_m} sub-quantizers")
+        vector_index.settings.FAISS_PQ_M = pq_m
+    for compression in args.compressions:
+        start = time.perf_counter()
+        compressed = VectorIndex(dimension=dimension, index_type="flat", compression=compression)
+        compressed.add(vectors)
+        build = time.perf_counter() - start
+        if compressed.training_pending:
+            print(f"{compression} skipped: {len(vectors)} vectors is below its training size")
+            continue
+        for factor in args.rerank_factor:
+            vector_index.settings.FAISS_RERANK_FACTOR = factor
+            rows.append((f"flat/{compression}", f"rerank x{factor}", measure(compressed, queries, truth, args.k),
+                         build, index_mb(compressed)))
+
+    print(f"{len(vectors)} vectors, dimension {dimension}, {len(queries)} queries, recall@{args.k}")
+    print(f"{'engine':<10} {'params':<14} {'recall':>7} {'p50 ms':>8} {'p95 ms':>8} {'build s':>8} {'MB':>8}")
+    for engine, params, result, build, mb in rows:
+        print(f"{engine:<10} {params:<14} {result['recall']:>7.3f} {result['p50_ms']:>8.3f} "
+              f"{result['p95_ms']:>8.3f} {build:>8.1f} {mb:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
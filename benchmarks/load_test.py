@@ -0,0 +1,391 @@
+"""
+End-to-end load test against a running app, with no OpenAI costs.
+
+Usage:
+    python -m benchmarks.load_test --mongodb-uri mongodb://localhost:27017 --sessions 20 --turns 5
+    python -m benchmarks.load_test --app-url http://localhost:8000 --sessions 50 --json run.json
+    python -m benchmarks.load_test ... --baseline run.json --tolerance 0.2
+
+Starts the fake OpenAI server in-process and the app itself (``uvicorn
+main:app`` with ``--workers``) in a scratch directory against a fresh
+``MONGODB_DB``, with ``INDEX_PARTITION_BY=none`` so every session searches
+the uploaded files. With ``--app-url`` an app that is already running is
+tested instead; start it against ``python -m benchmarks.fake_openai``. It
+then uploads every file in ``--data`` at once and waits until they are
+processed, and runs ``--sessions`` concurrent ``/ws/chat`` connections
+sending ``--turns`` streamed messages each.
+
+Reports ingestion chunks/s, chat time to first delta and full turn latency
+(p50/p95/p99) and the resident memory of the app's processes (peak and at
+the end). With ``--baseline`` the run fails (exit code 1) when a latency or
+memory figure is more than ``--tolerance`` worse, or throughput that much
+lower, than in the baseline's ``--json`` report.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+import numpy as np
+import websockets
+
+from benchmarks.fake_openai import FakeConfig, serve_in_background
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+QUESTIONS = [
+    "Which toppings does a Margherita pizza have?",
+    "What is a vegetarian pizza according to the ontology?",
+    "Summarise the main classes in the knowledge base",
+    "How is the dynamic-wave flow model coupled with the GPU solver?",
+    "List the properties used to describe a pizza base",
+    "What does the kbchat dataset contain?",
+]
+
+# Figures where larger is worse; ingestion throughput is the only one where larger is better
+LOWER_IS_BETTER = [
+    "ttfb_p50_ms", "ttfb_p95_ms", "ttfb_p99_ms",
+    "turn_p50_ms", "turn_p95_ms", "turn_p99_ms",
+    "peak_rss_mb",
+]
+HIGHER_IS_BETTER = ["ingest_chunks_per_second"]
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _children(pid: int) -> List[int]:
+    """``pid`` and all of its descendants (uvicorn workers, extraction pool)"""
+    parents: Dict[int, List[int]] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces; fields resume after its ')'
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        parents.setdefault(ppid, []).append(int(entry))
+    found = [pid]
+    for current in found:
+        found.extend(parents.get(current, []))
+    return found
+
+
+def _rss_mb(pids: List[int]) -> float:
+    total_kb = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total_kb += int(line.split()[1])
+                        break
+        except OSError:
+            continue
+    return total_kb / 1024
+
+
+class MemorySampler:
+    """Samples the summed resident memory of a process tree in a background thread"""
+
+    def __init__(self, pid: Optional[int], interval: float = 0.5):
+        self.pid = pid
+        self.interval = interval
+        self.peak_mb = 0.0
+        self.last_mb = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        if self.pid is not None and os.path.isdir("/proc"):
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.last_mb = _rss_mb(_children(self.pid))
+            self.peak_mb = max(self.peak_mb, self.last_mb)
+            self._stop.wait(self.interval)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+
+def start_app(args, openai_base_url: str, workdir: str) -> Tuple[subprocess.Popen, str]:
+    """Run the app in ``workdir`` (its ``data/`` goes there); returns the process and its URL"""
+    port = _free_port()
+    env = {
+        **os.environ,
+        "PYTHONPATH": REPO_ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""),
+        "OPENAI_API_KEY": "fake",
+        "OPENAI_API_BASE": openai_base_url,
+        "MONGODB_URI": args.mongodb_uri,
+        "MONGODB_DB": f"load_test_{uuid.uuid4().hex[:8]}",
+        "INDEX_PARTITION_BY": "none",
+    }
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(args.workers), "--log-level", "warning"],
+        cwd=workdir, env=env, start_new_session=True,
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"app exited with code {process.returncode}")
+        try:
+            if httpx.get(f"{url}/health", timeout=1).status_code == 200:
+                return process, url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.25)
+    stop_app(process)
+    raise RuntimeError("app did not become healthy within 60s")
+
+
+def stop_app(process: subprocess.Popen):
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+async def register(client: httpx.AsyncClient, email: str) -> str:
+    credentials = {"email": email, "password": "load-test-password"}
+    response = await client.post("/api/v1/auth/register", json=credentials)
+    if response.status_code == 400:
+        response = await client.post("/api/v1/auth/login", json=credentials)
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+
+def data_files(path: str) -> List[str]:
+    return sorted(
+        os.path.join(root, name)
+        for root, _, names in os.walk(path)
+        for name in names
+        if not name.startswith(".")
+    )
+
+
+async def run_ingestion(client: httpx.AsyncClient, token: str, files: List[str], timeout: float) -> Dict[str, Any]:
+    headers = {"Authorization": f"Bearer {token}"}
+
+    async def upload(path: str) -> str:
+        with open(path, "rb") as f:
+            response = await client.post(
+                "/api/v1/upload/", headers=headers, files={"file": (os.path.basename(path), f.read())}
+            )
+        response.raise_for_status()
+        return response.json()["file_id"]
+
+    start = time.perf_counter()
+    file_ids = await asyncio.gather(*(upload(path) for path in files))
+    pending = set(file_ids)
+    chunks = 0
+    failed = 0
+    deadline = time.monotonic() + timeout
+    while pending and time.monotonic() < deadline:
+        await asyncio.sleep(0.5)
+        for file_id in list(pending):
+            status = (await client.get(f"/api/v1/upload/status/{file_id}", headers=headers)).json()
+            if status["status"] == "processed":
+                chunks += status.get("chunks_count") or 0
+                pending.discard(file_id)
+            elif status["status"] in ("failed", "deleted", "replaced"):
+                failed += 1
+                pending.discard(file_id)
+    elapsed = time.perf_counter() - start
+    return {
+        "files": len(files),
+        "failed_files": failed,
+        "unfinished_files": len(pending),
+        "chunks": chunks,
+        "ingest_seconds": elapsed,
+        "ingest_chunks_per_second": chunks / elapsed if elapsed else 0.0,
+    }
+
+
+async def run_session(ws_url: str, token: str, session: int, turns: int, timeout: float,
+                      results: Dict[str, List[float]], outcomes: Dict[str, int]):
+    async with websockets.connect(f"{ws_url}/ws/chat?token={token}", max_size=None) as ws:
+        for turn in range(turns):
+            question = QUESTIONS[(session + turn) % len(QUESTIONS)]
+            start = time.perf_counter()
+            await ws.send(json.dumps({"message": question, "stream": True}))
+            first_delta = None
+            outcome = "timeout"
+            try:
+                while True:
+                    frame = json.loads(await asyncio.wait_for(ws.recv(), timeout))
+                    kind = frame.get("type")
+                    if kind == "delta":
+                        if first_delta is None:
+                            first_delta = time.perf_counter()
+                    elif kind == "final":
+                        outcome = "completed"
+                        break
+                    elif kind in ("busy", "error") or (kind is None and frame.get("sender") == "assistant"):
+                        # Errors without a type are the generic apology message
+                        outcome = kind or "error"
+                        break
+            except asyncio.TimeoutError:
+                pass
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+            if outcome != "completed":
+                continue
+            if first_delta is not None:
+                results["ttfb"].append((first_delta - start) * 1000)
+            results["turn"].append((time.perf_counter() - start) * 1000)
+
+
+async def run_chat(app_url: str, client: httpx.AsyncClient, args) -> Dict[str, Any]:
+    ws_url = "ws" + app_url[len("http"):]
+    run_id = uuid.uuid4().hex[:8]
+    tokens = await asyncio.gather(*(
+        register(client, f"load-{run_id}-{n}@example.com") for n in range(args.sessions)
+    ))
+    results: Dict[str, List[float]] = {"ttfb": [], "turn": []}
+    outcomes: Dict[str, int] = {}
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        run_session(ws_url, token, n, args.turns, args.turn_timeout, results, outcomes)
+        for n, token in enumerate(tokens)
+    ))
+    elapsed = time.perf_counter() - start
+    report: Dict[str, Any] = {
+        "sessions": args.sessions,
+        "turns": args.sessions * args.turns,
+        "outcomes": outcomes,
+        "turns_per_second": outcomes.get("completed", 0) / elapsed if elapsed else 0.0,
+    }
+    for name, values in results.items():
+        for p in (50, 95, 99):
+            report[f"{name}_p{p}_ms"] = float(np.percentile(values, p)) if values else None
+    return report
+
+
+async def run(app_url: str, args) -> Dict[str, Any]:
+    async with httpx.AsyncClient(base_url=app_url, timeout=120) as client:
+        report: Dict[str, Any] = {}
+        if not args.skip_ingest:
+            token = await register(client, f"load-{uuid.uuid4().hex[:8]}-uploader@example.com")
+            report.update(await run_ingestion(client, token, data_files(args.data), args.ingest_timeout))
+        report.update(await run_chat(app_url, client, args))
+        return report
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Figures that regressed by more than ``tolerance`` (a fraction) against ``baseline``"""
+    regressions = []
+    for key in LOWER_IS_BETTER + HIGHER_IS_BETTER:
+        old, new = baseline.get(key), report.get(key)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        if key in HIGHER_IS_BETTER:
+            change = -change
+        if change > tolerance:
+            regressions.append(f"{key}: {old:.1f} -> {new:.1f} ({change:+.0%} worse)")
+    return regressions
+
+
+def print_report(report: Dict[str, Any]):
+    def ms(key):
+        value = report.get(key)
+        return f"{value:8.0f}" if value is not None else "       -"
+
+    if "chunks" in report:
+        print(f"ingestion: {report['files']} files ({report['failed_files']} failed, "
+              f"{report['unfinished_files']} unfinished), {report['chunks']} chunks in "
+              f"{report['ingest_seconds']:.1f}s = {report['ingest_chunks_per_second']:.1f} chunks/s")
+    print(f"chat: {report['sessions']} sessions, {report['turns']} turns, outcomes {report['outcomes']}, "
+          f"{report['turns_per_second']:.1f} turns/s")
+    print(f"{'':18}{'p50':>8}{'p95':>8}{'p99':>8}")
+    print(f"{'first delta (ms)':18}{ms('ttfb_p50_ms')}{ms('ttfb_p95_ms')}{ms('ttfb_p99_ms')}")
+    print(f"{'full turn (ms)':18}{ms('turn_p50_ms')}{ms('turn_p95_ms')}{ms('turn_p99_ms')}")
+    if report.get("peak_rss_mb"):
+        print(f"app memory: peak {report['peak_rss_mb']:.0f} MB, at end {report['final_rss_mb']:.0f} MB RSS")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app-url", help="test an app that is already running instead of starting one")
+    parser.add_argument("--app-pid", type=int, help="with --app-url, the app's process for memory figures")
+    parser.add_argument("--mongodb-uri", default="mongodb://localhost:27017")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--data", default=os.path.join(REPO_ROOT, "test-data"))
+    parser.add_argument("--skip-ingest", action="store_true")
+    parser.add_argument("--ingest-timeout", type=float, default=600.0)
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--turn-timeout", type=float, default=120.0)
+    parser.add_argument("--dimension", type=int, default=1536)
+    parser.add_argument("--embedding-latency-ms", type=float, default=150.0)
+    parser.add_argument("--first-token-ms", type=float, default=300.0)
+    parser.add_argument("--token-ms", type=float, default=20.0)
+    parser.add_argument("--reply-tokens", type=int, default=60)
+    parser.add_argument("--max-concurrent", type=int, default=0, help="fake OpenAI rate limit (0 = none)")
+    parser.add_argument("--json", help="write the report to this file")
+    parser.add_argument("--baseline", help="report from an earlier --json run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="load-test-") as workdir:
+        process, app_url = None, args.app_url
+        if app_url is None:
+            openai_base_url = serve_in_background(FakeConfig(
+                dimension=args.dimension,
+                latency_ms=args.embedding_latency_ms,
+                max_concurrent=args.max_concurrent,
+                first_token_ms=args.first_token_ms,
+                token_ms=args.token_ms,
+                reply_tokens=args.reply_tokens,
+            ))
+            process, app_url = start_app(args, openai_base_url, workdir)
+        sampler = MemorySampler(process.pid if process else args.app_pid).start()
+        try:
+            report = asyncio.run(run(app_url, args))
+        finally:
+            sampler.stop()
+            if process is not None:
+                stop_app(process)
+    report["peak_rss_mb"] = sampler.peak_mb or None
+    report["final_rss_mb"] = sampler.last_mb or None
+
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Time and peak memory of RDF text extraction on a generated ontology.
+
+Usage:
+    python -m benchmarks.rdf_extraction --classes 50000
+    python -m benchmarks.rdf_extraction --file ontology.nt
+
+Compares the original extractor (an rdfs:label lookup per term on an
+in-memory rdflib graph), the graph extractor with a precomputed label
+table, and the streaming N-Triples path that never builds a graph. Each
+method runs in a fresh process so peak RSS is measured independently.
+"""
+
+import argparse
+import os
+import resource
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List
+
+import rdflib
+
+from app.services.extraction import _extract_from_rdf, _iter_ntriples
+
+RDFS = "http://www.w3.org/2000/01/rdf-schema#"
+
+
+def generate_ontology(path: str, classes: int):
+    """Class hierarchy with a label, a parent and a comment per class"""
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(classes):
+            node = f"<http://example.org/onto#C{i}>"
+            f.write(f'{node} <{RDFS}label> "Concept number {i}"@en .\n')
+            if i:
+                f.write(f"{node} <{RDFS}subClassOf> <http://example.org/onto#C{(i - 1) // 4}> .\n")
+            f.write(f'{node} <{RDFS}comment> "Generated class {i} for the extraction benchmark." .\n')
+
+
+def per_term_lookup(path: str) -> str:
+    """The extractor as it was: one g.triples() label lookup per term"""
+    label_predicate = rdflib.term.URIRef(f"{RDFS}label")
+
+    def get_label(term, g):
+        if isinstance(term, (rdflib.term.URIRef, rdflib.term.BNode)):
+            for _, _, lbl in g.triples((term, label_predicate, None)):
+                return str(lbl)
+            return str(term).split("/")[-1].split("#")[-1]
+        return str(term)
+
+    g = rdflib.Graph()
+    g.parse(path)
+    return "\n".join(f"{get_label(s, g)} {get_label(p, g)} {get_label(o, g)}." for s, p, o in g)
+
+
+def label_table(path: str) -> str:
+    return _extract_from_rdf(Path(path))
+
+
+def streaming(path: str) -> str:
+    return "".join(_iter_ntriples(Path(path)))
+
+
+METHODS = {
+    "per-term lookup (graph)": per_term_lookup,
+    "label table (graph)": label_table,
+    "streaming N-Triples": streaming,
+}
+
+
+def _run(name: str, path: str):
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    text = METHODS[name](path)
+    seconds = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KiB on Linux
+    return seconds, (peak - before) / 1024, len(text.splitlines())
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--file", help="existing N-Triples file to extract")
+    parser.add_argument("--classes", type=int, default=20000, help="size of the generated ontology")
+    parser.add_argument("--methods", nargs="+", choices=list(METHODS), default=list(METHODS))
+    args = parser.parse_args(argv)
+
+    path = args.file
+    cleanup = None
+    if not path:
+        fd, path = tempfile.mkstemp(suffix=".nt")
+        os.close(fd)
+        cleanup = path
+        generate_ontology(path, args.classes)
+    size_mb = os.path.getsize(path) / 1024 / 1024
+    print(f"{path}: {size_mb:.1f} MB")
+    print(f"{'method':<26}{'seconds':>10}{'peak MB':>10}{'sentences':>12}")
+    try:
+        for name in args.methods:
+            with ProcessPoolExecutor(max_workers=1) as pool:
+                seconds, peak_mb, sentences = pool.submit(_run, name, path).result()
+            print(f"{name:<26}{seconds:>10.2f}{peak_mb:>10.1f}{sentences:>12}")
+    finally:
+        if cleanup:
+            os.remove(cleanup)
+
+
+if __name__ == "__main__":
+    main()
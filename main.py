@@ -1,15 +1,39 @@
-from fastapi import FastAPI, WebSocket, Depends
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, WebSocket, Depends, Response
 from fastapi.middleware.cors import CORSMiddleware
 from app.api.v1 import api_v1_router
-from app.database import get_mongo_db
-from app.websocket import websocket_endpoint
+from app.database import get_mongo_db, mongo_db
+from app.websocket import websocket_endpoint, active_connections
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from app.services.document_processor import document_processor
+from app.services.llm_service import llm_service
+from app.services.ingestion_queue import ingestion_queue, clear_whole_index
+from app.services.metrics import metrics, CONTENT_TYPE
+from app.services import tokens
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # tiktoken may download its files on first use; token counts are estimated until it is ready
+    asyncio.get_event_loop().run_in_executor(None, tokens.warm_up)
+    if document_processor.read_only:
+        # Another worker process owns the index; follow its commits
+        index_task = asyncio.create_task(document_processor.run_refresh_loop())
+    else:
+        # Fold per-upload index segments into a snapshot periodically
+        index_task = asyncio.create_task(document_processor.run_compaction_loop())
+        # Resumes jobs left queued or interrupted by a previous run
+        await ingestion_queue.start(mongo_db)
+    yield
+    await ingestion_queue.stop()
+    index_task.cancel()
+    document_processor.extraction_pool.shutdown()
 
 app = FastAPI(
     title="Knowledge Base Chatbot API",
     description="Backend API for the Knowledge Base Chatbot application",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Configure CORS
@@ -36,10 +60,68 @@ async def chat_ws(websocket: WebSocket, db: AsyncIOMotorDatabase = Depends(get_m
     await websocket_endpoint(websocket, db)
 
 @app.post("/admin/clear_index")
-def clear_index():
-    document_processor.clear_index()
+async def clear_index(response: Response, db: AsyncIOMotorDatabase = Depends(get_mongo_db)):
+    if document_processor.read_only:
+        # The index-writing worker picks the request up, as it does deletions made here
+        await ingestion_queue.request_clear(db)
+        response.status_code = 202
+        return {"status": "pending", "message": "The index-writing worker will clear the FAISS index and document list."}
+    await clear_whole_index(db)
     return {"status": "success", "message": "FAISS index and document list cleared."}
 
+@app.get("/admin/load")
+async def load_stats(db: AsyncIOMotorDatabase = Depends(get_mongo_db)):
+    """Concurrency and queue depth of the LLM, ingestion and embedding pipelines"""
+    return {
+        "ingestion": await ingestion_queue.stats(db),
+        "llm": llm_service.limiter.stats(),
+        "answer_cache": llm_service.answer_cache.stats() if llm_service.answer_cache is not None else None,
+        "embeddings": document_processor.embedding_scheduler.stats(),
+        "extraction": document_processor.extraction_pool.stats(),
+        "websocket": {"connections": len(active_connections)},
+    }
+
+def _default_executor_queue_depth() -> float:
+    """Tasks waiting for a thread in the event loop's default executor (run_in_executor(None, ...))"""
+    executor = getattr(asyncio.get_running_loop(), "_default_executor", None)
+    return executor._work_queue.qsize() if executor is not None else 0
+
+def _index_totals() -> dict:
+    snapshots = [p.snapshot for p in list(document_processor.partitions.values())]
+    return {
+        ("total",): sum(s.index.ntotal for s in snapshots),
+        ("live",): sum(s.index.ntotal - len(s.index.excluded) for s in snapshots),
+    }
+
+metrics.gauge("index_vectors", "Vectors in the loaded index partitions (total, or not deleted)",
+              _index_totals, ["state"])
+metrics.gauge("index_partitions_loaded", "Index partitions loaded in this process",
+              lambda: len(document_processor.partitions))
+metrics.gauge("index_pending_segments", "Segments not yet folded into a base snapshot",
+              lambda: sum(p.store.segment_count for p in list(document_processor.partitions.values())))
+metrics.gauge("websocket_connections", "Open chat WebSocket connections", lambda: len(active_connections))
+metrics.gauge("executor_queue_depth", "Work waiting to run: thread pool tasks, LLM calls and texts to embed",
+              lambda: {
+                  ("default",): _default_executor_queue_depth(),
+                  ("llm",): llm_service.limiter.stats()["queue_depth"],
+                  ("embeddings",): document_processor.embedding_scheduler.stats()["queued_texts"],
+              }, ["executor"])
+metrics.gauge("in_flight", "Work running now: LLM calls, embedding batches and ingestion jobs",
+              lambda: {
+                  ("llm",): llm_service.limiter.stats()["in_flight"],
+                  ("embeddings",): document_processor.embedding_scheduler.stats()["in_flight_batches"],
+                  ("ingestion",): ingestion_queue.running,
+              }, ["work"])
+if llm_service.answer_cache is not None:
+    metrics.gauge("answer_cache", "Cached answers, and cache hits, misses and entries dropped for a new index version",
+                  lambda: {(stat,): value for stat, value in llm_service.answer_cache.stats().items()
+                           if stat != "hit_rate"}, ["stat"])
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Per-stage latency histograms and load gauges of this worker process, in Prometheus text format"""
+    return Response(metrics.render(), media_type=CONTENT_TYPE)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
@@ -0,0 +1,107 @@
+import asyncio
+
+import numpy as np
+from langchain_core.messages import AIMessage
+
+from app.services.answer_cache import AnswerCache
+from app.services.llm_service import LLMService
+from app.services import llm_service as llm_service_module
+
+ANSWER = {"response": "Mozzarella.", "sources": [], "context_used": True, "model": "gpt-3.5-turbo"}
+CHUNKS = frozenset({3, 4})
+
+
+def vector(*values):
+    return np.array(values, dtype="float32")
+
+
+def test_similar_question_with_the_same_chunks_is_a_hit():
+    cache = AnswerCache(max_entries=10, ttl_seconds=60, similarity_threshold=0.95)
+    cache.set("team", 1, CHUNKS, "What toppings?", vector(1, 0, 0), ANSWER)
+
+    assert cache.get("team", 1, CHUNKS, "Which toppings?", vector(0.99, 0.1, 0)) == ANSWER
+    # Below the threshold
+    assert cache.get("team", 1, CHUNKS, "How hot is the oven?", vector(0.6, 0.8, 0)) is None
+    # Same question, different retrieval
+    assert cache.get("team", 1, frozenset({3, 5}), "What toppings?", vector(1, 0, 0)) is None
+    assert cache.get("other", 1, CHUNKS, "What toppings?", vector(1, 0, 0)) is None
+    # Without embeddings only the same normalized text matches
+    assert cache.get("team", 1, CHUNKS, "  what TOPPINGS? ") == ANSWER
+    assert cache.get("team", 1, CHUNKS, "Which toppings?") is None
+    assert cache.stats()["hits"] == 2
+
+
+def test_new_index_version_invalidates_the_namespace():
+    cache = AnswerCache(max_entries=10, ttl_seconds=60, similarity_threshold=0.95)
+    cache.set("team", 1, CHUNKS, "What toppings?", vector(1, 0), ANSWER)
+    cache.set("other", 1, CHUNKS, "What toppings?", vector(1, 0), ANSWER)
+
+    assert cache.get("team", 2, CHUNKS, "What toppings?", vector(1, 0)) is None
+    assert cache.stats()["invalidations"] == 1
+    assert cache.get("other", 1, CHUNKS, "What toppings?", vector(1, 0)) == ANSWER
+
+    # A turn that searched the older index neither reads nor stores answers
+    cache.set("team", 1, CHUNKS, "What toppings?", vector(1, 0), ANSWER)
+    assert cache.get("team", 2, CHUNKS, "What toppings?", vector(1, 0)) is None
+
+
+def test_entries_expire_and_least_recently_used_are_evicted(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("app.services.answer_cache.time.monotonic", lambda: now[0])
+    cache = AnswerCache(max_entries=2, ttl_seconds=60, similarity_threshold=0.95)
+    cache.set("team", 1, frozenset({1}), "first", None, ANSWER)
+    cache.set("team", 1, frozenset({2}), "second", None, ANSWER)
+    assert cache.get("team", 1, frozenset({1}), "first") == ANSWER
+    cache.set("team", 1, frozenset({3}), "third", None, ANSWER)
+
+    assert len(cache) == 2
+    assert cache.get("team", 1, frozenset({2}), "second") is None
+    now[0] += 61
+    assert cache.get("team", 1, frozenset({1}), "first") is None
+    assert len(cache) == 1
+
+
+def test_repeated_question_is_answered_from_the_cache(monkeypatch):
+    service = LLMService()
+    service.answer_cache = AnswerCache(max_entries=10, ttl_seconds=60, similarity_threshold=0.95)
+    version = [7]
+    calls = []
+
+    async def fake_search(query, k, namespace, search_filter=None):
+        return [{"content": "Mozzarella is a topping.", "metadata": {"file_id": "f-1", "filename": "pizza.txt"},
+                 "row": 4, "similarity_score": 0.2, "score": 0.2, "score_kind": "l2_distance", "rank": 1}]
+
+    async def fake_generate(messages):
+        calls.append(messages)
+        return AIMessage(content="Mozzarella.")
+
+    processor = llm_service_module.document_processor
+    monkeypatch.setattr(processor, "search_similar_documents", fake_search)
+    monkeypatch.setattr(processor, "index_version", lambda namespace: version[0])
+    monkeypatch.setattr(processor, "cached_query_vector", lambda query: vector(1, 0))
+    monkeypatch.setattr(service, "_generate_async", fake_generate)
+
+    async def ask(history=()):
+        return await service._generate_response("What toppings?", list(history), True, 5, "team", None)
+
+    first = asyncio.run(ask())
+    second = asyncio.run(ask())
+    assert first["cached"] is False and second["cached"] is True
+    assert second["response"] == "Mozzarella."
+    assert len(calls) == 1
+
+    # A new upload changes the index version
+    version[0] = 8
+    assert asyncio.run(ask())["cached"] is False
+    assert len(calls) == 2
+
+    # An answer given within a conversation is only reused in that same conversation
+    conversation = [{"sender": "alice@example.com", "message": "I am vegan."},
+                    {"sender": "assistant", "message": "Noted!"}]
+    assert asyncio.run(ask(conversation))["cached"] is False
+    assert asyncio.run(ask(conversation))["cached"] is True
+    other = [{"sender": "bob@example.com", "message": "I love cheese."},
+             {"sender": "assistant", "message": "Great!"}]
+    assert asyncio.run(ask(other))["cached"] is False
+    assert asyncio.run(ask())["cached"] is True
+    assert len(calls) == 4
@@ -0,0 +1,64 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+
+from app.services.chat_history import ChatHistoryStore
+
+
+def make_db(recent, legacy=None):
+    collections = {}
+    cursor = MagicMock()
+    cursor.sort.return_value = cursor
+    cursor.limit.return_value = cursor
+    cursor.to_list = AsyncMock(return_value=list(recent))
+    messages = MagicMock()
+    messages.find = MagicMock(return_value=cursor)
+    messages.create_index = AsyncMock()
+    messages.insert_one = AsyncMock()
+    chats = MagicMock()
+    chats.find_one = AsyncMock(return_value=legacy)
+    collections["chat_messages"] = messages
+    collections["chats"] = chats
+    db = MagicMock()
+    db.__getitem__ = MagicMock(side_effect=collections.__getitem__)
+    return db, messages, chats, cursor
+
+
+def test_window_reads_latest_messages_oldest_first():
+    store = ChatHistoryStore(window=3)
+    newest_first = [{"sender": "assistant", "message": str(i)} for i in (5, 4, 3)]
+    db, messages, chats, cursor = make_db(newest_first)
+
+    window = asyncio.run(store.load_window(db, "user-1"))
+
+    assert [m["message"] for m in window] == ["3", "4", "5"]
+    cursor.limit.assert_called_once_with(3)
+    chats.find_one.assert_not_called()
+    window.append({"sender": "assistant", "message": "6"})
+    assert [m["message"] for m in window] == ["4", "5", "6"]
+
+
+def test_window_falls_back_to_sliced_legacy_document():
+    store = ChatHistoryStore(window=2)
+    legacy = {"messages": [{"sender": "assistant", "message": "old"}]}
+    db, messages, chats, _ = make_db([], legacy)
+
+    window = asyncio.run(store.load_window(db, "user-1"))
+
+    assert [m["message"] for m in window] == ["old"]
+    projection = chats.find_one.call_args.args[1]
+    assert projection["messages"] == {"$slice": -2}
+    asyncio.run(store.append(db, "user-1", {"sender": "user-1", "message": "new"}))
+    messages.insert_one.assert_awaited_once_with({"user_id": "user-1", "sender": "user-1", "message": "new"})
+
+
+def test_window_keeps_legacy_history_after_new_messages_arrive():
+    store = ChatHistoryStore(window=4)
+    legacy = {"messages": [{"sender": "assistant", "message": f"old {i}"} for i in (2, 3)]}
+    newest_first = [{"sender": "assistant", "message": f"new {i}"} for i in (2, 1)]
+    db, messages, chats, _ = make_db(newest_first, legacy)
+
+    window = asyncio.run(store.load_window(db, "user-1"))
+
+    assert [m["message"] for m in window] == ["old 2", "old 3", "new 1", "new 2"]
+    # Only as many legacy messages as the window has room for
+    assert chats.find_one.call_args.args[1]["messages"] == {"$slice": -2}
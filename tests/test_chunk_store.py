@@ -0,0 +1,40 @@
+from app.services.chunk_store import ChunkList, ChunkStore
+
+
+def _records():
+    return [
+        {"content": "first chunk", "metadata": {"file_id": "a", "filename": "a.txt"}},
+        {"content": "другий фрагмент", "metadata": {"file_id": "a", "filename": "a.txt"}},
+        {"content": "", "metadata": {"file_id": "b", "filename": "b.txt"}},
+    ]
+
+
+def test_round_trip_with_interned_metadata(tmp_path):
+    ChunkStore.write(str(tmp_path), _records())
+    store = ChunkStore(str(tmp_path))
+
+    assert len(store) == 3
+    assert list(store) == _records()
+    assert store[1]["content"] == "другий фрагмент"
+    assert len(store.metadata) == 2
+
+
+def test_empty_store(tmp_path):
+    ChunkStore.write(str(tmp_path), [])
+    store = ChunkStore(str(tmp_path))
+    assert len(store) == 0
+    assert list(store) == []
+
+
+def test_chunk_list_rebase_keeps_rows_appended_after_snapshot(tmp_path):
+    chunks = ChunkList(tail=_records()[:2])
+    snapshot = chunks.snapshot()
+    chunks.append(_records()[2])
+
+    ChunkStore.write(str(tmp_path), snapshot)
+    chunks = chunks.rebase(ChunkStore(str(tmp_path)), len(snapshot.tail))
+
+    assert chunks.base_size == 2
+    assert len(chunks.tail) == 1
+    assert list(chunks) == _records()
+    assert chunks[-1]["metadata"]["file_id"] == "b"
@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+
+from app.services.concurrency import ConcurrencyLimiter, ServiceBusyError
+
+
+def test_limiter_rejects_when_queue_is_full():
+    limiter = ConcurrencyLimiter("test", max_concurrency=1, max_queue=1)
+
+    async def hold(release: asyncio.Event):
+        async with limiter.slot():
+            await release.wait()
+
+    async def run():
+        release = asyncio.Event()
+        holder = asyncio.create_task(hold(release))
+        waiter = asyncio.create_task(hold(release))
+        await asyncio.sleep(0)
+        assert limiter.stats()["in_flight"] == 1
+        assert limiter.stats()["queue_depth"] == 1
+        with pytest.raises(ServiceBusyError):
+            async with limiter.slot():
+                pass
+        release.set()
+        await asyncio.gather(holder, waiter)
+
+    asyncio.run(run())
+    stats = limiter.stats()
+    assert stats["completed"] == 2
+    assert stats["rejected"] == 1
+    assert stats["in_flight"] == 0
+
+
+def test_limiter_times_out_waiting_callers():
+    limiter = ConcurrencyLimiter("test", max_concurrency=1, max_queue=4, queue_timeout=0.01)
+
+    async def run():
+        release = asyncio.Event()
+
+        async def hold():
+            async with limiter.slot():
+                await release.wait()
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        with pytest.raises(ServiceBusyError):
+            async with limiter.slot():
+                pass
+        release.set()
+        await holder
+
+    asyncio.run(run())
+    assert limiter.rejected == 1
@@ -0,0 +1,107 @@
+import asyncio
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from app.services.context_packing import ContextPacker
+from app.services.extraction import iter_chunks
+from app.services.llm_service import llm_service
+from app.services.tokens import count_tokens
+from app.services import llm_service as llm_service_module
+
+
+def make_results(chunks, file_id="f-1", filename="guide.txt", first_row=0):
+    return [
+        {"content": chunk, "metadata": {"file_id": file_id, "filename": filename},
+         "row": first_row + i, "similarity_score": 0.1 * i,
+         "score": 0.1 * i, "score_kind": "l2_distance", "rank": i + 1}
+        for i, chunk in enumerate(chunks)
+    ]
+
+
+def split(text):
+    return list(iter_chunks([text], 1000, 200, 200000))
+
+
+def test_neighbouring_chunks_are_merged_without_repeating_their_overlap():
+    text = "\n".join(f"Sentence {i} about the manual and its settings." for i in range(120))
+    chunks = split(text)
+    assert len(chunks) > 3
+    packer = ContextPacker(context_max_tokens=100000, history_max_tokens=1000)
+
+    results = make_results(chunks[:3])
+    # Search order is by relevance, not by position in the file
+    results = [results[2], results[0], results[1]]
+    passages = packer.merge(results)
+
+    assert len(passages) == 1
+    merged = passages[0].text
+    assert merged == text[:len(merged)]
+    assert len(merged) < sum(len(chunk) for chunk in chunks[:3])
+
+    packed = packer.pack(results, [])
+    assert packed.context.count("Source ") == 1
+    assert len(packed.sources) == 3
+    assert packed.tokens_saved > 0
+
+
+def test_separate_files_and_distant_chunks_stay_separate_passages_in_rank_order():
+    manual = split("\n".join(f"Manual line {i} explains a setting." for i in range(200)))
+    faq = split("\n".join(f"FAQ entry {i} answers a question." for i in range(60)))
+    results = make_results([manual[5]], "manual", "manual.txt", first_row=5) \
+        + make_results([faq[0]], "faq", "faq.txt", first_row=40) \
+        + make_results([manual[0]], "manual", "manual.txt", first_row=0) \
+        + make_results([faq[0]], "copy", "faq-copy.txt", first_row=90) \
+        + make_results([manual[5]], "manual", "manual.txt", first_row=150)
+
+    passages = ContextPacker(100000, 1000).merge(results)
+
+    # A repeated chunk of the same file is dropped; the copied file is still its own source
+    assert [passage.filename for passage in passages] == ["manual.txt", "faq.txt", "manual.txt", "faq-copy.txt"]
+    assert passages[0].text == manual[5]
+    assert passages[3].text == faq[0]
+
+
+def test_context_and_history_are_trimmed_to_their_budgets():
+    chunks = [f"Topic {i}: " + "details " * 150 for i in range(5)]
+    results = make_results(chunks, first_row=0)
+    for i, result in enumerate(results):
+        # Not neighbours: every chunk is its own passage
+        result["row"] = i * 10
+    history = [{"sender": "user@example.com" if i % 2 == 0 else "assistant", "message": f"message {i} " * 30}
+               for i in range(20)]
+    packer = ContextPacker(context_max_tokens=500, history_max_tokens=200, history_max_messages=10)
+
+    packed = packer.pack(results, history)
+
+    assert packed.context_tokens <= 500
+    assert count_tokens(packed.context) <= 500
+    assert packed.context.startswith("Source 1 (from guide.txt):\nTopic 0")
+    assert packed.history == history[-len(packed.history):]
+    assert 0 < len(packed.history) < 10
+    assert packed.history_tokens <= 200
+    assert packed.tokens_saved > 0
+
+
+def test_prompt_is_built_from_the_packed_context_and_history(monkeypatch):
+    text = "\n".join(f"Pizza fact {i}: mozzarella is a topping." for i in range(80))
+    chunks = split(text)
+
+    async def fake_search(query, k, namespace, search_filter=None):
+        return make_results(chunks[:2])
+
+    monkeypatch.setattr(llm_service_module.document_processor, "search_similar_documents", fake_search)
+    history = [
+        {"sender": "user@example.com", "message": "Hi there"},
+        {"sender": "assistant", "message": "Hello! How can I help?"},
+    ]
+
+    search_results, _ = asyncio.run(llm_service._retrieve("What toppings?", True, 5, "default", None))
+    messages, context, sources, token_report = llm_service._build_messages("What toppings?", history, search_results)
+
+    assert isinstance(messages[0], SystemMessage)
+    assert context in messages[0].content
+    assert context.count("Source ") == 1
+    assert [type(m) for m in messages[1:]] == [HumanMessage, AIMessage, HumanMessage]
+    assert messages[1].content == "Hi there"
+    assert len(sources) == 2
+    assert token_report["saved"] > 0
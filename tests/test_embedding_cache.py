@@ -0,0 +1,66 @@
+from app.services.embedding_cache import EmbeddingCache
+
+
+def test_hits_misses_and_persistence(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = EmbeddingCache(path, model="m")
+    assert cache.get_many(["a", "b"]) == [None, None]
+
+    cache.put_many(["a"], [[1.0, 2.0]])
+    assert cache.get_many(["a", "b", "a"]) == [[1.0, 2.0], None, [1.0, 2.0]]
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 3
+    cache.close()
+
+    reopened = EmbeddingCache(path, model="m")
+    assert reopened.get_many(["a"]) == [[1.0, 2.0]]
+    # Same text under another model is a different key
+    assert EmbeddingCache(path, model="other").get_many(["a"]) == [None]
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite3"), model="m", max_entries=2)
+    cache.put_many(["a"], [[1.0]])
+    cache.put_many(["b"], [[2.0]])
+    cache.get_many(["a"])
+    cache.put_many(["c"], [[3.0]])
+
+    assert cache.get_many(["a", "b", "c"]) == [[1.0], None, [3.0]]
+    assert cache.stats()["entries"] == 2
+    assert cache.stats()["evictions"] == 1
+
+
+def test_ttl_cache_expiry_and_memory_cap(monkeypatch):
+    from app.services import cache as cache_module
+    from app.services.cache import TTLCache
+
+    now = [100.0]
+    monkeypatch.setattr(cache_module.time, "monotonic", lambda: now[0])
+    cache = TTLCache(max_entries=10, ttl_seconds=5, max_bytes=100)
+
+    cache.set("a", 1, size=60)
+    cache.set("b", 2, size=60)
+    assert cache.get("a") is None  # evicted by the byte cap
+    assert cache.get("b") == 2
+
+    now[0] += 6
+    assert cache.get("b") is None
+    assert cache.stats()["bytes"] == 0
+
+
+def test_search_queries_are_not_written_to_the_persistent_cache(tmp_path, monkeypatch):
+    import asyncio
+    from app.services.document_processor import DocumentProcessor
+
+    processor = DocumentProcessor(str(tmp_path / "faiss_index"), str(tmp_path / "documents.pkl"))
+    processor.embeddings = object()
+    processor.embedding_cache = EmbeddingCache(str(tmp_path / "cache.sqlite3"), model="m")
+
+    async def fake_embed(texts, urgent=False):
+        return [[float(len(text))] for text in texts]
+
+    monkeypatch.setattr(processor.embedding_scheduler, "embed", fake_embed)
+    asyncio.run(processor._embed_query("what is my salary?"))
+    asyncio.run(processor._generate_embeddings_async(["chunk text"]))
+
+    assert processor.embedding_cache.get_many(["what is my salary?", "chunk text"]) == [None, [10.0]]
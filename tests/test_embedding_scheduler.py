@@ -0,0 +1,105 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.services import tokens
+from app.services.embedding_scheduler import EmbeddingScheduler
+
+
+class RateLimitError(Exception):
+    status_code = 429
+
+
+class FakeEmbeddings:
+    def __init__(self, fail_first: int = 0):
+        self.batches = []
+        self.active = 0
+        self.max_active = 0
+        self.fail_first = fail_first
+
+    async def __call__(self, texts):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(0.01)
+            if self.fail_first:
+                self.fail_first -= 1
+                raise RateLimitError("slow down")
+            self.batches.append(list(texts))
+            return [[float(len(text))] for text in texts]
+        finally:
+            self.active -= 1
+
+
+def test_small_uploads_are_coalesced_into_one_batch():
+    fake = FakeEmbeddings()
+    scheduler = EmbeddingScheduler(fake, coalesce_seconds=0.05)
+
+    async def run():
+        return await asyncio.gather(scheduler.embed(["a", "bb"]), scheduler.embed(["ccc"]))
+
+    first, second = asyncio.run(run())
+    assert first == [[1.0], [2.0]]
+    assert second == [[3.0]]
+    assert fake.batches == [["a", "bb", "ccc"]]
+
+
+def test_batches_respect_size_and_concurrency_limits():
+    fake = FakeEmbeddings()
+    scheduler = EmbeddingScheduler(fake, max_batch_size=3, max_concurrency=2, coalesce_seconds=0)
+
+    texts = [str(i) for i in range(20)]
+    result = asyncio.run(scheduler.embed(texts))
+
+    assert result == [[float(len(text))] for text in texts]
+    assert all(len(batch) <= 3 for batch in fake.batches)
+    assert fake.max_active <= 2
+
+
+def test_rate_limited_batches_are_retried():
+    fake = FakeEmbeddings(fail_first=2)
+    scheduler = EmbeddingScheduler(fake, backoff_base=0.01, coalesce_seconds=0)
+
+    assert asyncio.run(scheduler.embed(["abc"])) == [[3.0]]
+    assert scheduler.stats()["rate_limited"] == 2
+
+
+def test_non_retryable_errors_reach_the_caller():
+    async def broken(texts):
+        raise ValueError("bad input")
+
+    scheduler = EmbeddingScheduler(broken, coalesce_seconds=0)
+    with pytest.raises(ValueError):
+        asyncio.run(scheduler.embed(["abc"]))
+
+
+def test_slow_tokenizer_download_never_blocks_the_event_loop(monkeypatch):
+    release = threading.Event()
+
+    class WordEncoding:
+        def encode(self, text, disallowed_special=()):
+            return text.split()
+
+    def slow_load(model):
+        # Stand-in for tiktoken fetching its BPE files from a slow network
+        release.wait(5)
+        tokens._encodings[model] = WordEncoding()
+
+    monkeypatch.setattr(tokens, "_encodings", {})
+    monkeypatch.setattr(tokens, "_loaders", {})
+    monkeypatch.setattr(tokens, "_load_encoding", slow_load)
+    monkeypatch.setattr(tokens.settings, "TOKENIZER_LOAD_TIMEOUT_SECONDS", 0.05)
+    fake = FakeEmbeddings()
+    scheduler = EmbeddingScheduler(fake, coalesce_seconds=0, model="slow-model")
+
+    started = time.perf_counter()
+    assert asyncio.run(scheduler.embed(["four words of text"])) == [[18.0]]
+    assert time.perf_counter() - started < 0.5
+    # Off the loop the wait is bounded, then the length estimate is used
+    assert tokens.count_tokens("four words of text", "slow-model") == 18 // tokens.CHARS_PER_TOKEN + 1
+
+    release.set()
+    tokens._loaders["slow-model"].join(1)
+    assert tokens.count_tokens("four words of text", "slow-model") == 4
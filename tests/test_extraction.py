@@ -0,0 +1,214 @@
+import asyncio
+import json
+import time
+
+import numpy as np
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+
+from app.config import get_settings
+from app.services.document_processor import DocumentProcessor
+from app.services.vector_index import VectorIndex
+from app.services.extraction import (
+    ExtractionPool,
+    ExtractionTimeoutError,
+    extract_text_from_file,
+    iter_chunks,
+    stream_chunks,
+    _extract_from_rdf,
+)
+from benchmarks.rdf_extraction import generate_ontology
+
+settings = get_settings()
+
+
+async def chat_turn_latencies(done: asyncio.Event):
+    # Stand-in for chat turns: each should be scheduled within a tick
+    latencies = []
+    while not done.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.01)
+        latencies.append(time.perf_counter() - started - 0.01)
+    return latencies
+
+
+async def collect(pool, *args):
+    batches = []
+    async for batch in pool.stream(stream_chunks, *args):
+        batches.append(batch)
+    return batches
+
+
+def test_event_loop_stays_responsive_while_large_file_is_extracted(tmp_path):
+    path = tmp_path / "large.json"
+    records = [{"id": str(i), "title": f"Record {i}", "tags": ["alpha", "beta", f"t{i}"]} for i in range(100000)]
+    path.write_text(json.dumps({"records": records}), encoding="utf-8")
+    pool = ExtractionPool(max_workers=1, timeout=120)
+
+    async def run():
+        done = asyncio.Event()
+        probe = asyncio.create_task(chat_turn_latencies(done))
+        try:
+            result = await collect(pool, str(path), 1000, 200, 200000, 256)
+        finally:
+            done.set()
+        return result, await probe
+
+    try:
+        batches, latencies = asyncio.run(run())
+    finally:
+        pool.shutdown()
+
+    assert sum(len(chunks) for chunks, _ in batches) > 100
+    assert len(latencies) > 10
+    assert max(latencies) < 0.25
+
+
+def test_event_loop_stays_responsive_while_ingestion_fills_an_ivf_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "FAISS_INDEX_TYPE", "ivf_flat")
+    monkeypatch.setattr(settings, "FAISS_IVF_NLIST", 4)
+    monkeypatch.setattr(settings, "FAISS_IVF_MIN_TRAIN_SIZE", 64)
+    monkeypatch.setattr(settings, "EXTRACTION_BATCH_CHUNKS", 16)
+    path = tmp_path / "manual.txt"
+    path.write_text("\n\n".join(f"Section {i}. " + "setting value " * 60 for i in range(150)), encoding="utf-8")
+    processor = DocumentProcessor(str(tmp_path / "faiss_index"), str(tmp_path / "documents.pkl"))
+    rng = np.random.default_rng(0)
+    dimension = processor.partitions["default"].index.d
+
+    async def fake_embed(texts, urgent=False):
+        return rng.normal(size=(len(texts), dimension)).astype("float32").tolist()
+
+    create_index = VectorIndex._create_index
+
+    def slow_training(index, vectors=None):
+        if vectors is not None:
+            time.sleep(0.5)
+        return create_index(index, vectors)
+
+    monkeypatch.setattr(processor, "_generate_embeddings_async", fake_embed)
+    monkeypatch.setattr(VectorIndex, "_create_index", slow_training)
+    db = MagicMock()
+    db.__getitem__.return_value.update_one = AsyncMock()
+    namespace = "user:ivf@example.com"
+
+    async def run():
+        # Start the worker processes up front so only indexing is measured
+        await processor.extraction_pool.run(len, "warm up")
+        processor.extraction_pool._get_manager()
+        done = asyncio.Event()
+        probe = asyncio.create_task(chat_turn_latencies(done))
+        try:
+            await processor.process_document(str(path), "f-1", "manual.txt", db, namespace)
+        finally:
+            done.set()
+        return await probe
+
+    try:
+        latencies = asyncio.run(run())
+    finally:
+        processor.extraction_pool.shutdown()
+
+    assert max(latencies) < 0.25
+    with processor._use_partition(namespace) as partition:
+        assert partition.index.training_due
+    # Training happens in the compaction pass, which runs in the executor
+    assert processor.compact_index() == 1
+    with processor._use_partition(namespace) as partition:
+        assert partition.index.kind == "ivf_flat"
+        assert partition.index.ntotal >= 64
+
+
+def test_timed_out_job_is_killed_and_pool_recovers():
+    pool = ExtractionPool(max_workers=1, timeout=1.0)
+    try:
+        with pytest.raises(ExtractionTimeoutError):
+            asyncio.run(pool.run(time.sleep, 30))
+        assert asyncio.run(pool.run(len, "abc")) == 3
+        assert pool.stats()["timed_out"] == 1
+        assert pool.stats()["restarts"] == 1
+    finally:
+        pool.shutdown()
+
+
+def test_worker_memory_limit_fails_the_job():
+    pool = ExtractionPool(max_workers=1, timeout=60, memory_limit_mb=1024)
+    try:
+        with pytest.raises(MemoryError):
+            asyncio.run(pool.run(bytearray, 4 * 1024 ** 3))
+        assert asyncio.run(pool.run(len, "ok")) == 2
+    finally:
+        pool.shutdown()
+
+
+def test_windowed_splitting_matches_whole_text_splitting():
+    words = [f"word{i}" for i in range(20000)]
+    blocks = [" ".join(words[i:i + 50]) + "\n" for i in range(0, len(words), 50)]
+
+    chunks = list(iter_chunks(blocks, 1000, 200, window_chars=5000))
+    whole = list(iter_chunks(blocks, 1000, 200, window_chars=10 ** 9))
+
+    assert all(len(chunk) <= 1000 for chunk in chunks)
+    covered = set(" ".join(chunks).split())
+    assert covered == set(words)
+    assert abs(len(chunks) - len(whole)) <= len(whole) // 20
+
+
+def test_file_is_streamed_in_batches_with_bounded_read_ahead(tmp_path):
+    path = tmp_path / "large.txt"
+    path.write_text("\n\n".join(f"Paragraph {i} " + "lorem ipsum " * 40 for i in range(3000)), encoding="utf-8")
+    pool = ExtractionPool(max_workers=1, timeout=60, queue_size=1)
+
+    async def run():
+        batches = []
+        async for chunks, text_length in pool.stream(stream_chunks, str(path), 1000, 200, 20000, 64):
+            batches.append((len(chunks), text_length))
+            if len(batches) == 1:
+                # Slow consumer: the worker must wait instead of racing ahead
+                await asyncio.sleep(0.5)
+        return batches
+
+    try:
+        batches = asyncio.run(run())
+    finally:
+        pool.shutdown()
+
+    assert len(batches) > 10
+    assert all(count <= 64 for count, _ in batches)
+    lengths = [text_length for _, text_length in batches]
+    assert lengths == sorted(lengths)
+    assert lengths[0] < lengths[-1] == len(path.read_text(encoding="utf-8"))
+
+
+def test_text_file_with_invalid_utf8_is_still_extracted(tmp_path):
+    path = tmp_path / "notes.txt"
+    path.write_bytes("Caf\u00e9 menu: cr\u00e8me br\u00fbl\u00e9e".encode("latin-1"))
+
+    assert extract_text_from_file(str(path)) == "Caf\ufffd menu: cr\ufffdme br\ufffdl\ufffde"
+
+
+def test_streamed_ntriples_match_graph_extraction(tmp_path):
+    path = tmp_path / "onto.nt"
+    generate_ontology(str(path), 200)
+
+    streamed = extract_text_from_file(str(path)).splitlines()
+
+    assert "Concept number 5 subClassOf Concept number 1." in streamed
+    assert sorted(streamed) == sorted(_extract_from_rdf(path).splitlines())
+
+
+def test_streamed_literals_are_unescaped(tmp_path):
+    path = tmp_path / "escapes.nt"
+    path.write_text('_:b0 <http://example.org/onto#note> "tab\\tand \\"quote\\" \\u00e9" .\n', encoding="utf-8")
+
+    assert extract_text_from_file(str(path)) == 'b0 note tab\tand "quote" \u00e9.\n'
+
+
+def test_nquads_graph_label_is_ignored(tmp_path):
+    path = tmp_path / "data.nq"
+    path.write_text(
+        '<http://ex.org/a> <http://www.w3.org/2000/01/rdf-schema#label> "Alpha" <http://ex.org/g1> .\n'
+        '<http://ex.org/a> <http://ex.org/knows> <http://ex.org/b> <http://ex.org/g1> .\n',
+        encoding="utf-8",
+    )
+
+    assert extract_text_from_file(str(path)).splitlines() == ["Alpha label Alpha.", "Alpha knows b."]
@@ -0,0 +1,31 @@
+import asyncio
+
+from fastapi.testclient import TestClient
+from langchain_core.messages import HumanMessage
+from langchain_openai import ChatOpenAI
+
+from benchmarks.fake_openai import FakeConfig, create_app, fake_reply, serve_in_background
+
+
+def test_chat_completions_are_deterministic():
+    client = TestClient(create_app(FakeConfig(first_token_ms=0, token_ms=0, reply_tokens=8)))
+    body = {"model": "gpt-3.5-turbo", "messages": [{"role": "user", "content": "What is on a pizza?"}]}
+    first = client.post("/v1/chat/completions", json=body).json()
+    second = client.post("/v1/chat/completions", json=body).json()
+    content = first["choices"][0]["message"]["content"]
+    assert content == second["choices"][0]["message"]["content"]
+    assert content == "".join(fake_reply(body["messages"], 8))
+    assert first["usage"]["completion_tokens"] == 8
+
+
+def test_streamed_reply_arrives_token_by_token():
+    base_url = serve_in_background(FakeConfig(first_token_ms=0, token_ms=0, reply_tokens=5))
+    llm = ChatOpenAI(openai_api_key="fake", openai_api_base=base_url, model_name="gpt-3.5-turbo", max_retries=0)
+    messages = [HumanMessage(content="hello")]
+
+    async def run():
+        return [chunk.content async for chunk in llm.astream(messages) if chunk.content]
+
+    parts = asyncio.run(run())
+    assert len(parts) == 5
+    assert "".join(parts) == "".join(fake_reply([{"role": "user", "content": "hello"}], 5))
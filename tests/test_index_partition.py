@@ -0,0 +1,230 @@
+import asyncio
+import threading
+import time
+import traceback
+import zlib
+
+import numpy as np
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from langchain.docstore.document import Document
+
+from app.config import get_settings
+from app.services.document_processor import DocumentProcessor
+from app.services.index_partition import IndexPartition
+
+settings = get_settings()
+
+
+def unit(vector):
+    vector = np.asarray(vector, dtype="float32")
+    return vector / np.linalg.norm(vector)
+
+
+def make_processor(tmp_path, monkeypatch):
+    processor = DocumentProcessor(str(tmp_path / "faiss_index"), str(tmp_path / "documents.pkl"))
+    vectors = {}
+
+    async def fake_embed(texts, urgent=False):
+        return [vectors[text].tolist() for text in texts]
+
+    monkeypatch.setattr(processor, "_generate_embeddings_async", fake_embed)
+    return processor, vectors
+
+
+def add(processor, vectors, namespace, text, vector):
+    vectors[text] = unit(vector)
+    doc = Document(page_content=text, metadata={"file_id": text, "filename": f"{text}.txt"})
+    processor._add_to_index([doc], [vectors[text].tolist()], namespace)
+
+
+def test_namespaces_are_searched_independently(tmp_path, monkeypatch):
+    processor, vectors = make_processor(tmp_path, monkeypatch)
+    dimension = processor.partitions["default"].index.d
+    direction = np.ones(dimension)
+    add(processor, vectors, "user:a@example.com", "alpha notes", direction)
+    add(processor, vectors, "user:b@example.com", "beta notes", direction)
+    vectors["query"] = unit(direction)
+
+    results_a = asyncio.run(processor.search_similar_documents("query", 5, "user:a@example.com"))
+    results_b = asyncio.run(processor.search_similar_documents("query", 5, "user:b@example.com"))
+    results_default = asyncio.run(processor.search_similar_documents("query", 5))
+
+    assert [r["content"] for r in results_a] == ["alpha notes"]
+    assert [r["content"] for r in results_b] == ["beta notes"]
+    assert results_default == []
+    assert processor.get_index_stats("user:a@example.com")["total_vectors"] == 1
+
+
+def test_idle_partitions_are_evicted_and_reloaded_from_disk(tmp_path, monkeypatch):
+    processor, vectors = make_processor(tmp_path, monkeypatch)
+    dimension = processor.partitions["default"].index.d
+    add(processor, vectors, "user:a@example.com", "alpha notes", np.ones(dimension))
+    vectors["query"] = unit(np.ones(dimension))
+    assert set(processor.partitions) == {"default", "user:a@example.com"}
+
+    assert processor.evict_idle_partitions(idle_seconds=3600, max_loaded=1) == 1
+    assert set(processor.partitions) == {"user:a@example.com"}
+    assert processor.evict_idle_partitions(idle_seconds=0, max_loaded=10) == 1
+    assert processor.partitions == {}
+
+    results = asyncio.run(processor.search_similar_documents("query", 5, "user:a@example.com"))
+    assert [r["content"] for r in results] == ["alpha notes"]
+
+
+def test_deleted_file_is_excluded_then_purged_by_compaction(tmp_path, monkeypatch):
+    processor, vectors = make_processor(tmp_path, monkeypatch)
+    dimension = processor.partitions["default"].index.d
+    namespace = "user:a@example.com"
+    for i, text in enumerate(["alpha", "beta", "gamma"]):
+        add(processor, vectors, namespace, text, np.eye(dimension)[i] + 0.1)
+    vectors["query"] = unit(np.eye(dimension)[1] + 0.1)
+
+    assert processor.delete_document("beta", namespace) == 1
+    assert processor.delete_document("beta", namespace) == 0
+    results = asyncio.run(processor.search_similar_documents("query", 5, namespace))
+    assert "beta" not in [r["content"] for r in results]
+
+    # The tombstone survives a reload from disk
+    processor.evict_idle_partitions(idle_seconds=0, max_loaded=0)
+    assert processor.get_index_stats(namespace)["deleted_vectors"] == 1
+
+    assert processor.compact_index(min_segments=100) == 1
+    stats = processor.get_index_stats(namespace)
+    assert (stats["total_vectors"], stats["total_documents"], stats["deleted_vectors"]) == (2, 2, 0)
+    results = asyncio.run(processor.search_similar_documents("query", 5, namespace))
+    assert sorted(r["content"] for r in results) == ["alpha", "gamma"]
+
+    # Re-adding the file after the purge makes it searchable again
+    add(processor, vectors, namespace, "beta", np.eye(dimension)[1] + 0.1)
+    results = asyncio.run(processor.search_similar_documents("query", 1, namespace))
+    assert [r["content"] for r in results] == ["beta"]
+
+    # Folding it into an exact flat base changes no results, so cached searches stay valid
+    version = processor.index_version(namespace)
+    assert processor.compact_index(min_segments=1) == 1
+    assert processor.index_version(namespace) == version
+
+
+@pytest.mark.parametrize("index_type, compression", [("flat", "none"), ("ivf_flat", "none"), ("flat", "sq8")])
+def test_searches_see_consistent_snapshots_while_the_index_changes(tmp_path, monkeypatch, index_type, compression):
+    monkeypatch.setattr(settings, "FAISS_INDEX_TYPE", index_type)
+    monkeypatch.setattr(settings, "FAISS_COMPRESSION", compression)
+    monkeypatch.setattr(settings, "FAISS_IVF_NLIST", 4)
+    monkeypatch.setattr(settings, "FAISS_IVF_MIN_TRAIN_SIZE", 120)
+    partition = IndexPartition("default", str(tmp_path / "index"))
+    dimension = partition.index.d
+
+    def vector(text):
+        return np.random.default_rng(zlib.crc32(text.encode())).normal(size=dimension).astype("float32")
+
+    stop = threading.Event()
+    errors = []
+
+    def ingest():
+        for n in range(60):
+            texts = [f"file{n} chunk{i}" for i in range(5)]
+            records = [{"content": text, "metadata": {"file_id": f"file{n}"}} for text in texts]
+            partition.add(np.vstack([vector(text) for text in texts]), records)
+
+    def delete_and_compact():
+        for n in range(0, 60, 3):
+            while not len(partition.documents.rows_for_file(f"file{n}")):
+                time.sleep(0.001)
+            partition.delete_file(f"file{n}")
+            if n % 9 == 0:
+                partition.save()
+
+    def search(seed):
+        rng = np.random.default_rng(seed)
+        while not stop.is_set():
+            snapshot = partition.snapshot
+            rows = snapshot.index.ntotal
+            assert rows == len(snapshot.documents) == len(snapshot.lexical)
+            if not rows:
+                continue
+            row = int(rng.integers(rows))
+            text = snapshot.documents[row]["content"]
+            query = vector(text)[None]
+            if row not in snapshot.index.excluded:
+                assert snapshot.search(query, 1)[0]["content"] == text
+                assert snapshot.search_lexical(text, 1)[0]["content"] == text
+            # Each hit's score is the distance to the vector of the record returned with it
+            for result in partition.search(query, 5):
+                expected = float(np.sum((query[0] - vector(result["content"])) ** 2))
+                assert np.isclose(result["similarity_score"], expected, rtol=1e-3, atol=1e-2)
+
+    def run(target, *args):
+        try:
+            target(*args)
+        except Exception as e:
+            errors.append(traceback.format_exc())
+            stop.set()
+
+    readers = [threading.Thread(target=run, args=(search, seed)) for seed in range(3)]
+    writers = [threading.Thread(target=run, args=(ingest,)), threading.Thread(target=run, args=(delete_and_compact,))]
+    for thread in readers + writers:
+        thread.start()
+    for thread in writers:
+        thread.join()
+    stop.set()
+    for thread in readers:
+        thread.join()
+
+    assert errors == []
+    assert partition.stats()["live_vectors"] == 300 - 5 * 20
+
+
+def test_compressed_base_keeps_exact_vectors_on_disk(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "FAISS_COMPRESSION", "sq8")
+    monkeypatch.setattr(settings, "FAISS_IVF_MIN_TRAIN_SIZE", 200)
+    path = str(tmp_path / "index")
+    partition = IndexPartition("default", path)
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(300, partition.index.d)).astype("float32")
+    for start in range(0, 300, 100):
+        partition.add(vectors[start:start + 100], [{"content": f"chunk {i}", "metadata": {}}
+                                                    for i in range(start, start + 100)])
+    # Ingestion leaves training to the compaction, which runs as soon as it is due
+    assert partition.index.training_due
+    version = partition.version
+    assert partition.compact(min_segments=100)
+    assert partition.index.compression_kind == "sq8"
+    # Compressed vectors can rank differently, so cached results keyed on the old version go stale
+    assert partition.version != version
+
+    for loaded in (partition, IndexPartition("default", path, read_only=True)):
+        assert isinstance(loaded.index.exact, np.memmap)
+        result = loaded.search(vectors[7:8], 1)[0]
+        assert result["content"] == "chunk 7"
+        assert result["similarity_score"] == 0.0
+
+
+def test_failed_ingestion_leaves_no_chunks_searchable(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "EXTRACTION_BATCH_CHUNKS", 4)
+    processor, _ = make_processor(tmp_path, monkeypatch)
+    dimension = processor.partitions["default"].index.d
+    path = tmp_path / "manual.txt"
+    path.write_text("\n\n".join(f"Section {i}. " + "setting value " * 60 for i in range(40)), encoding="utf-8")
+    calls = []
+
+    async def flaky_embed(texts, urgent=False):
+        calls.append(len(texts))
+        if len(calls) == 2:
+            raise RuntimeError("embeddings API down")
+        return np.ones((len(texts), dimension)).tolist()
+
+    monkeypatch.setattr(processor, "_generate_embeddings_async", flaky_embed)
+    db = MagicMock()
+    db.__getitem__.return_value.update_one = AsyncMock()
+
+    try:
+        with pytest.raises(RuntimeError):
+            asyncio.run(processor.process_document(str(path), "f-1", "manual.txt", db, "user:a@example.com"))
+    finally:
+        processor.extraction_pool.shutdown()
+
+    with processor._use_partition("user:a@example.com") as partition:
+        # The first batch was indexed, then tombstoned when the second one failed
+        assert partition.index.ntotal == calls[0]
+        assert len(partition.index.excluded) == partition.index.ntotal
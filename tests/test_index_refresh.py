@@ -0,0 +1,101 @@
+import asyncio
+
+import numpy as np
+from langchain.docstore.document import Document
+
+from app.config import get_settings
+from app.services.document_processor import DocumentProcessor, ReadOnlyIndexError
+
+settings = get_settings()
+
+
+def make_pair(tmp_path, monkeypatch):
+    vectors = {}
+
+    async def fake_embed(texts, urgent=False):
+        return [vectors[text].tolist() for text in texts]
+
+    processors = []
+    for _ in range(2):
+        # The second processor finds the writer lock taken, like a second uvicorn worker
+        processor = DocumentProcessor(str(tmp_path / "faiss_index"), str(tmp_path / "documents.pkl"))
+        monkeypatch.setattr(processor, "_generate_embeddings_async", fake_embed)
+        processors.append(processor)
+    return processors[0], processors[1], vectors
+
+
+def add(processor, vectors, file_id, texts, rng):
+    for text in texts:
+        vectors[text] = rng.normal(size=processor.partitions["default"].index.d).astype("float32")
+    docs = [Document(page_content=text, metadata={"file_id": file_id, "filename": f"{file_id}.txt"}) for text in texts]
+    processor._add_to_index(docs, [vectors[text].tolist() for text in texts])
+
+
+def contents(processor, query, k=3):
+    return [r["content"] for r in asyncio.run(processor.search_similar_documents(query, k, mode="vector"))]
+
+
+def test_reader_follows_segments_deletes_and_compaction(tmp_path, monkeypatch):
+    writer, reader, vectors = make_pair(tmp_path, monkeypatch)
+    rng = np.random.default_rng(0)
+    assert (writer.read_only, reader.read_only) == (False, True)
+
+    add(writer, vectors, "a", ["alpha one", "alpha two"], rng)
+    assert contents(reader, "alpha one") == []
+    assert reader.refresh_index() == 1
+    assert contents(reader, "alpha one", 1) == ["alpha one"]
+    assert reader.refresh_index() == 0
+
+    writer.delete_document("a")
+    add(writer, vectors, "b", ["beta one"], rng)
+    writer.compact_index(min_segments=1)
+    assert reader.refresh_index() == 1
+    assert contents(reader, "alpha one") == ["beta one"]
+
+    try:
+        reader.delete_document("b")
+        raise AssertionError("the reader must not write")
+    except ReadOnlyIndexError:
+        pass
+
+
+def test_reader_memory_maps_ivf_and_adds_new_rows_beside_it(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "FAISS_INDEX_TYPE", "ivf_flat")
+    monkeypatch.setattr(settings, "FAISS_IVF_NLIST", 4)
+    monkeypatch.setattr(settings, "FAISS_IVF_MIN_TRAIN_SIZE", 64)
+    writer, reader, vectors = make_pair(tmp_path, monkeypatch)
+    rng = np.random.default_rng(1)
+    add(writer, vectors, "bulk", [f"bulk {i}" for i in range(200)], rng)
+    writer.compact_index(min_segments=1)
+    reader.refresh_index()
+    assert reader.get_index_stats("default")["memory_mapped"] is True
+
+    add(writer, vectors, "late", ["late arrival"], rng)
+    writer.delete_document("bulk")
+    add(writer, vectors, "late2", ["later arrival"], rng)
+    reader.refresh_index()
+    stats = reader.get_index_stats("default")
+    assert (stats["total_vectors"], stats["live_vectors"], stats["memory_mapped"]) == (202, 2, True)
+    assert contents(reader, "late arrival", 5) == ["late arrival", "later arrival"]
+
+
+def test_cached_search_results_follow_adds_deletes_and_refreshes(tmp_path, monkeypatch):
+    writer, reader, vectors = make_pair(tmp_path, monkeypatch)
+    rng = np.random.default_rng(2)
+    add(writer, vectors, "a", ["alpha one"], rng)
+    reader.refresh_index()
+    assert contents(writer, "alpha one") == ["alpha one"]
+    assert contents(reader, "alpha one") == ["alpha one"]
+    assert contents(writer, "alpha one") == ["alpha one"]
+    assert writer.search_result_cache.stats()["hits"] == 1
+
+    add(writer, vectors, "b", ["beta one"], rng)
+    assert sorted(contents(writer, "alpha one")) == ["alpha one", "beta one"]
+    writer.delete_document("a")
+    assert contents(writer, "alpha one") == ["beta one"]
+
+    # The reader keeps its cached answer until it picks up the writer's changes
+    assert contents(reader, "alpha one") == ["alpha one"]
+    reader.refresh_index()
+    assert contents(reader, "alpha one") == ["beta one"]
+    assert writer.search_result_cache.stats()["hits"] == 1
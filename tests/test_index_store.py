@@ -0,0 +1,69 @@
+import os
+import pickle
+
+import numpy as np
+
+from app.services.index_store import IndexStore
+from app.services.vector_index import VectorIndex
+
+
+def _records(n, file_id):
+    return [{"content": f"{file_id} chunk {i}", "metadata": {"file_id": file_id}} for i in range(n)]
+
+
+def _vectors(n, seed):
+    return np.random.default_rng(seed).normal(size=(n, 1536)).astype("float32")
+
+
+def test_segments_are_replayed_on_load(tmp_path):
+    store = IndexStore(str(tmp_path))
+    store.append_segment(_vectors(3, 0), _records(3, "a"))
+    store.append_segment(_vectors(2, 1), _records(2, "b"))
+
+    index, documents, _ = IndexStore(str(tmp_path)).load()
+    assert index.ntotal == 5
+    assert [doc["metadata"]["file_id"] for doc in documents] == ["a"] * 3 + ["b"] * 2
+
+
+def test_uncommitted_segment_is_discarded(tmp_path):
+    store = IndexStore(str(tmp_path))
+    store.append_segment(_vectors(3, 0), _records(3, "a"))
+    # Simulate a crash after the segment files were written but before the manifest commit
+    np.save(os.path.join(store.segments_path, "seg-000099.npy"), _vectors(1, 2))
+
+    reloaded = IndexStore(str(tmp_path))
+    index, documents, _ = reloaded.load()
+    assert index.ntotal == 3
+    assert len(documents) == 3
+    assert not os.path.exists(os.path.join(store.segments_path, "seg-000099.npy"))
+
+
+def test_compaction_keeps_segments_appended_during_snapshot(tmp_path):
+    store = IndexStore(str(tmp_path))
+    store.append_segment(_vectors(3, 0), _records(3, "a"))
+    index, documents, _ = store.load()
+
+    previous_base = store.manifest["base"]
+    compacted = list(store.manifest["segments"])
+    base = store.new_base_name()
+    store.append_segment(_vectors(2, 1), _records(2, "b"))
+    store.write_base(base, index.serialize(), documents)
+    assert store.commit_base(base, previous_base, compacted)
+    assert store.segment_count == 1
+
+    index, documents, _ = IndexStore(str(tmp_path)).load()
+    assert index.ntotal == 5
+    assert len(documents) == 5
+
+
+def test_legacy_files_are_adopted(tmp_path):
+    legacy_index = VectorIndex(index_type="flat")
+    legacy_index.add(_vectors(4, 0))
+    legacy_index.save(str(tmp_path / "index.faiss"))
+    documents_path = tmp_path / "documents.pkl"
+    documents_path.write_bytes(pickle.dumps(_records(4, "old")))
+
+    index, documents, _ = IndexStore(str(tmp_path), legacy_documents_path=str(documents_path)).load()
+    assert index.ntotal == 4
+    assert len(documents) == 4
+    assert not documents_path.exists()
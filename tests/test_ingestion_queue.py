@@ -0,0 +1,183 @@
+import asyncio
+from datetime import datetime
+from unittest.mock import AsyncMock, MagicMock
+
+from fastapi.testclient import TestClient
+
+from main import app
+from app.database import get_mongo_db
+from app.services.document_processor import document_processor
+from app.services.ingestion_queue import IngestionQueue, ingestion_queue, process_upload
+
+
+def make_db():
+    uploads = MagicMock()
+    uploads.update_one = AsyncMock()
+    db = MagicMock()
+    db.__getitem__ = MagicMock(return_value=uploads)
+    return db, uploads
+
+
+def last_set(uploads):
+    return uploads.update_one.call_args.args[1]["$set"]
+
+
+def test_failed_job_is_requeued_with_backoff_then_failed():
+    handler = AsyncMock(side_effect=RuntimeError("embedding API down"))
+    queue = IngestionQueue(handler, max_attempts=2, backoff_base=10, backoff_max=60)
+    db, uploads = make_db()
+
+    asyncio.run(queue.run_job(db, {"file_id": "f1", "attempts": 1}, "w1"))
+    update = last_set(uploads)
+    assert update["status"] == "queued"
+    assert update["error"] == "embedding API down"
+    delay = (update["next_attempt_at"] - datetime.utcnow()).total_seconds()
+    assert 4 <= delay <= 10
+
+    asyncio.run(queue.run_job(db, {"file_id": "f1", "attempts": 2}, "w1"))
+    assert last_set(uploads)["status"] == "failed"
+    assert (queue.retried, queue.failed, queue.completed) == (1, 1, 0)
+
+
+def test_job_reclaimed_after_last_attempt_is_not_run_again():
+    handler = AsyncMock()
+    queue = IngestionQueue(handler, max_attempts=3)
+    db, uploads = make_db()
+
+    asyncio.run(queue.run_job(db, {"file_id": "f1", "attempts": 4}, "w1"))
+
+    handler.assert_not_called()
+    assert last_set(uploads)["status"] == "failed"
+
+
+def test_workers_claim_jobs_and_record_completion():
+    jobs = [{"file_id": "a", "attempts": 1}, {"file_id": "b", "attempts": 1}]
+    handled = []
+
+    async def handler(job, db):
+        handled.append(job["file_id"])
+
+    queue = IngestionQueue(handler, max_workers=2, poll_seconds=0.01)
+    db, uploads = make_db()
+    uploads.create_index = AsyncMock()
+    uploads.find_one_and_update = AsyncMock(side_effect=lambda *args, **kwargs: jobs.pop(0) if jobs else None)
+    uploads.count_documents = AsyncMock(return_value=0)
+
+    async def run():
+        await queue.start(db)
+        for _ in range(100):
+            if len(handled) == 2:
+                break
+            await asyncio.sleep(0.01)
+        await queue.stop()
+        return await queue.stats(db)
+
+    stats = asyncio.run(run())
+
+    assert sorted(handled) == ["a", "b"]
+    assert stats["completed"] == 2
+    assert stats["jobs_per_minute"] > 0
+    claim_filter = uploads.find_one_and_update.call_args.args[0]
+    assert [clause["status"] for clause in claim_filter["$or"]] == ["queued", "processing", "processing"]
+
+
+def test_clear_requested_by_a_reader_is_run_once_by_the_writer():
+    requests = {}
+
+    async def update_one(query, update, upsert=False):
+        requests[query["_id"]] = dict(update["$set"])
+
+    async def find_one(query):
+        return {"_id": query["_id"], **requests[query["_id"]]} if query["_id"] in requests else None
+
+    async def delete_one(query):
+        if requests.get(query["_id"], {}).get("requested_at") == query["requested_at"]:
+            del requests[query["_id"]]
+
+    collection = MagicMock()
+    collection.update_one = update_one
+    collection.find_one = find_one
+    collection.delete_one = delete_one
+    db = MagicMock()
+    db.__getitem__ = MagicMock(return_value=collection)
+    cleared = AsyncMock()
+    queue = IngestionQueue(AsyncMock(), clear_handler=cleared)
+
+    async def run():
+        assert not await queue.clear_if_requested(db)
+        await queue.request_clear(db)
+        assert await queue.clear_if_requested(db)
+        assert not await queue.clear_if_requested(db)
+
+    asyncio.run(run())
+
+    cleared.assert_awaited_once_with(db)
+    assert requests == {}
+
+
+def test_clear_on_a_read_only_worker_is_forwarded_to_the_writer(monkeypatch):
+    db, _ = make_db()
+    request_clear = AsyncMock()
+    clear_index = MagicMock()
+    monkeypatch.setattr(document_processor, "read_only", True)
+    monkeypatch.setattr(document_processor, "clear_index", clear_index)
+    monkeypatch.setattr(ingestion_queue, "request_clear", request_clear)
+    monkeypatch.setitem(app.dependency_overrides, get_mongo_db, lambda: db)
+
+    response = TestClient(app).post("/admin/clear_index")
+
+    assert response.status_code == 202
+    assert response.json()["status"] == "pending"
+    request_clear.assert_awaited_once_with(db)
+    clear_index.assert_not_called()
+
+
+def matches(doc, query):
+    for field, condition in query.items():
+        value = doc.get(field)
+        if isinstance(condition, dict):
+            if value not in condition["$in"]:
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+def test_reupload_replaces_namespaced_and_legacy_uploads(monkeypatch):
+    stored = [
+        {"file_id": "legacy-old", "filename": "notes.txt", "status": "processed"},
+        {"file_id": "old", "filename": "notes.txt", "status": "processed", "namespace": "user:a@example.com"},
+        {"file_id": "legacy-new", "status": "processed"},
+        {"file_id": "new", "status": "processed", "namespace": "user:a@example.com"},
+    ]
+
+    async def find_one(query, projection=None):
+        return next((doc for doc in stored if matches(doc, query)), None)
+
+    async def find_one_and_update(query, update):
+        doc = await find_one(query)
+        if doc is not None:
+            previous = dict(doc)
+            doc.update(update["$set"])
+            return previous
+        return None
+
+    uploads = MagicMock()
+    uploads.find_one = find_one
+    uploads.find_one_and_update = find_one_and_update
+    db = MagicMock()
+    db.__getitem__ = MagicMock(return_value=uploads)
+    deleted = []
+    monkeypatch.setattr(document_processor, "process_document", AsyncMock())
+    monkeypatch.setattr(document_processor, "delete_document",
+                        lambda file_id, namespace: deleted.append((file_id, namespace)) or 1)
+
+    for file_id, namespace, replaces in [("new", "user:a@example.com", ["old"]),
+                                         ("legacy-new", "default", ["legacy-old"])]:
+        job = {"file_id": file_id, "path": "unused", "filename": "notes.txt", "namespace": namespace,
+               "replaces": replaces}
+        asyncio.run(process_upload(job, db))
+
+    assert stored[0]["status"] == stored[1]["status"] == "replaced"
+    assert stored[0]["replaced_by"] == "legacy-new"
+    assert deleted == [("old", "user:a@example.com"), ("legacy-old", "default")]
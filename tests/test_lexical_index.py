@@ -0,0 +1,70 @@
+import asyncio
+
+import numpy as np
+from langchain.docstore.document import Document
+
+from app.services.document_processor import DocumentProcessor
+from app.services.lexical_index import LexicalIndex, LexicalStore, tokenize
+
+
+def test_identifiers_match_whole_and_by_part():
+    assert tokenize("Order SKU-1042 via rdf:type") == ["order", "sku-1042", "sku", "1042", "via", "rdf:type", "rdf", "type"]
+
+    index = LexicalIndex()
+    index.add([
+        "The warranty covers product SKU-1042 for two years.",
+        "Product SKU-2077 ships without a warranty.",
+        "General notes about products and shipping.",
+    ])
+    assert [row for row, _ in index.search("sku-1042 warranty", 3)] == [0, 1]
+    assert [row for row, _ in index.search("sku-1042 warranty", 3, excluded=np.array([0]))] == [1]
+    assert index.search("nonexistent", 3) == []
+
+
+def test_base_postings_and_tail_score_like_one_index(tmp_path):
+    texts = [f"chunk {i} about topic{i % 3} and shared words" for i in range(20)]
+    LexicalStore.write(str(tmp_path / "lexical"), texts[:15])
+    split = LexicalIndex(LexicalStore(str(tmp_path / "lexical")))
+    split.add(texts[15:])
+    whole = LexicalIndex()
+    whole.add(texts)
+
+    for query in ["topic1 shared", "chunk 17", "words"]:
+        assert split.search(query, 5) == whole.search(query, 5)
+
+
+def test_hybrid_search_fuses_and_falls_back_to_lexical(tmp_path, monkeypatch):
+    processor = DocumentProcessor(str(tmp_path / "faiss_index"), str(tmp_path / "documents.pkl"))
+    dimension = processor.partitions["default"].index.d
+    texts = ["Error code E-4711 means the pump is dry.", "Refill the pump reservoir weekly.", "Unrelated text."]
+    vectors = {text: np.eye(dimension)[i] for i, text in enumerate(texts)}
+    vectors["what does E-4711 mean"] = np.eye(dimension)[1]
+    docs = [Document(page_content=text, metadata={"file_id": "f", "filename": "manual.txt"}) for text in texts]
+    processor._add_to_index(docs, [vectors[text].tolist() for text in texts])
+
+    async def fake_embed(texts, urgent=False):
+        return [vectors[text].tolist() for text in texts]
+
+    monkeypatch.setattr(processor, "_generate_embeddings_async", fake_embed)
+    query = "what does E-4711 mean"
+    vector = asyncio.run(processor.search_similar_documents(query, 1, mode="vector"))
+    hybrid = asyncio.run(processor.search_similar_documents(query, 2, mode="hybrid"))
+    assert vector[0]["content"] == texts[1]
+    assert {r["content"] for r in hybrid} == {texts[0], texts[1]}
+    # similarity_score stays the L2 distance in every mode; score is the mode's own
+    assert vector[0]["score_kind"] == "l2_distance"
+    assert vector[0]["similarity_score"] == vector[0]["score"] == 0.0
+    assert [r["score_kind"] for r in hybrid] == ["rrf", "rrf"]
+    assert {r["content"]: r["similarity_score"] for r in hybrid}[texts[1]] == 0.0
+    assert hybrid[0]["score"] > 0
+
+    async def unavailable(texts, urgent=False):
+        raise ConnectionError("embeddings API down")
+
+    monkeypatch.setattr(processor, "_generate_embeddings_async", unavailable)
+    processor.query_embedding_cache.clear()
+    fallback = asyncio.run(processor.search_similar_documents("pump E-4711", 1, mode="hybrid"))
+    lexical = asyncio.run(processor.search_similar_documents("pump E-4711", 1, mode="lexical"))
+    assert [r["content"] for r in fallback] == [r["content"] for r in lexical] == [texts[0]]
+    assert lexical[0]["score_kind"] == "bm25"
+    assert lexical[0]["similarity_score"] is None
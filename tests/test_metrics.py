@@ -0,0 +1,75 @@
+import queue
+import threading
+
+from fastapi.testclient import TestClient
+
+from main import app
+from app.api.v1.endpoints.auth import create_access_token
+from app.database import get_mongo_db
+from app.services.extraction import stream_chunks
+from app.services.metrics import MetricsRegistry, chat_stage_seconds, chat_turn_seconds
+from app import websocket as websocket_module
+from tests.test_websocket import TEST_EMAIL, get_mock_mongo_db
+
+
+def test_histograms_and_gauges_render_in_prometheus_text_format():
+    registry = MetricsRegistry()
+    latency = registry.histogram("stage_seconds", "Stage latency", ["stage"], buckets=[0.1, 1.0])
+    latency.observe(0.05, stage="embed")
+    latency.observe(0.5, stage="embed")
+    latency.observe(5.0, stage="embed")
+    registry.gauge("queue_depth", "Waiting work", lambda: {("llm",): 3}, ["queue"])
+    registry.gauge("broken", "Fails to collect", lambda: 1 / 0)
+
+    lines = registry.render().splitlines()
+    assert "# TYPE stage_seconds histogram" in lines
+    assert 'stage_seconds_bucket{stage="embed",le="0.1"} 1' in lines
+    assert 'stage_seconds_bucket{stage="embed",le="1"} 2' in lines
+    assert 'stage_seconds_bucket{stage="embed",le="+Inf"} 3' in lines
+    assert 'stage_seconds_sum{stage="embed"} 5.55' in lines
+    assert 'stage_seconds_count{stage="embed"} 3' in lines
+    assert 'queue_depth{queue="llm"} 3' in lines
+    # A failing collector is left out instead of breaking the scrape
+    assert not any(line.startswith("broken") for line in lines)
+
+
+def test_timed_extraction_reports_extract_and_split_seconds(tmp_path):
+    path = tmp_path / "doc.txt"
+    path.write_text("\n\n".join(f"Paragraph {i} " + "lorem ipsum " * 40 for i in range(300)), encoding="utf-8")
+    batches = queue.Queue()
+
+    stream_chunks(batches, threading.Event(), str(path), 1000, 200, 20000, 64, True)
+
+    items = [batches.get_nowait() for _ in range(batches.qsize())]
+    assert len(items) > 1
+    for chunks, text_length, timings in items:
+        assert set(timings) == {"extract", "split"}
+        assert all(seconds >= 0 for seconds in timings.values())
+
+
+def test_chat_turn_stages_are_exposed_on_metrics_endpoint(monkeypatch):
+    async def fake_stream(message, chat_history=None, use_rag=True, k_documents=5, namespace="default", search_filter=None):
+        yield {"type": "delta", "content": "Hi"}
+        yield {"type": "final", "response": "Hi", "sources": [], "context_used": False, "model": "fake"}
+
+    monkeypatch.setattr(websocket_module.llm_service, "generate_response_stream", fake_stream)
+    monkeypatch.setitem(app.dependency_overrides, get_mongo_db, get_mock_mongo_db)
+    client = TestClient(app)
+    turns = chat_turn_seconds.count(stream="true")
+    stored = chat_stage_seconds.count(stage="store_answer")
+
+    with client.websocket_connect(f"/ws/chat?token={create_access_token({'sub': TEST_EMAIL})}") as ws:
+        ws.send_json({"message": "hello", "stream": True})
+        ws.receive_json()
+        ws.receive_json()
+        assert ws.receive_json()["type"] == "final"
+
+    assert chat_turn_seconds.count(stream="true") == turns + 1
+    assert chat_stage_seconds.count(stage="store_answer") == stored + 1
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert 'chat_turn_stage_seconds_count{stage="rag_decision"}' in response.text
+    assert 'chat_turn_seconds_count{stream="true"}' in response.text
+    assert "websocket_connections" in response.text
+    assert 'executor_queue_depth{executor="llm"}' in response.text
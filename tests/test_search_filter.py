@@ -0,0 +1,67 @@
+import asyncio
+from datetime import datetime
+
+import numpy as np
+import pytest
+from langchain.docstore.document import Document
+
+from app.services.document_processor import DocumentProcessor
+from app.services.search_filter import SearchFilter
+
+
+def test_filter_parsing_and_matching():
+    search_filter = SearchFilter.from_dict({"filename": "Report-*.PDF", "uploaded_after": "2024-03-01T00:00:00Z"})
+    assert SearchFilter.from_dict({}) is None
+    assert search_filter.matches({"filename": "report-q1.pdf", "uploaded_at": "2024-03-02T10:00:00"})
+    assert not search_filter.matches({"filename": "report-q1.pdf", "uploaded_at": "2024-02-02T10:00:00"})
+    assert not search_filter.matches({"filename": "report-q1.pdf"})
+    assert not search_filter.matches({"filename": "notes.pdf", "uploaded_at": "2024-03-02T10:00:00"})
+    with pytest.raises(ValueError):
+        SearchFilter.from_dict({"uploaded_before": "yesterday"})
+
+
+def test_date_bounds_with_an_offset_are_converted_to_utc():
+    # 10:00 at +02:00 is 08:00 UTC; uploaded_at is stored as naive UTC
+    search_filter = SearchFilter.from_dict({"uploaded_after": "2024-01-01T10:00:00+02:00"})
+    assert search_filter.uploaded_after == datetime(2024, 1, 1, 8, 0)
+    assert search_filter.matches({"filename": "a.txt", "uploaded_at": "2024-01-01T09:00:00"})
+    assert not search_filter.matches({"filename": "a.txt", "uploaded_at": "2024-01-01T07:59:00"})
+    before = SearchFilter.from_dict({"uploaded_before": "2024-01-01T01:00:00-05:00"})
+    assert before.uploaded_before == datetime(2024, 1, 1, 6, 0)
+
+
+@pytest.mark.parametrize("exact_max_rows", [1000, 0])
+def test_filtered_search_only_returns_matching_files(tmp_path, monkeypatch, exact_max_rows):
+    # 1000 scans the allowed rows exactly; 0 pushes an ID selector into the FAISS search
+    monkeypatch.setattr("app.services.vector_index.settings.SEARCH_FILTER_EXACT_MAX_ROWS", exact_max_rows)
+    processor = DocumentProcessor(str(tmp_path / "faiss_index"), str(tmp_path / "documents.pkl"))
+    dimension = processor.partitions["default"].index.d
+    rng = np.random.default_rng(0)
+    vectors = {}
+    for file_number in range(5):
+        texts = [f"file {file_number} chunk {i} pump manual" for i in range(20)]
+        for text in texts:
+            vectors[text] = rng.normal(size=dimension)
+        docs = [Document(page_content=text, metadata={
+            "file_id": f"f{file_number}", "filename": f"manual-{file_number}.txt",
+            "uploaded_at": datetime(2024, 1, 1 + file_number).isoformat()
+        }) for text in texts]
+        processor._add_to_index(docs, [vectors[text].tolist() for text in texts])
+    vectors["pump"] = rng.normal(size=dimension)
+
+    async def fake_embed(texts, urgent=False):
+        return [vectors[text].tolist() for text in texts]
+
+    monkeypatch.setattr(processor, "_generate_embeddings_async", fake_embed)
+    processor.delete_document("f3")
+
+    def search(mode, **filter_fields):
+        search_filter = SearchFilter.from_dict(filter_fields)
+        results = asyncio.run(processor.search_similar_documents("pump", 10, mode=mode, search_filter=search_filter))
+        return {r["metadata"]["file_id"] for r in results}, len(results)
+
+    for mode in ["vector", "lexical", "hybrid"]:
+        assert search(mode, file_ids=["f1"]) == ({"f1"}, 10)
+        assert search(mode, filename="manual-[24].txt", uploaded_after="2024-01-04") == ({"f4"}, 10)
+        # Deleted files stay out of filtered searches
+        assert search(mode, file_ids=["f3"]) == (set(), 0)
@@ -0,0 +1,181 @@
+import hashlib
+
+import pytest
+from fastapi.testclient import TestClient
+from unittest.mock import AsyncMock, MagicMock
+from main import app
+from app.database import get_mongo_db
+from app.api.v1.endpoints import upload as upload_module
+from app.api.v1.endpoints.auth import create_access_token
+from app.services.document_processor import document_processor
+
+
+def auth_headers(email="uploader@example.com"):
+    return {"Authorization": f"Bearer {create_access_token({'sub': email})}"}
+
+
+@pytest.fixture
+def uploads(tmp_path, monkeypatch):
+    stored = []
+
+    async def find_one(query):
+        for doc in stored:
+            if "file_id" in query:
+                # Status lookups
+                if doc["file_id"] == query["file_id"] and doc["namespace"] == query["namespace"]:
+                    return doc
+            elif (doc.get("content_hash") == query.get("content_hash") and doc["namespace"] == query["namespace"]
+                    and doc["status"] in query["status"]["$in"]):
+                return doc
+        return None
+
+    async def insert_one(doc):
+        stored.append(doc)
+
+    def find(query, projection=None):
+        matches = [doc for doc in stored if doc["namespace"] == query["namespace"]
+                   and doc["filename"] == query["filename"] and doc["status"] in query["status"]["$in"]]
+        cursor = MagicMock()
+        cursor.to_list = AsyncMock(return_value=matches)
+        return cursor
+
+    async def find_one_and_update(query, update):
+        for doc in stored:
+            if (doc["file_id"] == query["file_id"] and doc["namespace"] == query["namespace"]
+                    and doc["status"] != query["status"]["$ne"]):
+                previous = dict(doc)
+                doc.update(update["$set"])
+                return previous
+        return None
+
+    async def update_many(query, update):
+        matches = [doc for doc in stored if doc["status"] == query["status"]]
+        for doc in matches:
+            doc.update(update["$set"])
+            for field in update.get("$unset", {}):
+                doc.pop(field, None)
+        return MagicMock(modified_count=len(matches))
+
+    collection = MagicMock()
+    collection.find_one = find_one
+    collection.update_many = update_many
+    collection.find = find
+    collection.insert_one = insert_one
+    collection.find_one_and_update = find_one_and_update
+    collection.update_one = AsyncMock()
+    mock_db = MagicMock()
+    mock_db.__getitem__ = MagicMock(return_value=collection)
+
+    monkeypatch.setattr(upload_module, "UPLOAD_DIR", str(tmp_path))
+    monkeypatch.setattr(upload_module.settings, "UPLOAD_CHUNK_BYTES", 1024)
+    # These tests cover per-user partitions, which are opt-in
+    monkeypatch.setattr(upload_module.settings, "INDEX_PARTITION_BY", "user")
+    previous = app.dependency_overrides.get(get_mongo_db)
+    app.dependency_overrides[get_mongo_db] = lambda: mock_db
+    yield stored
+    if previous is None:
+        app.dependency_overrides.pop(get_mongo_db, None)
+    else:
+        app.dependency_overrides[get_mongo_db] = previous
+
+
+def test_upload_is_hashed_and_duplicates_are_short_circuited(uploads, tmp_path):
+    client = TestClient(app)
+    content = b"knowledge base " * 1000
+
+    first = client.post("/api/v1/upload/", files={"file": ("notes.txt", content, "text/plain")}, headers=auth_headers())
+    assert first.status_code == 200
+    assert first.json()["duplicate"] is False
+    assert uploads[0]["content_hash"] == hashlib.sha256(content).hexdigest()
+    assert uploads[0]["size"] == len(content)
+
+    second = client.post("/api/v1/upload/", files={"file": ("copy.txt", content, "text/plain")}, headers=auth_headers())
+    assert second.status_code == 200
+    assert second.json()["duplicate"] is True
+    assert second.json()["file_id"] == first.json()["file_id"]
+    assert len(uploads) == 1
+    assert [p.name for p in tmp_path.iterdir()] == [f"{first.json()['file_id']}_notes.txt"]
+    assert uploads[0]["namespace"] == "user:uploader@example.com"
+
+    # The same content from another tenant is its own upload
+    other = client.post("/api/v1/upload/", files={"file": ("notes.txt", content, "text/plain")},
+                        headers=auth_headers("other@example.com"))
+    assert other.json()["duplicate"] is False
+    assert len(uploads) == 2
+
+
+def test_upload_requires_token_when_partitioned(uploads):
+    client = TestClient(app)
+
+    response = client.post("/api/v1/upload/", files={"file": ("notes.txt", b"text", "text/plain")})
+
+    assert response.status_code == 401
+
+
+def test_oversized_upload_is_rejected_while_streaming(uploads, tmp_path, monkeypatch):
+    monkeypatch.setattr(upload_module.settings, "UPLOAD_MAX_BYTES", 4096)
+    client = TestClient(app)
+
+    response = client.post("/api/v1/upload/", files={"file": ("big.txt", b"x" * 10000, "text/plain")},
+                           headers=auth_headers())
+
+    assert response.status_code == 413
+    assert uploads == []
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_reupload_replaces_and_delete_removes_the_file(uploads, tmp_path, monkeypatch):
+    deleted = []
+    monkeypatch.setattr(upload_module.document_processor, "delete_document",
+                        lambda file_id, namespace: deleted.append((file_id, namespace)) or 3)
+    client = TestClient(app)
+
+    first = client.post("/api/v1/upload/", files={"file": ("notes.txt", b"version one", "text/plain")},
+                        headers=auth_headers()).json()
+    second = client.post("/api/v1/upload/", files={"file": ("notes.txt", b"version two", "text/plain")},
+                         headers=auth_headers()).json()
+    assert second["replaces"] == [first["file_id"]]
+
+    # Another tenant cannot delete it
+    other = client.delete(f"/api/v1/upload/{second['file_id']}", headers=auth_headers("other@example.com"))
+    assert other.status_code == 404
+
+    response = client.delete(f"/api/v1/upload/{second['file_id']}", headers=auth_headers())
+    assert response.status_code == 200
+    assert response.json() == {"file_id": second["file_id"], "status": "deleted", "chunks_removed": 3}
+    assert deleted == [(second["file_id"], "user:uploader@example.com")]
+    assert uploads[1]["status"] == "deleted"
+    assert [p.name for p in tmp_path.iterdir()] == [f"{first['file_id']}_notes.txt"]
+
+    assert client.delete(f"/api/v1/upload/{second['file_id']}", headers=auth_headers()).status_code == 404
+
+
+def test_status_is_only_visible_to_the_uploading_tenant(uploads):
+    client = TestClient(app)
+    file_id = client.post("/api/v1/upload/", files={"file": ("notes.txt", b"private", "text/plain")},
+                          headers=auth_headers()).json()["file_id"]
+
+    own = client.get(f"/api/v1/upload/status/{file_id}", headers=auth_headers())
+    assert own.status_code == 200
+    assert own.json()["status"] == "queued"
+    assert client.get(f"/api/v1/upload/status/{file_id}", headers=auth_headers("other@example.com")).status_code == 404
+    assert client.get(f"/api/v1/upload/status/{file_id}").status_code == 401
+
+
+def test_content_is_indexed_again_after_the_index_is_cleared(uploads, monkeypatch):
+    cleared = []
+    monkeypatch.setattr(document_processor, "read_only", False)
+    monkeypatch.setattr(document_processor, "clear_index", lambda: cleared.append(True))
+    client = TestClient(app)
+    content = b"knowledge base " * 100
+
+    first = client.post("/api/v1/upload/", files={"file": ("notes.txt", content, "text/plain")}, headers=auth_headers())
+    uploads[0]["status"] = "processed"
+    assert client.post("/admin/clear_index").status_code == 200
+    assert cleared == [True]
+    assert uploads[0]["status"] == "cleared"
+
+    again = client.post("/api/v1/upload/", files={"file": ("notes.txt", content, "text/plain")}, headers=auth_headers())
+    assert again.json()["duplicate"] is False
+    assert again.json()["file_id"] != first.json()["file_id"]
+    assert len(uploads) == 2
@@ -0,0 +1,65 @@
+import faiss
+import numpy as np
+import pytest
+
+from app.services import vector_index
+from app.services.vector_index import VectorIndex
+
+
+@pytest.fixture
+def vectors():
+    rng = np.random.default_rng(0)
+    return rng.normal(size=(400, 16)).astype("float32")
+
+
+def test_ivf_trains_once_enough_vectors(monkeypatch, vectors):
+    monkeypatch.setattr(vector_index.settings, "FAISS_IVF_NLIST", 4)
+    monkeypatch.setattr(vector_index.settings, "FAISS_IVF_MIN_TRAIN_SIZE", 200)
+    index = VectorIndex(dimension=16, index_type="ivf_flat")
+
+    index.add(vectors[:100])
+    assert index.training_pending
+    assert index.kind == "flat"
+
+    index.add(vectors[100:])
+    assert not index.training_pending
+    assert isinstance(index.index, faiss.IndexIVFFlat)
+    assert index.ntotal == 400
+    _, ids = index.search(vectors[:1], 1)
+    assert ids[0][0] == 0
+
+
+def test_migrate_flat_index_to_hnsw(tmp_path, vectors):
+    flat = VectorIndex(dimension=16, index_type="flat")
+    flat.add(vectors)
+    path = str(tmp_path / "index.faiss")
+    flat.save(path)
+
+    loaded = VectorIndex.load(path, index_type="hnsw")
+    assert loaded.kind == "flat"
+    assert loaded.migrate()
+    assert loaded.kind == "hnsw"
+    assert loaded.ntotal == 400
+    _, ids = loaded.search(vectors[10:11], 1)
+    assert ids[0][0] == 10
+    assert not loaded.migrate()
+
+
+@pytest.mark.parametrize("index_type", ["flat", "ivf_flat", "hnsw"])
+@pytest.mark.parametrize("compression", ["fp16", "sq8", "pq"])
+def test_compressed_index_reranks_at_full_precision(monkeypatch, vectors, index_type, compression):
+    monkeypatch.setattr(vector_index.settings, "FAISS_IVF_NLIST", 4)
+    monkeypatch.setattr(vector_index.settings, "FAISS_IVF_MIN_TRAIN_SIZE", 300)
+    monkeypatch.setattr(vector_index.settings, "FAISS_PQ_M", 4)
+    index = VectorIndex(dimension=16, index_type=index_type, compression=compression)
+    index.add(vectors)
+    assert (index.kind, index.compression_kind) == (index_type, compression)
+    assert index.stats()["bytes_per_vector"] < 16 * 4
+
+    queries = vectors[:50] + 0.05 * np.random.default_rng(1).normal(size=(50, 16)).astype("float32")
+    distances, labels = index.search(queries, 3)
+    _, truth = faiss.knn(queries, vectors, 3)
+    assert (labels[:, 0] == truth[:, 0]).mean() >= 0.9
+    # Returned distances are the exact ones, not the compressed estimates
+    exact = np.sum((vectors[labels] - queries[:, None, :]) ** 2, axis=2)
+    np.testing.assert_allclose(distances, exact, rtol=1e-4)
@@ -0,0 +1,127 @@
+import pytest
+from fastapi.testclient import TestClient
+from unittest.mock import AsyncMock, MagicMock
+from main import app
+from app.database import get_mongo_db
+from app.api.v1.endpoints.auth import create_access_token
+from app import websocket as websocket_module
+
+TEST_EMAIL = "chatuser@example.com"
+
+
+def get_mock_mongo_db():
+    mock_db = MagicMock()
+    collections = {}
+
+    def get_collection(name):
+        if name not in collections:
+            collection = MagicMock()
+            if name == "users":
+                collection.find_one = AsyncMock(return_value={"_id": "user-1", "email": TEST_EMAIL})
+            else:
+                collection.find_one = AsyncMock(return_value={"messages": []})
+            collection.update_one = AsyncMock()
+            collection.insert_one = AsyncMock()
+            collection.create_index = AsyncMock()
+            cursor = MagicMock()
+            cursor.sort.return_value = cursor
+            cursor.limit.return_value = cursor
+            cursor.to_list = AsyncMock(return_value=[])
+            collection.find = MagicMock(return_value=cursor)
+            collections[name] = collection
+        return collections[name]
+
+    mock_db.__getitem__ = MagicMock(side_effect=get_collection)
+    return mock_db
+
+
+@pytest.fixture
+def client():
+    previous = app.dependency_overrides.get(get_mongo_db)
+    app.dependency_overrides[get_mongo_db] = get_mock_mongo_db
+    yield TestClient(app)
+    if previous is None:
+        app.dependency_overrides.pop(get_mongo_db, None)
+    else:
+        app.dependency_overrides[get_mongo_db] = previous
+
+
+def test_streamed_answer_sends_deltas_then_final(client, monkeypatch):
+    async def fake_stream(message, chat_history=None, use_rag=True, k_documents=5, namespace="default", search_filter=None):
+        for token in ["Hel", "lo"]:
+            yield {"type": "delta", "content": token}
+        yield {"type": "final", "response": "Hello", "sources": [], "context_used": False, "model": "fake"}
+
+    monkeypatch.setattr(websocket_module.llm_service, "generate_response_stream", fake_stream)
+    token = create_access_token({"sub": TEST_EMAIL})
+
+    with client.websocket_connect(f"/ws/chat?token={token}") as ws:
+        ws.send_json({"message": "hi", "stream": True})
+        assert ws.receive_json()["message"] == "hi"
+        assert ws.receive_json() == {"type": "delta", "sender": "assistant", "delta": "Hel"}
+        assert ws.receive_json()["delta"] == "lo"
+        final = ws.receive_json()
+        assert final["type"] == "final"
+        assert final["message"] == "Hello"
+        assert final["llm_metadata"]["model"] == "fake"
+
+
+def test_busy_llm_sends_busy_frame(client, monkeypatch):
+    async def busy_response(message, chat_history=None, use_rag=True, k_documents=5, namespace="default", search_filter=None):
+        raise websocket_module.ServiceBusyError("llm queue is full")
+
+    monkeypatch.setattr(websocket_module.llm_service, "generate_response", busy_response)
+    token = create_access_token({"sub": TEST_EMAIL})
+
+    with client.websocket_connect(f"/ws/chat?token={token}") as ws:
+        ws.send_json({"message": "hi"})
+        assert ws.receive_json()["message"] == "hi"
+        busy = ws.receive_json()
+        assert busy["type"] == "busy"
+        assert busy["sender"] == "assistant"
+
+
+def test_filter_in_payload_scopes_the_search(client, monkeypatch):
+    received = {}
+
+    async def fake_response(message, chat_history=None, use_rag=True, k_documents=5, namespace="default", search_filter=None):
+        received.update(use_rag=use_rag, search_filter=search_filter)
+        return {"response": "From the manual", "sources": [], "context_used": False, "model": "fake"}
+
+    monkeypatch.setattr(websocket_module.llm_service, "generate_response", fake_response)
+    token = create_access_token({"sub": TEST_EMAIL})
+
+    with client.websocket_connect(f"/ws/chat?token={token}") as ws:
+        ws.send_json({"message": "ok", "filter": {"file_ids": ["f-1"], "filename": "*.pdf"}})
+        assert ws.receive_json()["message"] == "ok"
+        assert ws.receive_json()["message"].startswith("From the manual")
+        ws.send_json({"message": "ok", "filter": {"uploaded_after": "last week"}})
+        error = ws.receive_json()
+        assert error["type"] == "error"
+
+    assert received["use_rag"] is True
+    assert received["search_filter"].file_ids == frozenset({"f-1"})
+    assert received["search_filter"].filename == "*.pdf"
+
+
+def test_prompt_contains_the_current_question_once(client, monkeypatch):
+    prompts = []
+
+    async def fake_response(message, chat_history=None, use_rag=True, k_documents=5, namespace="default", search_filter=None):
+        messages, _, _, _ = websocket_module.llm_service._build_messages(message, chat_history, [])
+        prompts.append([m.content for m in messages[1:]])
+        return {"response": "Sure", "sources": [], "context_used": False, "model": "fake"}
+
+    monkeypatch.setattr(websocket_module.llm_service, "generate_response", fake_response)
+    token = create_access_token({"sub": TEST_EMAIL})
+
+    with client.websocket_connect(f"/ws/chat?token={token}") as ws:
+        for question in ["What toppings are there?", "Which one is vegan?"]:
+            ws.send_json({"message": question})
+            assert ws.receive_json()["message"] == question
+            ws.receive_json()
+
+    assert prompts[0] == ["What toppings are there?"]
+    assert prompts[1].count("Which one is vegan?") == 1
+    assert prompts[1][-1] == "Which one is vegan?"
+    assert prompts[1].count("What toppings are there?") == 1